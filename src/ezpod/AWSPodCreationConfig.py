@@ -1,11 +1,18 @@
+import json
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from typing import ClassVar
 
 from pydantic import BaseModel
 from typing_extensions import Self
 
-from ezpod.BasePodCreationConfig import BasePodCreationConfig, boto3
+from ezpod.backend_aws_env_var import aws_regions
+from ezpod.BasePodCreationConfig import (
+    CREATE_CONCURRENCY,
+    BasePodCreationConfig,
+)
+from ezpod.shell_state import AWS_PROFILE_EXT
 
 
 class EbsBlockDevice(BaseModel):
@@ -23,6 +30,17 @@ class AWSBlockDeviceMapping(BaseModel):
     VirtualName: str | None = None
 
 
+class AWSRegionConfig(BaseModel):
+    """Launch settings for one region. AMIs, key pairs, security groups and
+    subnets are regional, so they can be set per region; unset fields fall
+    back to the profile's."""
+
+    ami_id: str | None = None
+    key_name: str | None = None
+    security_group_ids: list[str] | None = None
+    subnet_id: str | None = None
+
+
 class AWSPodCreationConfig(BasePodCreationConfig):
     """Configuration for launching an AWS EC2 instance.
 
@@ -31,7 +49,7 @@ class AWSPodCreationConfig(BasePodCreationConfig):
     environment tweaks.
     """
 
-    config_ext: ClassVar[str] = "ec2.json"
+    config_ext: ClassVar[str] = AWS_PROFILE_EXT
     # General EC2 parameters
     region: str | None = os.environ.get("EZPOD_AWS_REGION", "us-west-2")
     ami_id: str = os.environ.get(
@@ -47,26 +65,22 @@ class AWSPodCreationConfig(BasePodCreationConfig):
     subnet_id: str | None = os.environ.get("EZPOD_AWS_SUBNET_ID", None)
     volume_size: int = int(os.environ.get("EZPOD_AWS_VOLUME_SIZE", 100))  # GiB
     iam_instance_profile: str | None = os.environ.get("EZPOD_AWS_IAM_PROFILE", None)
+    # region name -> settings for launching there
+    region_overrides: dict[str, AWSRegionConfig] = {}
 
     def _client(self):
-        if boto3 is None:
+        from ezpod.ec2_data import ec2_client
+
+        client = ec2_client(self.region)
+        if client is None:
             raise ImportError(
                 "boto3 is required for AWS support. Please `pip install boto3` or add it to requirements.txt."
             )
-        return boto3.client("ec2", region_name=self.region)
+        return client
 
     def _create_impl(self, name: str):  # type: ignore[override]
         """Create an EC2 instance and tag it so that ezpod can identify it later."""
 
-        ec2 = self._client()
-        block_device_mappings = AWSBlockDeviceMapping(
-            DeviceName="/dev/sda1",
-            Ebs=EbsBlockDevice(
-                DeleteOnTermination=True,
-                VolumeSize=self.volume_size,
-                VolumeType="gp3",
-            ),
-        )
         # block_device_mappings = [
         #     {
         #         "DeviceName": "/dev/sda1",
@@ -111,26 +125,102 @@ class AWSPodCreationConfig(BasePodCreationConfig):
         # print(f"Created instance {instance_id}")
         # return instance_id
 
-        region_arg = f"--region {self.region}" if self.region else ""
-        subnet_arg = f"--subnet-id {self.subnet_id}" if self.subnet_id else ""
-
-        cmd = f"""aws ec2 run-instances \
-    --image-id {self.ami_id} \
-    --instance-type {self.instance_type} \
-    --key-name {self.key_name} \
-    --security-group-ids {','.join(self.security_group_ids)} \
-    --count 1 \
-    --tag-specifications 'ResourceType=instance,Tags=[{{Key=Name,Value={name}}}]' \
-    {subnet_arg} \
-    {region_arg} \
-    --block-device-mappings '{str(block_device_mappings.model_dump_json(exclude_none=True)).replace("'", '"')}'
-    """
-        print(cmd)
-        r = subprocess.run(cmd, shell=True)
-        # print(r.stdout.decode("utf-8"))
-        if r.stderr:
-            raise Exception(r.stderr.decode("utf-8"))
-        return r
+        return self.create_many([name])[0]
+
+    def _region_args(self) -> list[str]:
+        return ["--region", self.region] if self.region else []
+
+    def launch_regions(self) -> list[str | None]:
+        """The regions to launch in, in order of preference: the ones ezpod
+        lists (see aws_regions), with ``region`` standing in for the default."""
+        return [region or self.region for region in aws_regions()]
+
+    def in_region(self, region: str | None) -> Self:
+        """This config for launching in ``region``, its overrides applied."""
+        override = self.region_overrides.get(region or "", AWSRegionConfig())
+        update = override.model_dump(exclude_none=True)
+        return self.model_copy(update={**update, "region": region})
+
+    def _run_instance(self, name: str) -> subprocess.CompletedProcess:
+        """Launch one instance, tagged EzPod=true and named ``name`` at launch,
+        so it is never listed without its name."""
+        block_device_mappings = AWSBlockDeviceMapping(
+            DeviceName="/dev/sda1",
+            Ebs=EbsBlockDevice(
+                DeleteOnTermination=True,
+                VolumeSize=self.volume_size,
+                VolumeType="gp3",
+            ),
+        )
+        tags = f"{{Key=EzPod,Value=true}},{{Key=Name,Value={name}}}"
+        cmd = (
+            ["aws", "ec2", "run-instances"]
+            + ["--image-id", self.ami_id]
+            + ["--instance-type", self.instance_type]
+            + ["--key-name", self.key_name]
+            + ["--security-group-ids", *self.security_group_ids]
+            + ["--count", "1"]
+            + ["--tag-specifications", f"ResourceType=instance,Tags=[{tags}]"]
+            + (["--subnet-id", self.subnet_id] if self.subnet_id else [])
+            + (
+                ["--iam-instance-profile", f"Name={self.iam_instance_profile}"]
+                if self.iam_instance_profile
+                else []
+            )
+            + self._region_args()
+            + [
+                "--block-device-mappings",
+                f"[{block_device_mappings.model_dump_json(exclude_none=True)}]",
+            ]
+            + ["--output", "json"]
+        )
+        return subprocess.run(cmd, capture_output=True)
+
+    def _launch(self, name: str) -> str:
+        """Launch the instance ``name`` in this config's region, returning its
+        id."""
+        r = self._run_instance(name)
+        if r.returncode != 0:
+            raise Exception(r.stderr.decode("utf-8").strip())
+        return json.loads(r.stdout)["Instances"][0]["InstanceId"]
+
+    def create_many(self, names: list[str]) -> list[str | None]:
+        """Launch an instance per name, CREATE_CONCURRENCY at a time. Tags are
+        the same for every instance of a run-instances call, so each instance
+        gets its own call and is named at launch. Goes through launch_regions
+        in order: the names a region has no capacity for (or fails to launch)
+        spill over into the next one. Returns the instance ids in the order of
+        ``names`` (None for the names no region launched)."""
+        ids: list[str | None] = [None] * len(names)
+        errors = []
+        for region in self.launch_regions():
+            todo = [i for i, instance_id in enumerate(ids) if instance_id is None]
+            if not todo:
+                break
+            config = self.in_region(region)
+
+            def launch(i: int) -> tuple[str | None, Exception | None]:
+                try:
+                    return config._launch(names[i]), None
+                except Exception as e:
+                    return None, e
+
+            launched = []
+            with ThreadPoolExecutor(max(1, CREATE_CONCURRENCY)) as pool:
+                # printed from here, since lines printed from the threads interleave
+                for i, (instance_id, error) in zip(todo, pool.map(launch, todo)):
+                    if error is not None:
+                        print(f"{region}: error launching {names[i]}: {error}")
+                        errors.append(error)
+                    ids[i] = instance_id
+                    if instance_id is not None:
+                        launched.append(instance_id)
+            print(
+                f"{region}: launched {len(launched)}/{len(todo)} instances: {' '.join(launched)}"
+            )
+        if names and not any(ids):
+            raise errors[0]
+        return ids
 
     @classmethod
     def interactive_make(cls) -> Self:
@@ -1,17 +1,39 @@
+import os
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 from pydantic import BaseModel
 from typing_extensions import Self
 
 from ezpod.shell_local_data import acct_profiles, current_profile_name
+from ezpod.shell_state import profile_names
 
-# Optional boto3 import – only required when using the AWS backend
-try:
-    import boto3
-except (
-    ModuleNotFoundError
-):  # pragma: no cover – boto3 might not be installed in minimal setups
-    boto3 = None  # type: ignore
+
+def import_boto3():
+    """Import boto3 on first use – it is slow to import and only required when
+    using the AWS backend. Returns None if it is not installed."""
+    try:
+        import boto3
+    except (
+        ModuleNotFoundError
+    ):  # pragma: no cover – boto3 might not be installed in minimal setups
+        return None
+    return boto3
+
+
+# how many provider calls pod creation makes at once
+CREATE_CONCURRENCY = int(os.environ.get("EZPOD_CREATE_CONCURRENCY", 8))
+
+
+def created_pod_id(res) -> str | None:
+    """The pod id from a ``create`` result: either the id itself or the
+    CompletedProcess of a ``runpodctl create pod`` call."""
+    if isinstance(res, str):
+        return res
+    out = str(getattr(res, "stdout", ""))
+    if 'pod "' in out and '" created' in out:
+        return out.split('pod "')[1].split('" created')[0]
+    return None
 
 
 class BasePodCreationConfig(BaseModel, ABC):
@@ -41,6 +63,33 @@ class BasePodCreationConfig(BaseModel, ABC):
 
         return self._create_impl(name)
 
+    def create_many(self, names: list[str]) -> list[str | None]:
+        """Create a pod for each of ``names``, CREATE_CONCURRENCY at a time.
+
+        Returns the new pods' ids in the order of ``names``, None where a pod
+        failed to be created or its id couldn't be determined.  Raises the
+        first error if no pod could be created.  Back-ends with a bulk launch
+        call override this.
+        """
+
+        def create(name: str) -> tuple[str | None, Exception | None]:
+            try:
+                return created_pod_id(self.create(name)), None
+            except Exception as e:
+                return None, e
+
+        ids, errors = [], []
+        with ThreadPoolExecutor(max(1, CREATE_CONCURRENCY)) as pool:
+            # printed from here, since lines printed from the threads interleave
+            for name, (pod_id, error) in zip(names, pool.map(create, names)):
+                if error is not None:
+                    print(f"{name}: error creating pod: {error}")
+                    errors.append(error)
+                ids.append(pod_id)
+        if names and len(errors) == len(names):
+            raise errors[0]
+        return ids
+
     @classmethod
     def from_profile(cls, profile: str | None = None):
         if profile is None:
@@ -53,11 +102,7 @@ class BasePodCreationConfig(BaseModel, ABC):
 
     @classmethod
     def list_profiles(cls) -> list[str]:
-        return [
-            p.name
-            for p in acct_profiles().iterdir()
-            if p.is_file() and p.suffix == cls.config_ext
-        ]
+        return profile_names(cls.config_ext)
 
     def save(self, name):
         path = acct_profiles() / f"{name}.{self.config_ext}"
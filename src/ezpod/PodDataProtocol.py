@@ -55,5 +55,8 @@ class InstanceData(Protocol):
 
     def remove_pod(self): ...
 
+    @classmethod
+    def remove_pods(cls, datas: list[Self]) -> list[str]: ...
+
     @property
     def is_running(self) -> bool: ...
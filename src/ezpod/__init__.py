@@ -1,5 +1,34 @@
-from .runproject import RunFolder, RunProject
-from .pods import Pods
-from .create_pods import PodCreationConfig
-from .pod import Pod
-from .shell_local_data import flexible_login as login
+# Exports are imported on first access (PEP 562), so that importing a
+# submodule such as ezpod.__main__ doesn't pull in asyncssh, boto3, etc.
+from typing import TYPE_CHECKING
+
+_EXPORTS = {
+    "RunFolder": ("ezpod.runproject", "RunFolder"),
+    "RunProject": ("ezpod.runproject", "RunProject"),
+    "Pods": ("ezpod.pods", "Pods"),
+    "PodCreationConfig": ("ezpod.create_pods", "PodCreationConfig"),
+    "Pod": ("ezpod.pod", "Pod"),
+    "login": ("ezpod.shell_state", "flexible_login"),
+}
+
+if TYPE_CHECKING:
+    from .runproject import RunFolder, RunProject
+    from .pods import Pods
+    from .create_pods import PodCreationConfig
+    from .pod import Pod
+    from .shell_state import flexible_login as login
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    module, attr = _EXPORTS[name]
+    value = getattr(importlib.import_module(module), attr)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
@@ -1,74 +1,136 @@
-from collections import UserDict
 import os
-from warnings import warn
+import sys
+from typing import TYPE_CHECKING
 
 import click
 
-from ezpod.create_pods import PodCreationConfig
-from ezpod.pods import Pods
-from ezpod.runproject import RunFolder, RunProject
-from ezpod.shell_local_data import Account
+# Commands import what they need themselves, and the pod inventory is only
+# fetched by commands that use pods, to keep CLI startup fast.
+if TYPE_CHECKING:
+    from ezpod.pods import Pods
 
-pods: Pods = None
+_pods: "Pods | None" = None
+_selection: dict = {}
 GROUP = None
+# answered from a recent inventory snapshot unless --refresh is given
+READ_ONLY_COMMANDS = {"list", "ssh"}
 
 
 @click.group()
 @click.option("--group", default=None)
 @click.option("--i", default="")
 @click.option("--all", is_flag=True)
-def cli(group: str | None, i: str, all: bool):
-    global pods
-    global GROUP
+@click.option("--refresh", is_flag=True, help="Don't use the inventory snapshot.")
+@click.pass_context
+def cli(ctx: click.Context, group: str | None, i: str, all: bool, refresh: bool):
     if all:
         assert not group
         assert not i
+    _selection.update(
+        group=group,
+        i=i,
+        all=all,
+        cached=ctx.invoked_subcommand in READ_ONLY_COMMANDS and not refresh,
+    )
+
+
+def get_pods() -> "Pods":
+    """The pods selected by the group options, listed on first use."""
+    global _pods
+    global GROUP
+    if _pods is not None:
+        return _pods
+    from ezpod.pods import Pods
+
+    group, i, cached = _selection["group"], _selection["i"], _selection["cached"]
+    if _selection["all"]:
         GROUP = None
-        pods = Pods.All()
-        return
+        _pods = Pods.All(cached=cached)
+        return _pods
     if not group:
-        account = Account.load()
-        env_var = os.environ.get("EZPOD_GROUP", None)
-        if account.default_group is not None and env_var is not None:
-            warn("Both EZPOD_GROUP and default_group are set")
-            warn(f"Using EZPOD_GROUP: {env_var}")
-        group = env_var or account.default_group
+        from ezpod.shell_local_data import default_group
+
+        group = default_group()
     GROUP = group
     if group:
-        pods = Pods.All(group=group)
+        pods = Pods.All(group=group, cached=cached)
     else:
-        pods = Pods.All()
+        pods = Pods.All(cached=cached)
     assert pods is not None
-    if not i:
+    _pods = pods.select(i)
+    return _pods
+
+
+def snapshot_rows() -> list[dict] | None:
+    """For read-only commands: the selected pods' rows from a recent inventory
+    snapshot (see ezpod.snapshot), read without importing the backends. None
+    if there is no usable snapshot, so the pods have to be listed."""
+    if not _selection["cached"]:
+        return None
+    from ezpod.snapshot import default_group, load_rows, select_rows
+
+    if _selection["all"]:
+        return load_rows()
+    group = _selection["group"]
+    if not group:
+        found, group = default_group()
+        if not found:
+            return None
+    rows = load_rows(group=group)
+    if rows is None:
+        return None
+    return select_rows(rows, _selection["i"])
+
+
+def forward(command: str, **args):
+    """Hand ``command`` to the daemon for this folder (see ezpod.daemon) if
+    one is running, and exit with its status when it finishes. Returns if no
+    daemon is running, EZPOD_DAEMON=0, or the daemon was started with other
+    EZPOD_* settings."""
+    if os.environ.get("EZPOD_DAEMON", "1") == "0":
         return
-    if "-" in i:
-        s = slice(*[None if n == "" else int(n) for n in i.split("-")])
-        pods = pods[s]  # TODO
-    elif i.isnumeric():
-        pods = pods[int(i)]
-    else:
-        pods = pods[i]
+    from ezpod.daemon import connect, ezpod_environ, request
+
+    sock = connect()
+    if sock is None:
+        return
+    code = request(
+        sock, command, args=args, selection=_selection, environ=ezpod_environ()
+    )
+    if code is not None:
+        sys.exit(code)
+
+
+def daemon_request(command: str, **msg):
+    from ezpod.daemon import connect, request
+
+    sock = connect()
+    if sock is None:
+        raise click.ClickException(
+            "no daemon is running for this folder, start one with `ezpod daemon`"
+        )
+    sys.exit(request(sock, command, **msg))
 
 
 @cli.command()
 def list():
-    assert pods is not None
-    if pods.pods:
-        for pod in pods.pods:
-            print(pod)
+    rows = snapshot_rows()
+    if rows is None:
+        forward("list")
+        rows = [{"line": repr(pod)} for pod in get_pods().pods]
+    if rows:
+        for row in rows:
+            print(row["line"])
     else:
         print("No pods.")
 
 
 @cli.command()
 def purge():
-    assert pods is not None
+    pods = get_pods()
     pods.purge()
 
 
-from ezpod.AWSPodCreationConfig import AWSPodCreationConfig
-
-
 @cli.command()
 @click.argument("s")
 @click.option("--mem", default=None)
@@ -94,8 +156,9 @@ def make(
     until_success: bool,
     ami: str | None,
 ):
-    global pods
-    assert pods is not None
+    from ezpod.AWSPodCreationConfig import AWSPodCreationConfig
+
+    pods = get_pods()
     if mem is not None:
         print("Setting mem to", mem)
         pods.new_pods_config.mem = mem
@@ -133,9 +196,22 @@ def make(
     pods.make_new_pods(int(s))
 
 
-def make_until_success(pods: Pods):
+@cli.command()
+@click.argument("n", type=int)
+@click.option("--run", default=None, help="Command to run on each pod once set up.")
+@click.option("--min-complete", type=int, default=None)
+@click.option("--timeout", type=float, default=None)
+def up(n: int, run: str | None, min_complete: int | None, timeout: float | None):
+    """Make N pods, syncing and setting up each one as soon as it is ready."""
+    pods = get_pods()
+    pods.bring_up(n, run, min_complete=min_complete, timeout=timeout)
+
+
+def make_until_success(pods: "Pods"):
     import time
 
+    from ezpod.pods import Pods
+
     while True:
         pods.make_new_pods(1)
         time.sleep(1)
@@ -148,8 +224,9 @@ def make_until_success(pods: Pods):
 @cli.command()
 @click.argument("s")
 def ex(s):
+    forward("ex", s=s)
     # nonlocal pods
-    assert pods is not None
+    pods = get_pods()
 
     print("ex")
 
@@ -159,8 +236,9 @@ def ex(s):
 @cli.command()
 @click.argument("s")
 def py(s):
+    forward("py", s=s)
     # nonlocal pods
-    assert pods is not None
+    pods = get_pods()
 
     pods.get_alive().runpy(s)
 
@@ -169,8 +247,17 @@ def py(s):
 @click.argument("s")
 @click.option("--user", default=None)
 def ssh(s: str, user: str | None = None):
+    rows = snapshot_rows()
+    if rows is not None:
+        from ezpod.snapshot import sshcmd
+
+        alive = [row for row in rows if row["running"]]
+        row = alive[int(s)] if s.isnumeric() else {r["name"]: r for r in alive}[s]
+        if row["ssh"] is not None:
+            print(sshcmd(row["ssh"], user))
+            return
     # nonlocal pods
-    assert pods is not None
+    pods = get_pods()
     if s.isnumeric():
         pod = pods.get_alive().pods[int(s)]
     else:
@@ -181,20 +268,68 @@ def ssh(s: str, user: str | None = None):
 
 
 @cli.command()
-def sync():
-    # nonlocal pods
-    pods.get_alive().sync()
+@click.option("--force", is_flag=True, help="Sync pods even if already up to date.")
+@click.option("--watch", is_flag=True, help="Keep pushing local changes to pods.")
+@click.option(
+    "--volume", is_flag=True, help="Upload once to the shared network volume."
+)
+def sync(force, watch, volume):
+    forward("sync", force=force, watch=watch, volume=volume)
+    pods = get_pods()
+    if watch:
+        pods.get_alive().watch()
+    else:
+        pods.get_alive().sync(force=force, via_volume=volume)
+
+
+@cli.command()
+@click.option("--detach", is_flag=True, help="Run in the background.")
+@click.option("--stop", is_flag=True, help="Stop the daemon for this folder.")
+def daemon(detach, stop):
+    """Keep pods warm and serve ex/py/sync/list for this folder."""
+    from ezpod.daemon import serve, spawn
+
+    if stop:
+        daemon_request("stop")
+    elif detach:
+        print(f"daemon started, listening on {spawn()}")
+    else:
+        serve()
+
+
+@cli.command()
+def jobs():
+    """List the daemon's jobs."""
+    daemon_request("jobs")
+
+
+@cli.command()
+@click.argument("job")
+def attach(job):
+    """Follow a daemon job's output."""
+    daemon_request("attach", job=job)
+
+
+@cli.command()
+@click.argument("job")
+def cancel(job):
+    """Cancel a daemon job."""
+    daemon_request("cancel", job=job)
 
 
 @cli.command()
-def setup():
+@click.option("--force", is_flag=True, help="Set up pods even if already set up.")
+def setup(force):
+    pods = get_pods()
     pods.get_alive().sync()
-    pods.get_alive().setup()
+    pods.get_alive().setup(force=force)
 
 
 @cli.command()
 @click.argument("name")
 def create_profile(name):
+    from ezpod.create_pods import PodCreationConfig
+
     cfg = PodCreationConfig.interactive_make()
     cfg.save(name)
 
@@ -202,19 +337,23 @@ def create_profile(name):
 @cli.command()
 @click.argument("name")
 def setprofile(name):
-    from .shell_local_data import set_current_profile
+    from ezpod.shell_state import set_current_profile
 
     set_current_profile(name)
 
 
 @cli.command()
 def profiles():
-    print(PodCreationConfig.list_profiles())
+    # lists profile files directly rather than importing the config classes
+    from ezpod.backend_aws_env_var import BACKEND_AWS
+    from ezpod.shell_state import AWS_PROFILE_EXT, profile_names
+
+    print(profile_names(AWS_PROFILE_EXT if BACKEND_AWS else None))
 
 
 @cli.command()
 def create_account():
-    from .shell_local_data import Account
+    from ezpod.shell_local_data import Account
 
     Account.interactive_create()
 
@@ -222,13 +361,14 @@ def create_account():
 @cli.command()
 @click.argument("account")
 def login(account):
-    from .shell_local_data import flexible_login
+    from ezpod.shell_state import flexible_login
 
     flexible_login(account)
 
 
 @cli.command()
 def print_create_config():
+    from ezpod.create_pods import PodCreationConfig
 
     print(PodCreationConfig.from_profile())
 
@@ -0,0 +1,180 @@
+"""Controller side of the optional on-pod agent (see ``remote_agent.py``).
+
+Normally every command is sent over a fresh SSH exec that sources the pod's
+environment file and (re)activates the venv before running.  With
+``RunProject.use_agent`` the agent is deployed once per pod, started with the
+environment already loaded, and then runs every command sent to it over one
+long-lived SSH channel, streaming output back as it is produced.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import itertools
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import asyncssh
+
+from ezpod.ssh_pool import POOL
+
+if TYPE_CHECKING:
+    from ezpod.pod import Pod, PodOutput
+
+AGENT_SOURCE = (Path(__file__).parent / "remote_agent.py").read_text()
+# Versioned by content, so an updated agent gets redeployed automatically.
+AGENT_PATH = (
+    f"$HOME/.ezpod/agent_{hashlib.sha1(AGENT_SOURCE.encode()).hexdigest()[:12]}.py"
+)
+AGENT_SHA256 = hashlib.sha256(AGENT_SOURCE.encode()).hexdigest()
+
+
+def _intact(path: str) -> str:
+    """Shell test that ``path`` holds this version of the agent."""
+    return f'[ "$(sha256sum 2>/dev/null < {path})" = "{AGENT_SHA256}  -" ]'
+
+
+def _deploy_cmd(path: str = AGENT_PATH) -> str:
+    """Shell command that writes the agent from stdin to ``path`` unless it's
+    there already. A deploy cut short must not leave a truncated agent
+    behind, so the copy is written aside, checked, and then moved."""
+    tmp = f"{path}.$$"
+    return (
+        f"{_intact(path)}"
+        f" || {{ cat > {tmp} && {_intact(tmp)} && mv {tmp} {path}; }}"
+        f" || {{ rm -f {tmp}; exit 1; }}"
+    )
+
+
+class AgentDied(Exception):
+    pass
+
+
+class RemoteAgent:
+    _ids = itertools.count()
+
+    def __init__(self, pod: "Pod"):
+        self.pod = pod
+        self.process: Optional[asyncssh.SSHClientProcess] = None
+        self._outputs: dict[str, "PodOutput"] = {}
+        self._exits: dict[str, asyncio.Future[int]] = {}
+        self._ready: Optional[asyncio.Future[None]] = None
+        self._serve_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def alive(self) -> bool:
+        return (
+            self._serve_task is not None
+            and not self._serve_task.done()
+            and self._loop is asyncio.get_running_loop()
+        )
+
+    def _start_cmd(self) -> str:
+        bootstrap = (
+            f"source {self.pod.data.source_file}; {self.pod.activate_venv_cmd()}"
+        )
+        agent = f"exec {self.pod.project.pyname} -u {AGENT_PATH}"
+        # keep the setup's own output off the agent's protocol stream
+        return f"{{ {bootstrap}; }} >/dev/null 2>&1; {agent}"
+
+    async def start(self):
+        if self.alive:
+            assert self._ready is not None
+            return await self._ready
+        self._loop = asyncio.get_running_loop()
+        self._ready = self._loop.create_future()
+        self._serve_task = asyncio.ensure_future(self._serve())
+        await self._ready
+
+    async def _serve(self):
+        assert self._ready is not None
+        try:
+            async with POOL.connection(self.pod.data.sshaddr) as conn:
+                await conn.run(
+                    f"mkdir -p $HOME/.ezpod; {_deploy_cmd()}",
+                    input=AGENT_SOURCE,
+                    check=True,
+                )
+                # holding the pooled connection keeps it from being evicted
+                async with conn.create_process(self._start_cmd()) as process:
+                    self.process = process
+                    # unread stderr would fill the channel's window and stall it
+                    drain = asyncio.ensure_future(self._drain_stderr(process))
+                    try:
+                        async for line in process.stdout:
+                            self._dispatch(line)
+                    finally:
+                        drain.cancel()
+        except Exception as e:
+            if not self._ready.done():
+                self._ready.set_exception(e)
+        finally:
+            self.process = None
+            if not self._ready.done():
+                self._ready.set_exception(AgentDied("agent exited before starting"))
+            for fut in self._exits.values():
+                if not fut.done():
+                    fut.set_exception(AgentDied(f"agent on {self.pod.data.name} died"))
+
+    async def _drain_stderr(self, process: asyncssh.SSHClientProcess):
+        async for line in process.stderr:
+            print(f"{self.pod.data.name} agent: {line}", end="")
+
+    def _dispatch(self, line: str):
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            return  # stray output from the pod's shell setup
+        if event.get("ready"):
+            assert self._ready is not None
+            self._ready.set_result(None)
+            return
+        id = event["id"]
+        if "exit" in event:
+            fut = self._exits.pop(id, None)
+            if fut is not None and not fut.done():
+                fut.set_result(event["exit"])
+            return
+        output = self._outputs.get(id)
+        if output is not None:
+            output.append(event["stream"], event["data"])
+
+    def _send(self, **request):
+        assert self.process is not None
+        self.process.stdin.write(json.dumps(request) + "\n")
+
+    async def run(
+        self, cmd: str, output: "PodOutput", id: Optional[str] = None
+    ) -> "PodOutput":
+        await self.start()
+        id = id or f"{self.pod.data.id}-{next(self._ids)}"
+        assert self._loop is not None
+        fut = self._exits[id] = self._loop.create_future()
+        self._outputs[id] = output
+        try:
+            self._send(id=id, cmd=cmd)
+            returncode = await fut
+        except asyncio.CancelledError:
+            if self.process is not None:
+                self._send(id=id, cancel=True)
+            raise
+        finally:
+            self._outputs.pop(id, None)
+            self._exits.pop(id, None)
+        output.return_code = asyncssh.SSHCompletedProcess(
+            command=cmd, exit_status=returncode, returncode=returncode
+        )
+        return output
+
+    def cancel(self, id: str):
+        if self.process is not None:
+            self._send(id=id, cancel=True)
+
+    async def stop(self):
+        if self.process is not None:
+            self.process.stdin.write_eof()
+        if self._serve_task is not None:
+            await asyncio.gather(self._serve_task, return_exceptions=True)
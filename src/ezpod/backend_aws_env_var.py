@@ -3,3 +3,21 @@ import os
 
 BACKEND_AWS = os.environ.get("EZPOD_BACKEND_AWS_EC2", "runpod") == "aws"
 # BACKEND_AWS = True
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    """Whether the flag env var ``name`` is turned on ("1", "true" or "yes");
+    "0" or "false" turn it off, and unset leaves it at ``default``."""
+    value = os.environ.get(name, "").strip().lower()
+    if not value:
+        return default
+    return value in ("1", "true", "yes")
+
+
+def aws_regions() -> list[str | None]:
+    """The regions ezpod lists and launches instances in, in order of launch
+    preference: EZPOD_AWS_REGIONS (comma separated), else EZPOD_AWS_REGION
+    (None: the AWS configuration's default region)."""
+    regions = os.environ.get("EZPOD_AWS_REGIONS", "")
+    regions = [region.strip() for region in regions.split(",") if region.strip()]
+    return regions or [os.environ.get("EZPOD_AWS_REGION", None)]
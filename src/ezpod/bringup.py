@@ -0,0 +1,241 @@
+"""Pipelined bring-up of new pods.
+
+Making pods, waiting for all of them, syncing, then setting up puts a
+barrier between every step, so the first pod to boot idles until the last
+one does.  :func:`bring_up` instead moves each new pod through
+
+    create -> ready -> synced -> set up -> ran (the first job)
+
+on its own, starting the moment the inventory reports the pod ready (see
+ezpod.events), so the first useful work starts after the fastest pod's boot
+rather than the slowest's.  The sync plan is compiled while the pods boot.
+
+Like ``Pods.setup``, bring-up can stop waiting once ``min_complete`` pods are
+through (plus a grace period); pods that failed or didn't finish in time are
+removed.  Pods that don't show up in the listing within ``LISTING_TIMEOUT``
+are given up on, and removed if they show up after all.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Optional
+
+from ezpod.events import PodReady
+from ezpod.inventory import INVENTORY
+from ezpod.manifest import prune_manifests, scan_project
+from ezpod.pod import Pod, PodOutput
+from ezpod.sync import RsyncResult, SyncEngine
+from ezpod.syncplan import SyncPlan
+from ezpod.terminate import terminate
+
+if TYPE_CHECKING:
+    from ezpod.pods import Pods
+
+# seconds to keep waiting for stragglers once min_complete pods are through
+GRACE = float(os.environ.get("EZPOD_BRING_UP_GRACE", 10))
+# seconds a new pod has to show up in the listing before it is given up on
+LISTING_TIMEOUT = float(os.environ.get("EZPOD_BRING_UP_LISTING_TIMEOUT", 600))
+
+
+@dataclass
+class BringUp:
+    """One pod's progress through bring-up."""
+
+    pod: Pod
+    start: float
+    # stage -> seconds from the start of bring-up
+    times: dict[str, float] = field(default_factory=dict)
+    error: Optional[BaseException] = None
+    output: Optional[PodOutput] = None
+    done: bool = False  # went through every stage
+
+    @property
+    def stage(self) -> str:
+        return list(self.times)[-1] if self.times else "created"
+
+    def reached(self, stage: str):
+        self.times[stage] = time.monotonic() - self.start
+        print(f"{self.pod.data.name}: {stage} after {self.times[stage]:.1f}s")
+
+
+async def _bring_up_pod(
+    pods: "Pods",
+    record: BringUp,
+    files_from: str,
+    manifest,
+    engine: SyncEngine,
+    cmd: Optional[str],
+    force_setup: bool,
+):
+    pod = record.pod
+
+    async def sync(pod: Pod) -> RsyncResult:
+        result = await pod.sync_folder_async(files_from=files_from)
+        await pod.record_synced_async(manifest)
+        return result
+
+    await engine.sync_one(pod, sync, name=lambda pod: pod.data.name)
+    record.reached("synced")
+    output = await pod.setup_async(pods.make_output("<run setup>"), force_setup)
+    if output is None or output.return_code is None:
+        raise Exception("setup did not finish")
+    if output.return_code.returncode != 0:
+        raise Exception(f"setup failed (code: {output.return_code.returncode})")
+    record.reached("set up")
+    if cmd is not None:
+        async with pods.fanout.session(pod):
+            record.output = await pod.run_async(cmd, output=pods.make_output(cmd))
+        record.reached("ran")
+    record.done = True
+
+
+def _drop_never_up(pods: "Pods", ids: set[str]):
+    """Stop waiting for the created pods ``ids`` that never showed up in the
+    listing, and remove the ones that show up in a last, fresh listing."""
+    pods.pending = [id for id in pods.pending if id not in ids]
+    late = [
+        Pod(data, pods.project) for data in INVENTORY.get(max_age=0) if data.id in ids
+    ]
+    if late:
+        print(f"{len(late)} pods showed up too late, removing them")
+        terminate(late)
+    missing = ids - {pod.data.id for pod in late}
+    if missing:
+        print(
+            f"Warning: pods {sorted(missing)} never showed up in the inventory; "
+            "check the provider that they aren't running."
+        )
+
+
+async def bring_up(
+    pods: "Pods",
+    n: int,
+    cmd: Optional[str] = None,
+    min_complete: Optional[int] = None,
+    timeout: Optional[float] = None,
+    force_setup: bool = False,
+) -> dict[Pod, BringUp]:
+    """Make ``n`` pods and sync, set up and run ``cmd`` on each as soon as it
+    is ready. Returns the progress of every new pod that came up.
+
+    min_complete: stop waiting ``GRACE`` seconds after this many pods are
+        through. Defaults to ``pods.EZPOD_MIN_COMPLETE_TO_CONTINUE`` or
+        EZPOD_MIN_COMPLETE_TO_CONTINUE; otherwise all pods are waited for.
+    timeout: seconds after which to stop waiting (default
+        EZPOD_BRING_UP_TIMEOUT, or none).
+    """
+    min_complete = min_complete or pods.EZPOD_MIN_COMPLETE_TO_CONTINUE
+    min_complete = min_complete or os.environ.get("EZPOD_MIN_COMPLETE_TO_CONTINUE")
+    min_complete = int(min_complete) if min_complete else None
+    timeout = timeout or float(os.environ.get("EZPOD_BRING_UP_TIMEOUT", 0)) or None
+    start = time.monotonic()
+    stream = pods.events.stream()
+    pending_before = set(pods.pending)
+    await asyncio.to_thread(pods.make_new_pods, n)
+    ids = set(pods.pending) - pending_before
+    stop = threading.Event()
+    poller = asyncio.ensure_future(asyncio.to_thread(pods.wait_ready, ids, stop))
+
+    # the pods are booting, so this is free
+    folder = pods.project.folder
+    sync_plan = await asyncio.to_thread(SyncPlan.compile, folder)
+    manifest = await asyncio.to_thread(scan_project, folder.local, sync_plan.files)
+    files_from = sync_plan.file_list()
+
+    engine: SyncEngine[Pod] = SyncEngine()
+    records: dict[Pod, BringUp] = {}
+    tasks: dict[Pod, asyncio.Task] = {}
+    progress = asyncio.Event()
+
+    def finished(record: BringUp, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            record.error = task.exception()
+            print(
+                f"{record.pod.data.name}: failed after {record.stage}: {record.error}"
+            )
+        progress.set()
+
+    async def start_ready_pods():
+        async for event in stream:
+            pod = event.pod
+            if not isinstance(event, PodReady) or pod.data.id not in ids:
+                continue
+            if pod in records:
+                continue
+            records[pod] = record = BringUp(pod, start)
+            record.reached("ready")
+            task = asyncio.ensure_future(
+                _bring_up_pod(
+                    pods, record, files_from, manifest, engine, cmd, force_setup
+                )
+            )
+            task.add_done_callback(lambda task, record=record: finished(record, task))
+            tasks[pod] = task
+
+    listener = asyncio.ensure_future(start_ready_pods())
+    complete_at = None
+    try:
+        while True:
+            ok = [r for r in records.values() if r.done]
+            failed = [r for r in records.values() if r.error is not None]
+            now = time.monotonic()
+            unlisted = (
+                ids - set(pods.by_id) if now - start >= LISTING_TIMEOUT else set()
+            )
+            if len(ok) + len(failed) + len(unlisted) == len(ids):
+                break
+            if min_complete and len(ok) >= min_complete:
+                if complete_at is None:
+                    print(f"{len(ok)} pods are up, waiting {GRACE:.0f}s for more")
+                    complete_at = now
+                if now - complete_at >= GRACE:
+                    break
+            if timeout and now - start >= timeout:
+                print(f"bring-up timed out after {timeout:.0f}s")
+                break
+            deadlines = [start + timeout] if timeout else []
+            if not unlisted and ids - set(pods.by_id):
+                deadlines.append(start + LISTING_TIMEOUT)
+            if complete_at is not None:
+                deadlines.append(complete_at + GRACE)
+            wait = min(deadlines) - now if deadlines else None
+            progress.clear()
+            try:
+                await asyncio.wait_for(progress.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        stop.set()
+        listener.cancel()
+        stream.close()
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(poller, listener, *tasks.values(), return_exceptions=True)
+    prune_manifests()
+
+    ok = [r for r in records.values() if r.done]
+    never_up = ids - set(pods.by_id)
+    unfinished = []
+    for pod in list(pods.pods):
+        if pod.data.id in ids and not any(r.pod is pod for r in ok):
+            stage = records[pod].stage if pod in records else "not ready"
+            print(f"{pod.data.name} didn't finish ({stage})")
+            unfinished.append(pod)
+    await asyncio.to_thread(pods.remove_pods, unfinished)
+    if never_up:
+        await asyncio.to_thread(_drop_never_up, pods, never_up)
+    if ok:
+        last = "ran" if cmd is not None else "set up"
+        times = sorted(r.times[last] for r in ok)
+        print(
+            f"bring-up: {len(ok)}/{n} pods {last}, first after {times[0]:.1f}s, "
+            f"last after {times[-1]:.1f}s"
+        )
+    else:
+        print(f"bring-up: 0/{n} pods came up")
+    return records
@@ -7,7 +7,7 @@ from typing_extensions import Self
 
 from ezpod.AWSPodCreationConfig import AWSPodCreationConfig
 from ezpod.backend_aws_env_var import BACKEND_AWS
-from ezpod.BasePodCreationConfig import BasePodCreationConfig, boto3
+from ezpod.BasePodCreationConfig import BasePodCreationConfig
 
 from .runpodctl_executor import runpod_run
 from .shell_local_data import (
@@ -17,6 +17,7 @@ from .shell_local_data import (
     set_current_account,
     set_current_profile,
 )
+from .shell_state import profile_names
 
 
 # ---------------------------------------------------------------------------
@@ -48,7 +49,7 @@ class RunPodCreationConfig(BasePodCreationConfig):
 
     @classmethod
     def list_profiles(cls):
-        return [p.name for p in acct_profiles().iterdir() if p.is_file()]
+        return profile_names()
 
     def _create_impl(self, name):
         print("making", self)
@@ -0,0 +1,498 @@
+"""A long-lived controller that keeps pods warm between CLI commands.
+
+``ezpod daemon`` holds the pods, their pooled SSH connections and output
+buffers, and the inventory cache, and serves ``ex``, ``py``, ``sync`` and
+``list`` over a Unix socket.  While a daemon serves the current account and
+folder, the CLI forwards those commands to it and streams back their output
+instead of starting from scratch.
+
+Commands run as jobs inside the daemon.  If the client goes away (Ctrl-C, a
+closed terminal) the job keeps running and its output keeps going to the
+job's log; ``ezpod jobs``, ``ezpod attach JOB`` and ``ezpod cancel JOB``
+find, follow and stop it.
+
+The client side only uses the standard library, so forwarding a command
+costs no more than the CLI's own startup.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextvars
+import hashlib
+import io
+import itertools
+import json
+import os
+import shutil
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Any, Awaitable, Callable, Optional
+
+from ezpod.shell_state import STATE_DIR, current_account_name, current_profile_name
+
+if TYPE_CHECKING:
+    from ezpod.pod import Pod
+    from ezpod.pods import Pods
+    from ezpod.runproject import RunProject
+
+DAEMON_DIR = STATE_DIR.parent / "daemon"
+# commands the CLI forwards to a running daemon
+COMMANDS = ("list", "ex", "py", "sync")
+# how often (seconds) a client following a job checks its log for more output
+FOLLOW_INTERVAL = 0.1
+# environment variables that pick the backend, regions and credentials a daemon
+# lists and launches pods with; clients only reach a daemon started with the
+# same values
+KEY_ENV_VARS = (
+    "EZPOD_BACKEND_AWS_EC2",
+    "EZPOD_AWS_REGIONS",
+    "EZPOD_AWS_REGION",
+    "AWS_PROFILE",
+    "AWS_REGION",
+    "AWS_DEFAULT_REGION",
+)
+# EZPOD_* variables a daemon applies per job; the others are read once at
+# startup, so a client whose values differ runs its command itself
+PER_JOB_ENV_VARS = ("EZPOD_GROUP",)
+# set by the client or spawn() and already part of the socket path
+_CLIENT_ENV_VARS = ("EZPOD_DAEMON", "EZPOD_ACCOUNT_OVERRIDE", "EZPOD_PROFILE_OVERRIDE")
+# finished jobs (and their logs) a daemon keeps for ezpod jobs/attach
+KEEP_JOBS = int(os.environ.get("EZPOD_DAEMON_KEEP_JOBS", "50"))
+
+
+def socket_path(folder: str | None = None) -> Path:
+    """The socket of the daemon for the current account, profile, ``folder``
+    (default: the working directory) and KEY_ENV_VARS."""
+    folder = os.path.abspath(folder or os.getcwd())
+    parts = [current_account_name(), str(current_profile_name()), folder]
+    parts += [f"{name}={os.environ.get(name, '')}" for name in KEY_ENV_VARS]
+    key = "\0".join(parts).encode()
+    return DAEMON_DIR / f"{hashlib.sha1(key).hexdigest()[:16]}.sock"
+
+
+def _make_daemon_dir():
+    """Create DAEMON_DIR, readable only by us: the sockets in it run commands
+    on the pods."""
+    DAEMON_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if DAEMON_DIR.stat().st_uid != os.getuid():
+        raise Exception(f"{DAEMON_DIR} belongs to another user")
+    DAEMON_DIR.chmod(0o700)
+
+
+def _send(stream: IO[bytes], **msg):
+    stream.write(json.dumps(msg).encode() + b"\n")
+    stream.flush()
+
+
+# client
+
+
+def connect(path: Path | None = None) -> Optional[socket.socket]:
+    """A connection to the daemon at ``path``, or None if none is running."""
+    path = path or socket_path()
+    if not path.exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except OSError:  # a stale socket left by a daemon that was killed
+        sock.close()
+        return None
+    return sock
+
+
+def ezpod_environ(environ: dict[str, str] | None = None) -> dict[str, str]:
+    environ = os.environ if environ is None else environ
+    return {
+        k: v
+        for k, v in environ.items()
+        if k.startswith("EZPOD_") and k not in _CLIENT_ENV_VARS
+    }
+
+
+def request(sock: socket.socket, command: str, **msg: Any) -> Optional[int]:
+    """Send ``command`` to the daemon and print its output until it
+    finishes. Returns the command's exit status, or None if the daemon
+    refused to run it."""
+    job = None
+    with sock, sock.makefile("rwb") as f:
+        _send(f, command=command, **msg)
+        try:
+            for line in f:
+                reply = json.loads(line)
+                if "refused" in reply:
+                    print(f"ezpod daemon: {reply['refused']}", file=sys.stderr)
+                    return None
+                if "job" in reply:
+                    job = reply["job"]
+                if "out" in reply:
+                    sys.stdout.write(reply["out"])
+                    sys.stdout.flush()
+                if "exit" in reply:
+                    return reply["exit"]
+        except KeyboardInterrupt:
+            if job is None:
+                raise
+            print(
+                f"\ndetached, job {job} keeps running in the daemon "
+                f"(ezpod attach {job} / ezpod cancel {job})",
+                file=sys.stderr,
+            )
+            return 130
+    print("lost the connection to the daemon", file=sys.stderr)
+    return 1
+
+
+def spawn(timeout: float = 30) -> Path:
+    """Start a daemon for the working directory in the background, detached
+    from this terminal. Returns its socket once it accepts connections."""
+    path = socket_path()
+    _make_daemon_dir()
+    # the daemon's parent isn't this shell, so pass on the shell's selection
+    env = dict(os.environ, EZPOD_ACCOUNT_OVERRIDE=current_account_name())
+    profile = current_profile_name()
+    if profile is not None:
+        env["EZPOD_PROFILE_OVERRIDE"] = profile
+    log_path = path.with_suffix(".log")
+    with open(log_path, "ab") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "ezpod", "daemon"],
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        sock = connect(path)
+        if sock is not None:
+            sock.close()
+            return path
+        if process.poll() is not None:
+            break
+        time.sleep(0.1)
+    raise Exception(f"daemon did not start, see {log_path}")
+
+
+# server
+
+_current_job: contextvars.ContextVar[Optional["Job"]] = contextvars.ContextVar(
+    "ezpod_daemon_job", default=None
+)
+
+
+class _JobOutput(io.TextIOBase):
+    """Stands in for sys.stdout and sys.stderr in the daemon, sending what a
+    job prints (also from the tasks and threads it starts, which inherit its
+    context) to the job's log."""
+
+    def __init__(self, fallback: IO[str]):
+        self.fallback = fallback
+
+    def write(self, s: str) -> int:
+        job = _current_job.get()
+        log = job.log if job is not None else None
+        if log is None:
+            return self.fallback.write(s)
+        log.write(s)
+        log.flush()
+        return len(s)
+
+    def flush(self):
+        self.fallback.flush()
+
+
+@dataclass
+class Job:
+    id: str
+    command: str
+    log_path: Path
+    start_time: datetime
+    future: Optional[concurrent.futures.Future] = None
+    log: Optional[IO[str]] = None  # open while the job runs
+    exit: Optional[int] = None
+
+    def __str__(self):
+        status = "running" if self.exit is None else f"exit {self.exit}"
+        return f"{self.id:>4}  {status:<8}  {self.start_time:%H:%M:%S}  {self.command}"
+
+
+def _peer_uid(sock: socket.socket) -> Optional[int]:
+    """The uid of the process at the other end of ``sock``, or None where
+    SO_PEERCRED isn't available (then only the directory's mode protects the
+    socket)."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    return struct.unpack("3i", creds)[1]
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "_Server"
+
+    def handle(self):
+        uid = _peer_uid(self.request)
+        if uid is not None and uid != os.getuid():
+            _send(self.wfile, out="ezpod daemon: permission denied\n", exit=1)
+            return
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            self.server.daemon.handle(json.loads(line), self.wfile)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client went away; its job keeps running
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    daemon: "Daemon"
+
+
+class Daemon:
+    def __init__(self, project: "RunProject", path: Path):
+        self.project = project
+        self.path = path
+        self.jobs_dir = path.with_suffix(".jobs")
+        self.jobs: dict[str, Job] = {}
+        self.loop = asyncio.new_event_loop()
+        self._pods: dict[str, "Pod"] = {}
+        self._pods_lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self._server: Optional[_Server] = None
+
+    def select(self, selection: dict, environ: dict) -> "Pods":
+        """The pods picked by a client's group options. Pods live as long as
+        the daemon, so their connections and outputs outlive commands."""
+        from ezpod.inventory import INVENTORY
+        from ezpod.pod import Pod
+        from ezpod.pods import Pods
+        from ezpod.shell_local_data import default_group
+
+        group = None
+        if not selection["all"]:
+            group = selection["group"] or default_group(environ)
+        if selection["cached"]:
+            datas = INVENTORY.get_cached(group=group)
+        else:
+            datas = INVENTORY.get(group=group)
+        with self._pods_lock:
+            # a group's listing says nothing about the other groups' pods
+            pods = {
+                id: pod
+                for id, pod in self._pods.items()
+                if group is not None and pod.data.podname.group != group
+            }
+            for data in datas:
+                pod = self._pods.get(data.id)
+                if pod is None:
+                    pod = Pod(data, self.project)
+                else:
+                    pod.update(data)
+                pods[data.id] = pod
+            self._pods = pods
+        selected = [pods[data.id] for data in datas]
+        return Pods(self.project, selected, group=group).select(selection["i"])
+
+    async def _list(self, pods: "Pods", args: dict):
+        if pods.pods:
+            for pod in pods.pods:
+                print(pod)
+        else:
+            print("No pods.")
+
+    async def _ex(self, pods: "Pods", args: dict):
+        from ezpod.fanout import VERBOSE
+        from ezpod.ssh_pool import POOL
+
+        print("ex")
+        pods = pods.get_alive()
+        await pods.arun(args["s"])
+        if VERBOSE:
+            print(POOL.stats)
+            pods.print_cache_report()
+
+    async def _py(self, pods: "Pods", args: dict):
+        from ezpod.fanout import VERBOSE
+        from ezpod.ssh_pool import POOL
+
+        pods = pods.get_alive()
+        await pods.arun(pods.to_py_cmd(args["s"]))
+        if VERBOSE:
+            print(POOL.stats)
+            pods.print_cache_report()
+
+    async def _sync(self, pods: "Pods", args: dict):
+        pods = pods.get_alive()
+        if args.get("watch"):
+            await pods.async_watch()
+        else:
+            await pods.async_sync(
+                force=args.get("force", False), via_volume=args.get("volume", False)
+            )
+
+    async def _run_job(
+        self,
+        job: Job,
+        run: Callable[["Pods", dict], Awaitable[None]],
+        msg: dict,
+    ):
+        _current_job.set(job)
+        try:
+            pods = await asyncio.to_thread(
+                self.select, msg["selection"], msg.get("environ", {})
+            )
+            await run(pods, msg.get("args", {}))
+            code = 0
+        except asyncio.CancelledError:
+            print(f"job {job.id} cancelled")
+            code = 130
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        assert job.log is not None
+        job.log.close()
+        job.log = None
+        job.exit = code
+
+    def refuse(self, environ: dict) -> Optional[str]:
+        """Why a client with the EZPOD_* variables ``environ`` can't use this
+        daemon, or None if it can."""
+        ours, theirs = ezpod_environ(), ezpod_environ(environ)
+        differ = sorted(
+            k
+            for k in ours.keys() | theirs.keys()
+            if k not in PER_JOB_ENV_VARS and ours.get(k) != theirs.get(k)
+        )
+        if differ:
+            return (
+                f"started with different {', '.join(differ)}, running locally "
+                "(restart the daemon to use these settings)"
+            )
+        return None
+
+    def _prune_jobs(self):
+        finished = [job for job in self.jobs.values() if job.exit is not None]
+        for job in finished[: max(len(finished) - KEEP_JOBS, 0)]:
+            del self.jobs[job.id]
+            job.log_path.unlink(missing_ok=True)
+
+    def start(self, msg: dict) -> Job:
+        command = msg["command"]
+        args = msg.get("args", {})
+        id = str(next(self._job_ids))
+        job = Job(
+            id=id,
+            command=" ".join([command, *(f"{k}={v!r}" for k, v in args.items())]),
+            log_path=self.jobs_dir / f"{id}.log",
+            start_time=datetime.now(),
+        )
+        job.log = open(job.log_path, "w")
+        self._prune_jobs()
+        self.jobs[job.id] = job
+        run = getattr(self, f"_{command}")
+        job.future = asyncio.run_coroutine_threadsafe(
+            self._run_job(job, run, msg), self.loop
+        )
+        return job
+
+    def follow(self, job: Job, out: IO[bytes]):
+        """Stream ``job``'s log to a client until the job finishes."""
+        with open(job.log_path) as log:
+            while True:
+                done = job.exit is not None
+                chunk = log.read()
+                if chunk:
+                    _send(out, out=chunk)
+                elif done:
+                    break
+                else:
+                    time.sleep(FOLLOW_INTERVAL)
+        _send(out, exit=job.exit)
+
+    def handle(self, msg: dict, out: IO[bytes]):
+        command = msg["command"]
+        job = self.jobs.get(str(msg.get("job")))
+        if command in COMMANDS and (refused := self.refuse(msg.get("environ", {}))):
+            _send(out, refused=refused)
+        elif command in COMMANDS:
+            job = self.start(msg)
+            _send(out, job=job.id)
+            self.follow(job, out)
+        elif command == "jobs":
+            lines = [str(j) for j in self.jobs.values()] or ["No jobs."]
+            _send(out, out="".join(f"{line}\n" for line in lines), exit=0)
+        elif command in ("attach", "cancel") and job is None:
+            _send(out, out=f"no job {msg.get('job')}\n", exit=1)
+        elif command == "attach":
+            assert job is not None
+            _send(out, job=job.id)
+            self.follow(job, out)
+        elif command == "cancel":
+            assert job is not None and job.future is not None
+            job.future.cancel()
+            _send(out, exit=0)
+        elif command == "stop":
+            _send(out, out="stopping the daemon\n", exit=0)
+            assert self._server is not None
+            threading.Thread(target=self._server.shutdown).start()
+        else:
+            _send(out, out=f"unknown command {command}\n", exit=1)
+
+    def serve_forever(self):
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = _JobOutput(stdout), _JobOutput(stderr)
+        loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        loop_thread.start()
+        try:
+            with _Server(str(self.path), _Handler) as server:
+                server.daemon = self
+                self._server = server
+                print(f"ezpod daemon for {os.getcwd()} listening on {self.path}")
+                try:
+                    server.serve_forever()
+                except KeyboardInterrupt:
+                    pass
+        finally:
+            self.path.unlink(missing_ok=True)
+            from ezpod.ssh_pool import POOL
+
+            try:
+                close = asyncio.run_coroutine_threadsafe(POOL.close_all(), self.loop)
+                close.result(timeout=10)
+            except Exception as e:
+                print(f"closing connections failed: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            loop_thread.join(timeout=10)
+            shutil.rmtree(self.jobs_dir, ignore_errors=True)
+            sys.stdout, sys.stderr = stdout, stderr
+            print("ezpod daemon stopped")
+
+
+def serve():
+    """Run a daemon for the working directory in the foreground."""
+    from ezpod.runproject import RunFolder, RunProject
+
+    path = socket_path()
+    sock = connect(path)
+    if sock is not None:
+        sock.close()
+        raise Exception(f"a daemon for {os.getcwd()} is already running at {path}")
+    _make_daemon_dir()
+    path.unlink(missing_ok=True)
+    Daemon(RunProject(folder=RunFolder.cwd()), path).serve_forever()
@@ -6,11 +6,18 @@ EC2 instance information.
 
 Instances are identified via the tag ``EzPod=true`` – this tag is automatically
 added when launching new instances through :pyclass:`~ezpod.create_pods.AWSPodCreationConfig`.
+Older versions only tagged ``Name``: such instances are listed with their group
+(their name says which group they are in), and otherwise warned about.
 """
 
 from __future__ import annotations
 
+import json
 import os
+import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from pydantic import BaseModel
 from typing_extensions import Self
@@ -18,7 +25,11 @@ from typing_extensions import Self
 from ezpod.AddrEntry import AddrEntry
 
 from ezpod.aws_models.ec2.describe_instances import Tag
+from ezpod.backend_aws_env_var import aws_regions
+from ezpod.BasePodCreationConfig import import_boto3
+from ezpod.instance_types import INSTANCE_TYPES, InstanceTypeInfo
 
+from ezpod.pod_data import TERMINATE_CONCURRENCY
 from ezpod.pod_group_info import PodGroupInfo
 
 # ---------------------------------------------------------------------------
@@ -193,6 +204,128 @@ from ezpod.PodDataProtocol import InstanceData
 #         return []
 
 
+# instance ids per terminate-instances call
+AWS_TERMINATE_BATCH = int(os.environ.get("EZPOD_AWS_TERMINATE_BATCH", 500))
+
+
+# instances in other states (i.e. terminated) aren't listed
+LISTED_STATES = ["pending", "running", "stopping", "stopped", "shutting-down"]
+# ssh key of an instance, by its key pair name and region
+AWS_KEY_PATH = os.environ.get("EZPOD_AWS_KEY_PATH", "~/.awskeys/{key_name}.pem")
+# instances per describe-instances page
+AWS_DESCRIBE_PAGE_SIZE = int(os.environ.get("EZPOD_AWS_DESCRIBE_PAGE_SIZE", 1000))
+
+_clients: dict[str | None, object] = {}
+_clients_lock = threading.Lock()
+
+
+def ec2_client(region: str | None = None):
+    """A boto3 EC2 client for ``region``, made once and reused (making one
+    loads the service model, which is slow). None if boto3 isn't installed."""
+    with _clients_lock:
+        if region not in _clients:
+            boto3 = import_boto3()
+            if boto3 is None:
+                return None
+            _clients[region] = boto3.client("ec2", region_name=region)
+        return _clients[region]
+
+
+def _instance_filters(group: str | None = None, ezpod_tag: bool = True) -> list[dict]:
+    """ezpod_tag=False: the instances named like ezpod pods, tagged or not."""
+    filters = [{"Name": "instance-state-name", "Values": LISTED_STATES}]
+    if ezpod_tag:
+        filters.append({"Name": "tag:EzPod", "Values": ["true"]})
+    if group is not None or not ezpod_tag:
+        filters.append({"Name": "tag:Name", "Values": [f"{group or '*'}_*"]})
+    return filters
+
+
+def _untagged_ezpod_names(reservations: list[dict], group: str | None) -> set[str]:
+    """The instances in ``reservations`` named like ezpod pods (of ``group``,
+    if given) but without the EzPod tag, by id."""
+    pattern = re.compile(rf"{re.escape(group) if group else '[^_]+'}_\d+")
+    ids = set()
+    for reservation in reservations:
+        for instance in reservation["Instances"]:
+            tags = {t["Key"]: t["Value"] for t in instance.get("Tags", [])}
+            if "EzPod" not in tags and pattern.fullmatch(tags.get("Name", "")):
+                ids.add(instance["InstanceId"])
+    return ids
+
+
+# untagged instances already warned about, so a long-lived process (see
+# ezpod.daemon) doesn't repeat it on every listing
+_warned_untagged: set[str] = set()
+
+
+def _describe(region: str | None, filters: list[dict]) -> list[dict]:
+    client = ec2_client(region)
+    if client is not None:
+        paginator = client.get_paginator("describe_instances")
+        pages = paginator.paginate(
+            Filters=filters, PaginationConfig={"PageSize": AWS_DESCRIBE_PAGE_SIZE}
+        )
+        return [r for page in pages for r in page["Reservations"]]
+    cmd = ["aws", "ec2", "describe-instances", "--output", "json", "--filters"]
+    cmd += [f"Name={f['Name']},Values={','.join(f['Values'])}" for f in filters]
+    cmd += ["--page-size", str(AWS_DESCRIBE_PAGE_SIZE)]
+    cmd += ["--region", region] if region else []
+    return json.loads(subprocess.check_output(cmd))["Reservations"]
+
+
+def describe_reservations(
+    region: str | None = None, group: str | None = None
+) -> list[dict]:
+    """The reservations holding ezpod instances (of ``group``, if given) that
+    aren't terminated, filtered by AWS rather than here. Uses boto3 if it is
+    installed and the AWS CLI otherwise.
+
+    Instances launched by older versions carry only a ``Name`` tag. Those
+    named for ``group`` are listed too; without a group they are only warned
+    about, since a name alone doesn't make an instance ezpod's."""
+    with ThreadPoolExecutor(2) as pool:
+        tagged = pool.submit(_describe, region, _instance_filters(group))
+        named = pool.submit(_describe, region, _instance_filters(group, False))
+        reservations, named_reservations = tagged.result(), named.result()
+    untagged = _untagged_ezpod_names(named_reservations, group)
+    if not untagged:
+        return reservations
+    names = sorted(
+        next(t["Value"] for t in i["Tags"] if t["Key"] == "Name")
+        for r in named_reservations
+        for i in r["Instances"]
+        if i["InstanceId"] in untagged
+    )
+    if group is None:
+        if untagged <= _warned_untagged:
+            return reservations
+        _warned_untagged.update(untagged)
+        print(
+            f"Warning: {len(untagged)} instances in {region or 'the default region'} "
+            f"are named like ezpod pods but aren't tagged EzPod=true, so they "
+            f"aren't listed (launched by an older ezpod?): {', '.join(names)}. "
+            "Tag them EzPod=true to manage them, or select their group."
+        )
+        return reservations
+    for reservation in named_reservations:
+        reservation["Instances"] = [
+            i for i in reservation["Instances"] if i["InstanceId"] in untagged
+        ]
+    return reservations + [r for r in named_reservations if r["Instances"]]
+
+
+def _terminate_instances(
+    ids: list[str], region: str | None
+) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        ["aws", "ec2", "terminate-instances", "--instance-ids", *ids]
+        + ["--output", "json"]
+        + (["--region", region] if region else []),
+        capture_output=True,
+    )
+
+
 class EC2State(BaseModel):
     Name: str
     Code: int
@@ -219,6 +352,10 @@ class EC2InstanceData(BaseModel):
     PublicIpAddress: str | None = None
     Tags: list[Tag] | None = None
     source_file: str = "~/.bashrc"
+    # where the instance was listed and what its type is made of; not part
+    # of the AWS response
+    region: str | None = None
+    type_info: InstanceTypeInfo | None = None
 
     @property
     def tags(self):
@@ -256,43 +393,82 @@ class EC2InstanceData(BaseModel):
                 proto="tcp",
                 user="ubuntu",
                 opts="-o StrictHostKeychecking=no",
-                key_path="~/.awskeys/testkey2.pem",
+                key_path=AWS_KEY_PATH.format(
+                    key_name=self.KeyName, region=self.region or "default"
+                ),
                 homedir="/home/ubuntu",
             )
         ]
 
     @property
-    def gpu_type(self) -> str: ...
+    def gpu_type(self) -> str:
+        if self.type_info is None or self.type_info.gpu_type is None:
+            return self.InstanceType
+        return self.type_info.gpu_type
+
+    @property
+    def gpu_qty(self) -> int:
+        return self.type_info.gpu_qty if self.type_info else 0
+
+    @property
+    def vcpu(self) -> int | None:
+        return self.type_info.vcpu if self.type_info else None
+
+    @property
+    def mem(self) -> int | None:
+        """GiB"""
+        return self.type_info.mem if self.type_info else None
 
     @property
-    def gpu_qty(self) -> int: ...
+    def cost(self) -> float | None:
+        """On-demand USD per hour"""
+        return self.type_info.price if self.type_info else None
 
     @property
     def sshaddr(self) -> AddrEntry:
         return self.addrs[0]
 
     def remove_pod(self):
-        return subprocess.run(
-            f"aws ec2 terminate-instances --instance-ids {self.InstanceId} --output json",
-            shell=True,
-            capture_output=True,
-        )
+        return _terminate_instances([self.InstanceId], self.region)
 
     @classmethod
-    def get_all(cls) -> list[Self]:
-        insts = EC2Data.get_all_pods()
-        keep, notkeep = [], []
-        for p in insts:
-            if p.tags and "EzPod" in p.tags and p.tags["EzPod"] == "true":
-                keep.append(p)
-            else:
-                notkeep.append(p)
-        if notkeep:
-            print(
-                "Warning: some EC2 instances were not valid ezpod instances and will be ignored:",
-                notkeep,
-            )
-        return keep
+    def remove_pods(cls, datas: list[Self]) -> list[str]:
+        """Terminate instances with one terminate-instances call per region
+        and AWS_TERMINATE_BATCH ids, the calls running concurrently. A rejected
+        batch (e.g. one of its instances no longer exists) is retried one
+        instance at a time. Returns the ids that could not be terminated."""
+
+        def terminate(region: str | None, batch: list[str]) -> list[str]:
+            r = _terminate_instances(batch, region)
+            if r.returncode == 0:
+                out = json.loads(r.stdout)
+                done = {i["InstanceId"] for i in out["TerminatingInstances"]}
+                return [id for id in batch if id not in done]
+            if len(batch) == 1:
+                print(f"{batch[0]}: error terminating: {r.stderr.decode().strip()}")
+                return batch
+            return [id for one in batch for id in terminate(region, [one])]
+
+        by_region: dict[str | None, list[str]] = {}
+        for data in datas:
+            by_region.setdefault(data.region, []).append(data.InstanceId)
+        regions, batches = [], []
+        for region, ids in by_region.items():
+            for i in range(0, len(ids), AWS_TERMINATE_BATCH):
+                regions.append(region)
+                batches.append(ids[i : i + AWS_TERMINATE_BATCH])
+        with ThreadPoolExecutor(TERMINATE_CONCURRENCY) as pool:
+            failed = pool.map(terminate, regions, batches)
+            return [id for ids in failed for id in ids]
+
+    @classmethod
+    def get_all(cls, group: str | None = None) -> list[Self]:
+        """Every ezpod instance (tagged EzPod=true), or those of ``group``, in
+        all the configured regions (listed concurrently)."""
+        regions = aws_regions()
+        with ThreadPoolExecutor(len(regions)) as pool:
+            listings = pool.map(lambda r: EC2Data.get_all_pods(r, group), regions)
+            return [data for listing in listings for data in listing]
 
     @property
     def status(self) -> str:
@@ -326,16 +502,22 @@ class EC2Data(BaseModel):
         return cls.model_validate_json(json_str)
 
     @classmethod
-    def get(cls, region: str | None = None) -> Self:
-        reg = f" --region {region}" if region else ""
-        cmd = f"aws ec2 describe-instances --output json {reg}"
-        output = subprocess.check_output(cmd, shell=True)
-        return cls.model_validate_json(output)
+    def get(cls, region: str | None = None, group: str | None = None) -> Self:
+        return cls.model_validate(
+            {"Reservations": describe_reservations(region, group)}
+        )
 
     @classmethod
-    def get_all_pods(cls, region: str | None = None) -> list[EC2InstanceData]:
-        inst = cls.get(region)
-        return [i for r in inst.Reservations for i in r.Instances]
+    def get_all_pods(
+        cls, region: str | None = None, group: str | None = None
+    ) -> list[EC2InstanceData]:
+        inst = cls.get(region, group)
+        datas = [i for r in inst.Reservations for i in r.Instances]
+        infos = INSTANCE_TYPES.get(region, {data.InstanceType for data in datas})
+        for data in datas:
+            data.region = region
+            data.type_info = infos.get(data.InstanceType)
+        return datas
 
 
 def main():
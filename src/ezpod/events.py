@@ -0,0 +1,125 @@
+"""Pod lifecycle events.
+
+:meth:`Pods.update` diffs every inventory listing against the pods it knows
+and emits an event for each change on ``Pods.events``: a pod becoming ready
+(running with an ssh address), disappearing, changing status or getting a
+new address.  Listeners either register a callback, called synchronously
+from whatever thread runs the update, or iterate over a stream::
+
+    async for event in pods.events.stream():
+        if isinstance(event, PodReady):
+            ...
+
+Streams may be fed from another thread (e.g. ``wait_pending`` run with
+``asyncio.to_thread``), so a loop can react to each pod as it comes up while
+the inventory is polled in the background.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Optional
+
+from ezpod.AddrEntry import AddrEntry
+
+if TYPE_CHECKING:
+    from ezpod.pod import Pod
+    from ezpod.PodDataProtocol import InstanceData
+
+
+@dataclass
+class PodEvent:
+    pod: "Pod"
+
+
+@dataclass
+class PodReady(PodEvent):
+    """The pod is running and has an ssh address, for the first time."""
+
+
+@dataclass
+class PodGone(PodEvent):
+    """The pod is no longer in the inventory."""
+
+
+@dataclass
+class StatusChanged(PodEvent):
+    old: str
+    new: str
+
+
+@dataclass
+class AddressAssigned(PodEvent):
+    addr: AddrEntry
+
+
+def ssh_addr(data: "InstanceData") -> Optional[AddrEntry]:
+    """The pod's ssh address, or None if it has none yet."""
+    try:
+        return data.sshaddr
+    except (AssertionError, IndexError):
+        return None
+
+
+def is_ready(data: "InstanceData") -> bool:
+    return data.is_running and ssh_addr(data) is not None
+
+
+Callback = Callable[[PodEvent], None]
+
+
+class EventStream:
+    """Events emitted after the stream was made, as an async iterator. Make
+    it in (or for) the loop that will consume it."""
+
+    def __init__(self, events: "PodEvents", loop: asyncio.AbstractEventLoop):
+        self._events = events
+        self._loop = loop
+        self._queue: asyncio.Queue[PodEvent] = asyncio.Queue()
+
+    def _put(self, event: PodEvent):
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+        except RuntimeError:  # the loop is closed
+            self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> PodEvent:
+        return await self._queue.get()
+
+    def close(self):
+        self._events.unsubscribe(self._put)
+
+
+class PodEvents:
+    def __init__(self):
+        self._callbacks: list[Callback] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Callback) -> Callback:
+        with self._lock:
+            self._callbacks.append(callback)
+        return callback
+
+    def unsubscribe(self, callback: Callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def stream(self) -> EventStream:
+        stream = EventStream(self, asyncio.get_event_loop())
+        self.subscribe(stream._put)
+        return stream
+
+    def emit(self, event: PodEvent):
+        with self._lock:
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Warning: {type(event).__name__} callback failed: {e!r}")
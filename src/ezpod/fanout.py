@@ -0,0 +1,188 @@
+"""Bounded-concurrency fan-out of per-pod SSH sessions.
+
+Starting one session per pod all at once is fine for a handful of pods, but
+with hundreds of pods the handshakes pile up and trip sshd's ``MaxStartups``.
+:class:`FanOut` caps the number of sessions starting at the same time, rate
+limits session starts per host, and releases sessions in jittered waves.  Only
+the start is limited: once a session's process is running it gives its slot
+back, so long commands on many pods all run at once.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Optional
+
+from ezpod.backend_aws_env_var import env_flag
+from ezpod.ssh_pool import START_SLOT
+
+if TYPE_CHECKING:
+    from ezpod.pod import Pod
+
+Job = tuple["Pod", Callable[[], Awaitable[Any]]]
+# print fan-out, connection pool and cache statistics after each command
+VERBOSE = env_flag("EZPOD_VERBOSE")
+
+
+def _default_concurrency() -> int:
+    # Every starting session holds a socket, so stay well under the fd limit.
+    try:
+        import resource
+
+        return max(8, resource.getrlimit(resource.RLIMIT_NOFILE)[0] // 4)
+    except (ImportError, ValueError):
+        return 64
+
+
+@dataclass
+class FanOutStats:
+    total: int = 0
+    started: int = 0
+    completed: int = 0
+    failed: int = 0
+    start_time: float = field(default_factory=time.monotonic)
+    end_time: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end_time or time.monotonic()) - self.start_time
+
+    @property
+    def throughput(self) -> float:
+        """Finished sessions per second."""
+        if self.elapsed <= 0:
+            return 0.0
+        return (self.completed + self.failed) / self.elapsed
+
+    def __str__(self):
+        return (
+            f"fan-out: {self.completed}/{self.total} sessions ok, {self.failed} failed "
+            f"in {self.elapsed:.1f}s ({self.throughput:.2f} sessions/s)"
+        )
+
+
+class FanOut:
+    def __init__(
+        self,
+        max_concurrency: int = int(
+            os.environ.get("EZPOD_FANOUT_CONCURRENCY", _default_concurrency())
+        ),
+        host_rate: float = float(os.environ.get("EZPOD_FANOUT_HOST_RATE", 10)),
+        wave_size: int = int(os.environ.get("EZPOD_FANOUT_WAVE_SIZE", 32)),
+        wave_interval: float = float(os.environ.get("EZPOD_FANOUT_WAVE_INTERVAL", 1)),
+        jitter: float = float(os.environ.get("EZPOD_FANOUT_JITTER", 0.5)),
+    ):
+        """
+        max_concurrency: sessions allowed to be starting (connecting and
+            starting their process) at the same time.
+        host_rate: max session starts per second against one host ip. RunPod
+            pods often share a proxy ip, so this is not the same as per pod.
+        wave_size: sessions released per wave.
+        wave_interval: seconds between waves.
+        jitter: max random extra delay (seconds) added to each session start.
+        """
+        self.max_concurrency = max_concurrency
+        self.host_rate = host_rate
+        self.wave_size = wave_size
+        self.wave_interval = wave_interval
+        self.jitter = jitter
+        self.stats = FanOutStats()
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._host_next_start: dict[str, float] = {}
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+            self._host_next_start = {}
+
+    async def _wait_host_slot(self, host: str):
+        if not self.host_rate:
+            return
+        now = time.monotonic()
+        start = max(now, self._host_next_start.get(host, now))
+        self._host_next_start[host] = start + 1 / self.host_rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    @asynccontextmanager
+    async def _start_slot(self, host: str, rate_limit: bool) -> AsyncIterator[None]:
+        self._check_loop()
+        assert self._sem is not None
+        async with self._sem:
+            if rate_limit:
+                await self._wait_host_slot(host)
+            yield
+
+    @asynccontextmanager
+    async def session(self, pod: "Pod", rate_limit: bool = True) -> AsyncIterator[None]:
+        """Run a session against ``pod`` in the block: the ssh processes and
+        connections it starts (see ezpod.ssh_pool) wait for one of the
+        engine's slots, and hold it only until they have started.
+
+        rate_limit: wait for the pod's host to be free per ``host_rate``.
+        """
+        host = pod.data.sshaddr.ip
+        token = START_SLOT.set(lambda: self._start_slot(host, rate_limit))
+        try:
+            yield
+        finally:
+            START_SLOT.reset(token)
+
+    async def _run_job(
+        self, i: int, job: Job, stats: FanOutStats, waves: bool, rate_limit: bool
+    ):
+        pod, start = job
+        if waves:
+            delay = (i // self.wave_size) * self.wave_interval
+            delay += random.uniform(0, self.jitter)
+            await asyncio.sleep(delay)
+        try:
+            async with self.session(pod, rate_limit):
+                stats.started += 1
+                result = await start()
+        except Exception:
+            stats.failed += 1
+            raise
+        else:
+            stats.completed += 1
+            return result
+        finally:
+            if stats.completed + stats.failed == stats.total:
+                stats.end_time = time.monotonic()
+
+    def create_tasks(self, jobs: list[Job]) -> list[asyncio.Task]:
+        """Schedule ``jobs`` on the running loop, returning one task per job.
+
+        Task names are the job's index so callers can map a task back to its
+        pod.  ``self.stats`` is reset for every call.  Jobs are only spread
+        out in waves if there are more than ``wave_size`` of them, and only
+        rate limited against hosts that have more than one.
+        """
+        loop = asyncio.get_event_loop()
+        self.stats = stats = FanOutStats(total=len(jobs))
+        waves = len(jobs) > self.wave_size
+        per_host = Counter(pod.data.sshaddr.ip for pod, _ in jobs)
+        return [
+            loop.create_task(
+                self._run_job(
+                    i, job, stats, waves, per_host[job[0].data.sshaddr.ip] > 1
+                ),
+                name=str(i),
+            )
+            for i, job in enumerate(jobs)
+        ]
+
+    async def run(self, jobs: list[Job]) -> list[Any]:
+        results = await asyncio.gather(*self.create_tasks(jobs))
+        if VERBOSE:
+            print(self.stats)
+        return results
@@ -0,0 +1,190 @@
+"""EC2 instance-type metadata: GPUs, vCPUs, memory and on-demand price.
+
+A listing of instances only says each one's instance type.  What that type
+is made of comes from ``describe_instance_types`` (and the Pricing API for
+the price), which hardly ever changes, so it is cached on disk per region and
+only refetched for types that are new or older than ``TTL``.  An inventory
+refresh therefore looks the types up here without making any calls once the
+fleet's types have been seen.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from pydantic import BaseModel
+
+from ezpod.backend_aws_env_var import env_flag
+from ezpod.shell_local_data import STATE_DIR
+
+CACHE_DIR = STATE_DIR.parent / "instance_types"
+# seconds an instance type's metadata is reused for
+TTL = float(os.environ.get("EZPOD_INSTANCE_TYPES_TTL", 7 * 24 * 3600))
+# look up on-demand prices (needs pricing:GetProducts)
+PRICING = env_flag("EZPOD_AWS_PRICING", default=True)
+# instance types per describe-instance-types call (the API's maximum)
+DESCRIBE_BATCH = 100
+# Pricing API calls made at once
+PRICING_CONCURRENCY = 16
+
+
+class InstanceTypeInfo(BaseModel):
+    instance_type: str
+    vcpu: int
+    mem: int  # GiB
+    gpu_qty: int = 0
+    gpu_type: Optional[str] = None
+    price: Optional[float] = None  # on-demand USD per hour
+    fetched_at: float = 0.0
+
+    @classmethod
+    def from_description(cls, description: dict) -> "InstanceTypeInfo":
+        gpus = description.get("GpuInfo", {}).get("Gpus", [])
+        return cls(
+            instance_type=description["InstanceType"],
+            vcpu=description["VCpuInfo"]["DefaultVCpus"],
+            mem=description["MemoryInfo"]["SizeInMiB"] // 1024,
+            gpu_qty=sum(gpu["Count"] for gpu in gpus),
+            gpu_type=gpus[0]["Name"] if gpus else None,
+            fetched_at=time.time(),
+        )
+
+
+def _describe(region: Optional[str], types: list[str]) -> list[dict]:
+    from ezpod.ec2_data import ec2_client
+
+    client = ec2_client(region)
+    descriptions = []
+    for i in range(0, len(types), DESCRIBE_BATCH):
+        batch = types[i : i + DESCRIBE_BATCH]
+        if client is not None:
+            paginator = client.get_paginator("describe_instance_types")
+            pages = paginator.paginate(InstanceTypes=batch)
+            descriptions += [d for page in pages for d in page["InstanceTypes"]]
+            continue
+        cmd = ["aws", "ec2", "describe-instance-types", "--output", "json"]
+        cmd += ["--instance-types", *batch]
+        cmd += ["--region", region] if region else []
+        descriptions += json.loads(subprocess.check_output(cmd))["InstanceTypes"]
+    return descriptions
+
+
+def _prices(region: Optional[str], types: list[str]) -> dict[str, Optional[float]]:
+    """The on-demand Linux price of each of ``types`` in ``region`` (None where
+    the Pricing API has none or isn't available), looked up concurrently."""
+    from ezpod.BasePodCreationConfig import import_boto3
+    from ezpod.ec2_data import ec2_client
+
+    boto3 = import_boto3()
+    if boto3 is None or not types:
+        return {t: None for t in types}
+    region_code = region or ec2_client(region).meta.region_name
+    # the Pricing API is only served from a few regions
+    pricing = boto3.client("pricing", region_name="us-east-1")
+
+    def price(instance_type: str) -> Optional[float]:
+        filters = {
+            "instanceType": instance_type,
+            "regionCode": region_code,
+            "operatingSystem": "Linux",
+            "tenancy": "Shared",
+            "preInstalledSw": "NA",
+            "capacitystatus": "Used",
+        }
+        try:
+            products = pricing.get_products(
+                ServiceCode="AmazonEC2",
+                Filters=[
+                    {"Type": "TERM_MATCH", "Field": field, "Value": value}
+                    for field, value in filters.items()
+                ],
+            )["PriceList"]
+        except Exception as e:
+            print(f"Warning: no price for {instance_type}: {e}")
+            return None
+        for product in products:
+            for term in json.loads(product)["terms"].get("OnDemand", {}).values():
+                for dimension in term["priceDimensions"].values():
+                    return float(dimension["pricePerUnit"]["USD"])
+        return None
+
+    with ThreadPoolExecutor(min(PRICING_CONCURRENCY, len(types))) as pool:
+        return dict(zip(types, pool.map(price, types)))
+
+
+class InstanceTypes:
+    """The per-region instance-type metadata cache."""
+
+    def __init__(self, ttl: float = TTL):
+        self.ttl = ttl
+        self._infos: dict[Optional[str], dict[str, InstanceTypeInfo]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, region: Optional[str]) -> Path:
+        return CACHE_DIR / f"{region or 'default'}.json"
+
+    def _load(self, region: Optional[str]) -> dict[str, InstanceTypeInfo]:
+        if region not in self._infos:
+            try:
+                saved = json.loads(self._path(region).read_text())
+                infos = {
+                    t: InstanceTypeInfo.model_validate(i) for t, i in saved.items()
+                }
+            except (FileNotFoundError, ValueError):
+                infos = {}
+            self._infos[region] = infos
+        return self._infos[region]
+
+    def _save(self, region: Optional[str]):
+        path = self._path(region)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        infos = {t: i.model_dump(mode="json") for t, i in self._infos[region].items()}
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(infos))
+        tmp.replace(path)
+
+    def get(
+        self, region: Optional[str], types: set[str]
+    ) -> dict[str, InstanceTypeInfo]:
+        """Metadata for each of ``types`` in ``region``, fetched for the ones
+        not cached or older than the TTL. Types AWS doesn't know are left out;
+        if fetching fails, whatever is cached is returned."""
+        with self._lock:
+            infos = self._load(region)
+            now = time.time()
+            stale = sorted(
+                t
+                for t in types
+                if t not in infos or now - infos[t].fetched_at > self.ttl
+            )
+        if stale:
+            # fetch without the lock, so other regions' lookups aren't held up
+            try:
+                fetched = [
+                    InstanceTypeInfo.from_description(description)
+                    for description in _describe(region, stale)
+                ]
+                if PRICING:
+                    prices = _prices(region, [i.instance_type for i in fetched])
+                    for info in fetched:
+                        info.price = prices[info.instance_type]
+            except Exception as e:
+                print(f"Warning: couldn't describe instance types {stale}: {e}")
+                fetched = []
+            with self._lock:
+                for info in fetched:
+                    infos[info.instance_type] = info
+                if fetched:
+                    self._save(region)
+        with self._lock:
+            return {t: infos[t] for t in types if t in infos}
+
+
+INSTANCE_TYPES = InstanceTypes()
@@ -0,0 +1,169 @@
+"""A short-lived cache of the provider's pod listing.
+
+Listing pods shells out to ``runpodctl`` or the AWS CLI and parses the whole
+fleet, which takes around a second.  ``Pods.All``, ``Pods.update`` and
+``Pods.wait_pending`` all read the listing through :data:`INVENTORY`, which
+reuses a listing younger than its TTL.  Listings are kept per group, since
+the AWS backend can list just one group's instances; a fresh listing of the
+whole fleet also answers for any group.  Concurrent callers share a single
+fetch, and creating or removing pods invalidates the cache.
+
+Every fetched listing is also saved as a snapshot on disk, next to the
+per-shell state, so read-only CLI commands (``ezpod list``, ``ezpod ssh``)
+can be answered from a recent snapshot without listing the fleet again (see
+ezpod.snapshot).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from ezpod.backend_aws_env_var import BACKEND_AWS
+from ezpod.events import ssh_addr
+from ezpod.pod_data import PodData
+from ezpod.snapshot import (
+    SNAPSHOT_MAX_AGE,
+    load,
+    pod_line,
+    snapshot_path,
+    snapshot_paths,
+)
+
+
+def _row(data) -> dict:
+    """What ``ezpod list`` and ``ezpod ssh`` need of a pod (see ezpod.snapshot)."""
+    addr = ssh_addr(data)
+    return {
+        "id": data.id,
+        "name": data.name,
+        "group": data.podname.group,
+        "line": pod_line(data.name, data.id, data.gpu_type, data.status),
+        "running": data.is_running,
+        "ssh": addr
+        and {
+            "ip": addr.ip,
+            "port": addr.port,
+            "user": addr.user,
+            "opts": addr.full_opts,
+        },
+    }
+
+
+def _data_cls():
+    if BACKEND_AWS:
+        from ezpod.ec2_data import EC2InstanceData
+
+        return EC2InstanceData
+    return PodData
+
+
+@dataclass
+class InventoryStats:
+    fetches: int = 0
+    hits: int = 0
+
+    def __str__(self):
+        return f"inventory: {self.fetches} fetches, {self.hits} cache hits"
+
+
+def _in_group(datas: list, group: Optional[str]) -> list:
+    if group is None:
+        return list(datas)
+    return [d for d in datas if d.podname.group == group]
+
+
+class Inventory:
+    def __init__(self, ttl: float = float(os.environ.get("EZPOD_INVENTORY_TTL", 2))):
+        """ttl: seconds a listing is reused for."""
+        self.ttl = ttl
+        self.stats = InventoryStats()
+        # group (None: every pod) -> (monotonic time fetched, listing)
+        self._listings: dict[Optional[str], tuple[float, list[PodData]]] = {}
+        self._lock = threading.Lock()
+
+    def _cached(
+        self, group: Optional[str], max_age: float, requested: float = float("inf")
+    ) -> Optional[list[PodData]]:
+        """The group's listing if one is at most ``max_age`` seconds old or was
+        fetched after ``requested``, from its own listing or the full one."""
+        now = time.monotonic()
+        for key in (group, None):
+            if key in self._listings:
+                fetched_at, datas = self._listings[key]
+                if now - fetched_at <= max_age or fetched_at >= requested:
+                    return _in_group(datas, group)
+        return None
+
+    def get(
+        self, max_age: Optional[float] = None, group: Optional[str] = None
+    ) -> list[PodData]:
+        """The pod listing (of ``group``, if given), fetched if the cached one
+        is older than ``max_age`` (default: the TTL) seconds."""
+        max_age = self.ttl if max_age is None else max_age
+        requested = time.monotonic()
+        with self._lock:
+            # Someone else may have fetched while we waited for the lock.
+            datas = self._cached(group, max_age, requested)
+            if datas is not None:
+                self.stats.hits += 1
+                return datas
+            datas = _in_group(PodData.get_all(group), group)
+            self._listings[group] = (time.monotonic(), datas)
+            self.stats.fetches += 1
+            self._save_snapshot(datas, group)
+            return list(datas)
+
+    def _save_snapshot(self, datas: list, group: Optional[str]):
+        path = snapshot_path(group)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        snapshot = {
+            "fetched_at": time.time(),
+            "pods": [d.model_dump(mode="json", by_alias=True) for d in datas],
+            "rows": [_row(d) for d in datas],
+        }
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(snapshot))
+        tmp.replace(path)
+
+    def _load_snapshot(self, max_age: float, group: Optional[str]) -> Optional[list]:
+        cls = _data_cls()
+        for key in (group, None):
+            snapshot = load(max_age, key)
+            if snapshot is None:
+                continue
+            try:
+                datas = [cls.model_validate(d) for d in snapshot["pods"]]
+            except ValueError:  # saved by an incompatible version
+                continue
+            return _in_group(datas, group)
+        return None
+
+    def get_cached(
+        self, max_age: float = SNAPSHOT_MAX_AGE, group: Optional[str] = None
+    ) -> list:
+        """The pod listing (of ``group``, if given) from memory or the on-disk
+        snapshot if one is at most ``max_age`` seconds old, otherwise fetched."""
+        with self._lock:
+            datas = self._cached(group, max_age)
+            if datas is not None:
+                self.stats.hits += 1
+                return datas
+        datas = self._load_snapshot(max_age, group)
+        if datas is None:
+            return self.get(max_age, group)
+        self.stats.hits += 1
+        return datas
+
+    def invalidate(self):
+        with self._lock:
+            self._listings = {}
+            for path in snapshot_paths():
+                path.unlink(missing_ok=True)
+
+
+INVENTORY = Inventory()
@@ -0,0 +1,139 @@
+"""Manifests of the files a sync sends, for skipping pods that are up to date.
+
+A :class:`Manifest` records size, mtime and content hash for every file in
+the sync set.  Its digest identifies the exact state of the project that was
+synced.  After a pod syncs successfully we write the digest to a marker in
+the pod's copy of the folder (see Pod.synced_marker) and keep the manifest, so
+the next sync can skip pods whose marker matches and send other pods only the
+files that changed since the state in their marker.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from ezpod.global_paths import PROFILES_PATH
+
+SYNC_STATE_PATH = PROFILES_PATH / "sync_state"
+MANIFESTS_PATH = SYNC_STATE_PATH / "manifests"
+POD_DIGESTS_PATH = SYNC_STATE_PATH / "pods"
+LOCAL_MANIFESTS_PATH = SYNC_STATE_PATH / "local"
+
+# relpath -> (size, mtime_ns, sha256)
+Entries = dict[str, tuple[int, int, str]]
+
+
+def _hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass
+class Manifest:
+    entries: Entries = field(default_factory=dict)
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(
+            json.dumps(sorted(self.entries.items())).encode()
+        ).hexdigest()
+
+    @classmethod
+    def build(
+        cls,
+        root: Path,
+        files: list[str],
+        previous: Optional["Manifest"] = None,
+    ) -> "Manifest":
+        """Hash ``files`` (relative to ``root``). Files whose size and mtime
+        match ``previous`` reuse its hash instead of being re-read."""
+        known = previous.entries if previous is not None else {}
+        entries: Entries = {}
+        for relpath in files:
+            path = root / relpath
+            try:
+                st = path.stat()
+            except FileNotFoundError:  # dangling symlink, or deleted since
+                continue
+            old = known.get(relpath)
+            if old is not None and (old[0], old[1]) == (st.st_size, st.st_mtime_ns):
+                entries[relpath] = old
+            else:
+                entries[relpath] = (st.st_size, st.st_mtime_ns, _hash_file(path))
+        return cls(entries)
+
+    def changed_since(self, other: "Manifest") -> list[str]:
+        """Files that are new or have different contents than in ``other``."""
+        return sorted(
+            relpath
+            for relpath, entry in self.entries.items()
+            if relpath not in other.entries
+            or other.entries[relpath][2] != entry[2]
+            or other.entries[relpath][1] != entry[1]
+        )
+
+    def save(self):
+        MANIFESTS_PATH.mkdir(parents=True, exist_ok=True)
+        path = MANIFESTS_PATH / f"{self.digest}.json"
+        if not path.exists():
+            path.write_text(json.dumps(self.entries))
+
+    @classmethod
+    def load(cls, digest: str) -> Optional["Manifest"]:
+        path = MANIFESTS_PATH / f"{digest}.json"
+        if not path.exists():
+            return None
+        return cls._read(path)
+
+    @classmethod
+    def _read(cls, path: Path) -> "Manifest":
+        return cls(
+            {k: (v[0], v[1], v[2]) for k, v in json.loads(path.read_text()).items()}
+        )
+
+
+def scan_project(root: Path, files: list[str]) -> Manifest:
+    """Build the manifest of ``root``, reusing hashes from the last scan of
+    the same folder, and remember it for the next scan."""
+    key = hashlib.sha1(str(root.resolve()).encode()).hexdigest()
+    cache = LOCAL_MANIFESTS_PATH / f"{key}.json"
+    previous = Manifest._read(cache) if cache.exists() else None
+    manifest = Manifest.build(root, files, previous)
+    LOCAL_MANIFESTS_PATH.mkdir(parents=True, exist_ok=True)
+    cache.write_text(json.dumps(manifest.entries))
+    return manifest
+
+
+def _pod_digest_path(pod_id: str, remote_name: str) -> Path:
+    return POD_DIGESTS_PATH / f"{pod_id}__{remote_name}"
+
+
+def record_synced(pod_id: str, remote_name: str, manifest: Manifest):
+    manifest.save()
+    POD_DIGESTS_PATH.mkdir(parents=True, exist_ok=True)
+    _pod_digest_path(pod_id, remote_name).write_text(manifest.digest)
+
+
+def forget_synced(pod_id: str, remote_name: str):
+    _pod_digest_path(pod_id, remote_name).unlink(missing_ok=True)
+
+
+def prune_manifests():
+    """Delete stored manifests that no pod's record refers to anymore."""
+    if not MANIFESTS_PATH.exists():
+        return
+    referenced = (
+        {p.read_text().strip() for p in POD_DIGESTS_PATH.iterdir()}
+        if POD_DIGESTS_PATH.exists()
+        else set()
+    )
+    for path in MANIFESTS_PATH.glob("*.json"):
+        if path.stem not in referenced:
+            path.unlink(missing_ok=True)
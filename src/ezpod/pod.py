@@ -1,7 +1,8 @@
 import asyncio
+import hashlib
 import os
 from collections import deque
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 from typing import Deque, Dict, Optional
@@ -13,7 +14,34 @@ from ezpod.PodDataProtocol import InstanceData
 
 from .pod_data import PodData, PURGED_POD_IDS
 
+from .agent import RemoteAgent
+from .inventory import INVENTORY
+from .manifest import Manifest, forget_synced, record_synced
 from .runproject import RunFolder, RunProject
+from .snapshot import pod_line
+from .ssh_pool import POOL
+from .sync import RsyncResult, rsync
+from .syncplan import SyncPlan
+
+JOBS_DIR = "$HOME/.ezpod/jobs"
+# Remote commands report cache hits/misses with lines like
+# "__ezpod_cache venv hit"; these are recorded in PodOutput.cache.
+CACHE_SENTINEL = "__ezpod_cache"
+# Files whose contents decide whether a pod's setup is still up to date.
+SETUP_SPEC_FILES = ("setup.py", "requirements.txt", "pyproject.toml")
+# Where wheelhouse-mode setup keeps built wheels on a pod, relative to its home.
+# Outside the project folder, so project syncs and ignore rules don't touch it.
+WHEELHOUSE_DIR = ".ezpod/wheelhouse"
+# How many past outputs each pod keeps: each holds up to 2 x 1000 lines, and
+# a daemon (see ezpod.daemon) keeps its pods for as long as it runs.
+HISTORY_LEN = int(os.environ.get("EZPOD_POD_HISTORY", 10))
+# Python code setting ``tags`` to what decides which wheels an interpreter can
+# install: its implementation, version, machine and libc.
+INTERPRETER_TAGS = (
+    "import platform, sys; "
+    "tags = (sys.implementation.name, '%d.%d' % sys.version_info[:2], "
+    "platform.machine(), *platform.libc_ver())"
+)
 
 
 @dataclass
@@ -25,16 +53,14 @@ class PodOutput:
     start_time: datetime
     end_time: Optional[datetime] = None
     return_code: Optional[asyncssh.SSHCompletedProcess] = None
+    cache: Dict[str, str] = field(default_factory=dict)
 
-
-def parse_include_file(file: Path) -> set[str]:
-    if not file.exists():
-        return set()
-    return {
-        ist
-        for i in file.read_text().split("\n")
-        if not (ist := i.strip()).startswith("#") and ist
-    }
+    def append(self, stream: str, line: str):
+        if line.startswith(CACHE_SENTINEL):
+            _, key, value = line.split(maxsplit=2)
+            self.cache[key] = value.strip()
+            return
+        getattr(self, stream).append(line)
 
 
 class Pod:
@@ -47,46 +73,58 @@ class Pod:
         self.data: InstanceData = data
         # self.tmi = TMInstance(project=project, data=data)
         self.output: Optional[PodOutput] = None
+        self.history: Deque[PodOutput] = deque(maxlen=HISTORY_LEN)
+        self._agent: Optional[RemoteAgent] = None
         self._max_lines = 1000  # Could make this configurable in __init__ if needed
 
     @property
     def folder(self):
         return Path(self.project.folder.local_path)
 
-    def sync_folder_async(self, folder: Optional[RunFolder] = None):
-        from ezpod.sync import asyncrsync
-
+    async def sync_folder_async(
+        self,
+        folder: Optional[RunFolder] = None,
+        files_from: Optional[str] = None,
+        dest: Optional[str] = None,
+        link_dest: Optional[str] = None,
+    ) -> RsyncResult:
+        """files_from: path of a list of the files to sync (see SyncPlan). By
+            default the folder's plan is compiled just for this pod.
+        dest: remote directory to sync into, instead of the project folder.
+        link_dest: see ``ezpod.sync.rsync``.
+        """
         folder = folder or self.project.folder
-        exclude = {".git"} | parse_include_file(folder.local / ".gitignore")
-        ezpod_exclude = parse_include_file(folder.local / ".ezpodignore")
-        include = parse_include_file(folder.local / ".ezpodinclude")
-        if include & ezpod_exclude:
-            raise Exception(
-                f".ezpodinclude contains entries that were ignored in .ezpodignore: {include & ezpod_exclude}"
-            )
-        if include - exclude:
-            raise Exception(
-                f".ezpodinclude contains entries that are not ignored: {include - exclude}"
-            )
-        exclude = list((exclude | ezpod_exclude) - include)
+        if files_from is None:
+            sync_plan = SyncPlan.compile(folder)  # its list lives as long as it does
+            files_from = sync_plan.file_list()
         print("syncing to", self.data.sshaddr)
-        promise = asyncrsync(
+        return await rsync(
             host=self.data.sshaddr.ip,
             user=self.data.sshaddr.user,
             port=int(self.data.sshaddr.port),
             key_path=self.data.sshaddr.key_path or None,
-            src=self.project.folder.local_path,
-            dest=f"{self.data.sshaddr.homedir}/{self.project.folder.remote_name}",
-            exclude=exclude,
+            # trailing slash: sync the folder's contents into remote_name
+            src=self.project.folder.local_path.rstrip("/") + "/",
+            dest=dest
+            or f"{self.data.sshaddr.homedir}/{self.project.folder.remote_name}",
+            files_from=files_from,
+            link_dest=link_dest,
         )
-        return promise
 
-    def command_extras(self, cmd, in_folder=True):
-        print("source_file", self.data.source_file, type(self.data))
-        cmd = f"source {self.data.source_file}; {self.activate_venv_cmd()}; {cmd}"
+    def command_extras(
+        self, cmd, in_folder=True, job_tag: str | None = None, bootstrap=True
+    ):
+        if bootstrap:  # the agent runs commands with the environment already set up
+            print("source_file", self.data.source_file, type(self.data))
+            cmd = f"source {self.data.source_file}; {self.activate_venv_cmd()}; {cmd}"
 
         if in_folder:
             cmd = f"cd {self.project.folder.remote_name}; {cmd}"
+        if job_tag:
+            # sshd starts each command in its own session, so $$ is also the
+            # process group id that cancel_remote kills.
+            pidfile = f"{JOBS_DIR}/{job_tag}.pid"
+            cmd = f'mkdir -p {JOBS_DIR}; echo $$ > {pidfile}; trap "rm -f {pidfile}" EXIT; {cmd}'
         return cmd
 
     def remote_command(self, cmd, in_folder=True) -> str:
@@ -99,7 +137,7 @@ class Pod:
     # def run(self, cmd, in_folder=True):
     #     return self.tmi.run(self.remote_command(cmd, in_folder))
 
-    async def async_ssh_exec(self, cmd, output: PodOutput | None = None):
+    def _start_output(self, cmd, output: PodOutput | None = None) -> PodOutput:
         # Initialize new output buffer for this command
         output = output or PodOutput(
             command=cmd,
@@ -109,56 +147,78 @@ class Pod:
             is_running=True,
         )
         self.output = output
+        self.history.append(output)
+        return output
 
-        opts = asyncssh.SSHClientConnectionOptions(
-            username=self.data.sshaddr.user,
-            **(
-                dict(client_keys=[Path(self.data.sshaddr.key_path)])  # type: ignore
-                if self.data.sshaddr.key_path
-                else {}
-            ),
-        )
-        async with asyncssh.connect(
-            self.data.sshaddr.ip,
-            self.data.sshaddr.port,
-            options=opts,
-        ) as conn:
-            async with conn.create_process(cmd) as process:
+    async def async_ssh_exec(self, cmd, output: PodOutput | None = None):
+        output = self._start_output(cmd, output)
+        try:
+            async with POOL.process(self.data.sshaddr, cmd) as process:
 
                 async def read_stdout():
-                    assert self.output is not None
                     async for line in process.stdout:
-                        self.output.stdout.append(line)
-                        # print("2", line)
+                        output.append("stdout", line)
 
                 async def read_stderr():
-                    assert self.output is not None
                     async for line in process.stderr:
-                        self.output.stderr.append(line)
+                        output.append("stderr", line)
 
-                # print(1)
-                # while process.returncode is None:
-                #     line = await process.stdout.readline()
-                #     print(line, end="")
-                # print(2)
                 await asyncio.gather(read_stdout(), read_stderr())
-                # print(3)
-                self.output.return_code = await process.wait()
-                self.output.end_time = datetime.now()
-                self.output.is_running = False
+                output.return_code = await process.wait()
+        finally:
+            # also reached when the command is cancelled or the connection drops
+            output.end_time = datetime.now()
+            output.is_running = False
         return output
 
+    @property
+    def agent(self) -> RemoteAgent:
+        if self._agent is None:
+            self._agent = RemoteAgent(self)
+        return self._agent
+
+    async def async_agent_exec(
+        self, cmd, output: PodOutput | None = None, job_tag: str | None = None
+    ):
+        output = self._start_output(cmd, output)
+        try:
+            await self.agent.run(cmd, output, id=job_tag)
+        finally:
+            output.end_time = datetime.now()
+            output.is_running = False
+        return output
+
+    async def cancel_remote(self, job_tag: str):
+        """Kill the process group of a command started with ``job_tag``."""
+        pidfile = f"{JOBS_DIR}/{job_tag}.pid"
+        async with POOL.connection(self.data.sshaddr) as conn:
+            await conn.run(
+                f"test -f {pidfile} && kill -TERM -- -$(cat {pidfile}); rm -f {pidfile}"
+            )
+
     def get_output(self) -> Optional[PodOutput]:
         """Get the current output buffer for this pod"""
         return self.output
 
     async def run_async(
-        self, cmd, in_folder=True, purge_after=False, output: PodOutput | None = None
+        self,
+        cmd,
+        in_folder=True,
+        purge_after=False,
+        output: PodOutput | None = None,
+        job_tag: str | None = None,
     ):
         try:
-            output = await self.async_ssh_exec(
-                self.command_extras(cmd, in_folder), output
-            )
+            if self.project.use_agent:
+                output = await self.async_agent_exec(
+                    self.command_extras(cmd, in_folder, job_tag, bootstrap=False),
+                    output,
+                    job_tag,
+                )
+            else:
+                output = await self.async_ssh_exec(
+                    self.command_extras(cmd, in_folder, job_tag), output
+                )
         except asyncssh.connection.HostKeyNotVerifiable as e:  # type: ignore
             print(e)
             print(f"Unable to verify pod. removing pod {self.data.name}")
@@ -170,22 +230,179 @@ class Pod:
 
     def activate_venv_cmd(self):
         if self.project.use_venv:
-            return f"cd ~; {self.project.pyname} -m venv --system-site-packages .venv; source .venv/bin/activate; cd -;"
+            # The venv is only (re)made when the marker written after making it
+            # doesn't match the current interpreter's path and version.
+            py = self.project.pyname
+            marker = ".venv/.ezpod_venv"
+            key = f"$(command -v {py}) $({py} -V 2>&1)"
+            make = f"{py} -m venv --system-site-packages .venv && echo {key} > {marker}"
+            return (
+                f"cd ~; "
+                f'if [ "$(cat {marker} 2>/dev/null)" = "{key}" ]; '
+                f"then echo {CACHE_SENTINEL} venv hit; "
+                f"else {make}; echo {CACHE_SENTINEL} venv miss; fi; "
+                f"source .venv/bin/activate; cd - >/dev/null"
+            )
         return "echo skipping venv activation"
 
-    def setup_async(self, output: PodOutput):
-        if "setup.py" in os.listdir(self.folder):
-            return self.run_async(
-                f"{self.project.pyname} -m pip install --ignore-installed blinker ;"  # TODO MAKE GENERAL DIRECTORY SPECIFIC SETUP RULES OPTION
-                + f"{self.project.pyname} -m pip install -e .",
-                output,
-            )
-        elif "requirements.txt" in os.listdir(self.folder):
-            return self.run_async(
-                f"{self.project.pyname} -m pip install -r requirements.txt",
-                output,
+    def _is_package(self) -> bool:
+        files = os.listdir(self.folder)
+        if "setup.py" in files or "pyproject.toml" in files:
+            return True
+        elif "requirements.txt" in files:
+            return False
+        raise Exception("No setup.py, pyproject.toml or requirements.txt found.")
+
+    @property
+    def wheelhouse(self) -> str:
+        """This project's wheelhouse on the pod, relative to its home."""
+        return f"{WHEELHOUSE_DIR}/{self.project.folder.remote_name}"
+
+    def setup_install_cmd(self, wheelhouse=False) -> str:
+        py = self.project.pyname
+        pip_install = f"{py} -m pip install"
+        if wheelhouse:
+            pip_install += f" --no-index --find-links $HOME/{self.wheelhouse}"
+        if self._is_package():
+            # TODO MAKE GENERAL DIRECTORY SPECIFIC SETUP RULES OPTION
+            blinker = self._cached_cmd(
+                "$HOME/.ezpod/setup/blinker",
+                self._interpreter_key(),
+                f"{pip_install} --ignore-installed blinker",
             )
-        raise Exception("No setup.py or requirements.txt found.")
+            return f"{blinker}; {pip_install} -e ."
+        return f"{pip_install} -r requirements.txt"
+
+    def wheelhouse_build_cmd(self, dest: str, py: str | None = None) -> str:
+        """Command that builds wheels for everything setup installs into
+        ``dest``, run in the project folder."""
+        pip_wheel = f"{py or self.project.pyname} -m pip wheel -w {dest}"
+        if self._is_package():
+            # build backends are needed too, since installs can't reach an index
+            return f"{pip_wheel} . setuptools wheel blinker"
+        return f"{pip_wheel} -r requirements.txt"
+
+    async def interpreter_tags_async(self) -> str | None:
+        """The project interpreter's INTERPRETER_TAGS on the pod."""
+        code = f"{INTERPRETER_TAGS}; print('{CACHE_SENTINEL}', 'interpreter', *tags)"
+        output = await self.run_async(f'{self.project.pyname} -c "{code}"')
+        if output is None:
+            return None
+        return output.cache.get("interpreter")
+
+    async def download_async(self, remote_path: str, local_dir: Path):
+        """Copy ``remote_path`` (relative to the pod's home) into ``local_dir``."""
+        async with POOL.connection(self.data.sshaddr) as conn:
+            async with conn.start_sftp_client() as sftp:
+                await sftp.get(remote_path, str(local_dir), recurse=True, preserve=True)
+
+    async def push_wheelhouse_async(self, local: Path) -> RsyncResult:
+        """Replace the pod's wheelhouse with the wheels in ``local``."""
+        addr = self.data.sshaddr
+        async with POOL.connection(addr) as conn:
+            wheelhouse = f"$HOME/{self.wheelhouse}"
+            await conn.run(f"rm -rf {wheelhouse} && mkdir -p {wheelhouse}", check=True)
+        return await rsync(
+            host=addr.ip,
+            user=addr.user,
+            port=int(addr.port),
+            key_path=addr.key_path or None,
+            src=str(local).rstrip("/") + "/",
+            dest=f"{addr.homedir}/{self.wheelhouse}",
+        )
+
+    def setup_key(self) -> str:
+        """Hash of the local dependency spec files, combined on the pod with the
+        interpreter to decide whether setup can be skipped."""
+        h = hashlib.sha256(self.project.pyname.encode())
+        for name in SETUP_SPEC_FILES:
+            path = self.folder / name
+            if path.exists():
+                h.update(name.encode() + b"\0" + path.read_bytes())
+        return f"{h.hexdigest()[:16]} {self._interpreter_key()}"
+
+    def _interpreter_key(self) -> str:
+        py = self.project.pyname
+        return f"$(command -v {py}) $({py} -V 2>&1)"
+
+    def _cached_cmd(
+        self, marker: str, key: str, cmd: str, report: str | None = None
+    ) -> str:
+        """Wrap ``cmd`` so it only runs when ``marker``'s first line isn't
+        ``key``. The marker's second line records how long ``cmd`` took."""
+        # each marker times itself with its own variable, so a cached command
+        # nested in another one doesn't reset the outer one's start time
+        start = "S_" + hashlib.sha1(marker.encode()).hexdigest()[:8]
+        hit = miss = ""
+        if report:
+            hit = f"echo {CACHE_SENTINEL} {report} hit $(sed -n 2p {marker}); "
+            miss = f"echo {CACHE_SENTINEL} {report} miss; "
+        record = f"{{ echo {key}; echo $((SECONDS - {start})); }} > {marker}"
+        return (
+            f"mkdir -p $(dirname {marker}); "
+            f'if [ "$(head -n 1 {marker} 2>/dev/null)" = "{key}" ]; then {hit}true; '
+            f"else {miss}{start}=$SECONDS; {cmd} && {record}; fi"
+        )
+
+    @property
+    def synced_marker(self) -> str:
+        """Holds the digest of the folder state last synced to the pod. It
+        lives in the synced folder, so it goes away when the folder does."""
+        return f"$HOME/{self.project.folder.remote_name}/.ezpod_synced"
+
+    async def synced_digest_async(self) -> Optional[str]:
+        """The digest in the pod's sync marker, or None if it has none or
+        couldn't be reached."""
+        marker = self.synced_marker
+        cmd = (
+            f"echo {CACHE_SENTINEL} synced "
+            f"$(head -n 1 {marker} 2>/dev/null | grep . || echo none)"
+        )
+        output = await self.run_async(cmd, in_folder=False)
+        digest = output.cache.get("synced") if output is not None else None
+        return None if digest in (None, "none") else digest
+
+    async def record_synced_async(self, manifest: Manifest):
+        """Note that the pod now has the folder state ``manifest``."""
+        record_synced(self.data.id, self.project.folder.remote_name, manifest)
+        await self.run_async(
+            f"echo {manifest.digest} > {self.synced_marker}", in_folder=False
+        )
+
+    async def forget_synced_async(self):
+        """Note that the pod's folder no longer matches any synced state."""
+        forget_synced(self.data.id, self.project.folder.remote_name)
+        await self.run_async(f"rm -f {self.synced_marker}", in_folder=False)
+
+    @property
+    def setup_marker(self) -> str:
+        return f"$HOME/.ezpod/setup/{self.project.folder.remote_name}"
+
+    async def needs_setup_async(self) -> bool:
+        """Whether setup_async would install, i.e. the pod's setup marker
+        doesn't match its current spec files and interpreter."""
+        marker = self.setup_marker
+        cmd = (
+            f'if [ "$(head -n 1 {marker} 2>/dev/null)" = "{self.setup_key()}" ]; '
+            f"then echo {CACHE_SENTINEL} needs_setup no; "
+            f"else echo {CACHE_SENTINEL} needs_setup yes; fi"
+        )
+        output = await self.run_async(cmd)
+        return output is None or output.cache.get("needs_setup") != "no"
+
+    def setup_async(self, output: PodOutput, force=False, wheelhouse=False):
+        marker = self.setup_marker
+        marker_reset = f"rm -f {marker}; " if force else ""
+        return self.run_async(
+            marker_reset
+            + self._cached_cmd(
+                marker,
+                self.setup_key(),
+                self.setup_install_cmd(wheelhouse),
+                report="setup",
+            ),
+            output=output,
+        )
 
     def remove(self):
         r = self.data.remove_pod()
@@ -198,7 +415,17 @@ class Pod:
                 raise Exception("Error removing pod.")
         if r.stdout:
             print(f"{self.data.name}: {r.stdout}")
+        self.mark_removed()
+
+    def mark_removed(self):
+        """Drop what's kept about this pod once the provider removed it."""
         PURGED_POD_IDS.append(self.data.id)
+        INVENTORY.invalidate()
+        forget_synced(self.data.id, self.project.folder.remote_name)
+        try:
+            POOL.forget(self.data.sshaddr)
+        except AssertionError:  # never got an ssh address, so never pooled
+            pass
         # if self.tmi.proj:
         #     self.tmi.pane.send_keys("exit")
 
@@ -212,4 +439,5 @@ class Pod:
         self.data = data
 
     def __repr__(self):
-        return f"{self.data.name} ({self.data.id}, {self.data.gpu_type}, {self.data.status})"
+        data = self.data
+        return pod_line(data.name, data.id, data.gpu_type, data.status)
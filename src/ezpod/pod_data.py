@@ -1,4 +1,6 @@
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 from pydantic import BaseModel, computed_field
@@ -12,6 +14,8 @@ from ezpod.PodDataProtocol import BMPMeta, InstanceData
 from ezpod.runpodctl_executor import runpod_info, runpod_run
 
 PURGED_POD_IDS = []
+# how many provider calls bulk removal makes at once
+TERMINATE_CONCURRENCY = int(os.environ.get("EZPOD_TERMINATE_CONCURRENCY", 16))
 
 
 class PodData(BaseModel):
@@ -97,13 +101,12 @@ class PodData(BaseModel):
         return addr[0]
 
     @classmethod
-    def get_all(cls) -> list["PodData"]:
+    def get_all(cls, group: str | None = None) -> list["PodData"]:
+        """Every pod; on AWS only those of ``group``, if given, are listed."""
         if BACKEND_AWS:
-            from .ec2_data import EC2Data
-            import os
+            from .ec2_data import EC2InstanceData
 
-            region = os.environ.get("EZPOD_AWS_REGION", None)
-            return EC2Data.get_all_pods(region)
+            return EC2InstanceData.get_all(group)
         for i in range(100):
             try:
                 return cls._get_all()
@@ -159,6 +162,29 @@ class PodData(BaseModel):
     def remove_pod(self):
         return runpod_run(f"remove pod {self.id}")
 
+    @classmethod
+    def remove_pods(cls, datas: list["PodData"]) -> list[str]:
+        """Remove pods, TERMINATE_CONCURRENCY at a time, retrying each once.
+        Returns the ids of pods that could not be removed."""
+
+        def remove(data: "PodData") -> tuple[bool, str]:
+            r = data.remove_pod()
+            if r.stderr:
+                r = data.remove_pod()
+            if r.stderr:
+                return False, f"error removing pod: {r.stderr.decode().strip()}"
+            return True, r.stdout.decode().strip()
+
+        failed = []
+        with ThreadPoolExecutor(TERMINATE_CONCURRENCY) as pool:
+            # printed from here, since lines printed from the threads interleave
+            for data, (ok, message) in zip(datas, pool.map(remove, datas)):
+                if message:
+                    print(f"{data.name}: {message}")
+                if not ok:
+                    failed.append(data.id)
+        return failed
+
     @property
     def is_running(self) -> bool:
         return self.status.lower() == "running"
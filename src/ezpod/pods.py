@@ -1,15 +1,53 @@
 import asyncio
+import hashlib
 import os
+import shutil
+import subprocess
+import sys
+import threading
 import time
 from collections import deque
 from datetime import datetime
 from functools import cached_property
+from pathlib import Path
 from typing import Any, Coroutine, Optional
 
-from ezpod.create_pods import PodCreationConfig
-from ezpod.pod import Pod, PodOutput
+from ezpod.backend_aws_env_var import env_flag
+from ezpod.bringup import BringUp, bring_up
+from ezpod.create_pods import PodCreationConfig, RunPodCreationConfig
+from ezpod.events import (
+    AddressAssigned,
+    PodEvents,
+    PodGone,
+    PodReady,
+    StatusChanged,
+    is_ready,
+    ssh_addr,
+)
+from ezpod.fanout import VERBOSE, FanOut, Job
+from ezpod.inventory import INVENTORY
+from ezpod.manifest import (
+    Manifest,
+    prune_manifests,
+    scan_project,
+)
+from ezpod.pod import INTERPRETER_TAGS, Pod, PodOutput
 from ezpod.pod_data import PodData, PURGED_POD_IDS
+from ezpod.PodDataProtocol import InstanceData
+from ezpod.relay import RelayTree
 from ezpod.runproject import RunFolder, RunProject
+from ezpod.scheduler import CommandResult, HedgePolicy, WorkQueue
+from ezpod.shell_local_data import STATE_DIR
+from ezpod.ssh_pool import POOL, PoolStats
+from ezpod.sync import RsyncResult, SyncEngine
+from ezpod.syncplan import SyncPlan
+from ezpod.terminate import terminate
+from ezpod.volume_sync import copy_from_volume, upload_version
+from ezpod.watch import watch
+
+# bounds for how often wait_pending polls the inventory (seconds)
+POLL_MIN_INTERVAL = float(os.environ.get("EZPOD_POLL_MIN_INTERVAL", 0.5))
+POLL_MAX_INTERVAL = float(os.environ.get("EZPOD_POLL_MAX_INTERVAL", 10))
 
 
 class Pods:
@@ -31,6 +69,11 @@ class Pods:
         self.EZPOD_MIN_COMPLETE_TO_CONTINUE = None
         self._output_max_lines = 1000
         self.group = group
+        self.fanout = FanOut()
+        # lifecycle events from update(), see ezpod.events
+        self.events = PodEvents()
+        self._ready = {pod.data.id for pod in pods if is_ready(pod.data)}
+        self._gone: set[str] = set()
 
     @cached_property
     def new_pods_config(self) -> Optional[PodCreationConfig]:
@@ -54,24 +97,88 @@ class Pods:
         outputs: dict[Pod, PodOutput] | None = None,
         in_folder=True,
         purge_after=False,
+        hedge: HedgePolicy | None = None,
     ):
         self.wait_pending()
         loop = asyncio.get_event_loop()
-        outputs = outputs if outputs is not None else self.make_outputs(cmd)
+        loop.run_until_complete(
+            self.arun(cmd, outputs, in_folder, purge_after, hedge=hedge)
+        )
+        if VERBOSE:
+            print(POOL.stats)
+            self.print_cache_report()
+
+    async def arun(
+        self,
+        cmd: str | list[str],
+        outputs: dict[Pod, PodOutput] | None = None,
+        in_folder=True,
+        purge_after=False,
+        hedge: HedgePolicy | None = None,
+    ):
+        if hedge is not None:
+            # Hedging only makes sense for distinct commands, which are then
+            # free to run on any pod.
+            if not isinstance(cmd, list):
+                raise ValueError("hedging requires a list of commands")
+            if outputs is not None or purge_after:
+                # a hedged command may run on any pod, or on two at once
+                raise ValueError("hedging doesn't support outputs or purge_after")
+            assert len(cmd) == len(self.pods), f"{len(cmd)} != {len(self.pods)}"
+            return await self.amap(cmd, in_folder, hedge)
+        return await self.fanout.run(
+            self._fan_out_jobs(cmd, outputs, in_folder, purge_after)
+        )
+
+    def _commands_per_pod(self, cmd: str | list[str]) -> list[tuple[Pod, str]]:
         if isinstance(cmd, str):
-            tasks = [
-                loop.create_task(pod.run_async(cmd, in_folder, purge_after))
-                for pod in self.pods
-            ]
+            return [(pod, cmd) for pod in self.pods]
         elif isinstance(cmd, list) and all(isinstance(c, str) for c in cmd):
-            assert len(cmd) == len(self.pods)
-            tasks = [
-                loop.create_task(pod.run_async(c, in_folder, purge_after))
-                for pod, c in zip(self.pods, cmd)
-            ]
-        else:
-            raise ValueError(f"Invalid command type: {type(cmd)}")
-        loop.run_until_complete(asyncio.gather(*tasks))
+            assert len(cmd) == len(self.pods), f"{len(cmd)} != {len(self.pods)}"
+            return list(zip(self.pods, cmd))
+        raise ValueError(f"Invalid command type: {type(cmd)}")
+
+    def _fan_out_jobs(
+        self,
+        cmd: str | list[str],
+        outputs: dict[Pod, PodOutput] | None = None,
+        in_folder=True,
+        purge_after=False,
+    ) -> list[Job]:
+        outputs = outputs or {}
+        return [
+            (
+                pod,
+                lambda pod=pod, c=c: pod.run_async(
+                    c, in_folder, purge_after, output=outputs.get(pod)
+                ),
+            )
+            for pod, c in self._commands_per_pod(cmd)
+        ]
+
+    def map(
+        self,
+        commands: list[str],
+        in_folder=True,
+        hedge: HedgePolicy | None = None,
+    ) -> list[CommandResult]:
+        """Run each command once, handing the next one to whichever pod is
+        idle. Results are returned in the order of ``commands``.
+
+        With ``hedge``, idle pods re-launch commands running past the policy's
+        deadline; the first copy to finish wins."""
+        self.wait_pending()
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(self.amap(commands, in_folder, hedge))
+
+    async def amap(
+        self,
+        commands: list[str],
+        in_folder=True,
+        hedge: HedgePolicy | None = None,
+    ) -> list[CommandResult]:
+        queue = WorkQueue(self.pods, self.fanout, in_folder=in_folder, hedge=hedge)
+        return await queue.run(commands)
 
     def to_py_cmd(
         self, cmd: str | list[str], challenge_file: str | None = None, prefix_vars=None
@@ -116,9 +223,7 @@ class Pods:
     ):
         self.run_manual_challenge_file(challenge_file, stop_after_n_complete)
         assert not any(p.output is None for p in self.pods)
-        for p in self.pods:
-            if p.output.end_time is None:
-                p.remove()
+        unfinished = [p for p in self.pods if p.output.end_time is None]
         speeds = [
             (p.output.end_time - p.output.start_time, p)
             for p in self.pods
@@ -129,8 +234,7 @@ class Pods:
         speeds.sort()
         sorted_pods = [p for _, p in speeds]
         keep, toss = sorted_pods[:n], sorted_pods[n:]
-        for badpod in toss:
-            badpod.remove()
+        self.remove_pods(unfinished + toss)
 
         return speeds
 
@@ -144,25 +248,15 @@ class Pods:
             monitor = monitor(self)
         loop = asyncio.get_event_loop()
         tasks: list[asyncio.Task | Coroutine[Any, Any, None]] = []
-        if isinstance(cmd, str):
-            tasks = [
-                loop.create_task(
-                    pod.run_async(cmd, in_folder=in_folder, purge_after=purge_after)
-                )
-                for pod in self.pods
-            ]
-        elif isinstance(cmd, list) and all(isinstance(c, str) for c in cmd):
-            assert len(cmd) == len(self.pods), f"{len(cmd)} != {len(self.pods)}"
-            tasks = [
-                loop.create_task(
-                    pod.run_async(c, in_folder=in_folder, purge_after=purge_after)
-                )
-                for pod, c in zip(self.pods, cmd)
-            ]
-        else:
-            raise ValueError(f"Invalid command type: {type(cmd)}")
+        tasks.extend(
+            self.fanout.create_tasks(
+                self._fan_out_jobs(cmd, in_folder=in_folder, purge_after=purge_after)
+            )
+        )
         tasks.append(monitor)
         loop.run_until_complete(asyncio.gather(*tasks))
+        if VERBOSE:
+            print(self.fanout.stats)
 
     async def run_async_with_monitor_and_timeout(
         self,
@@ -180,21 +274,9 @@ class Pods:
             monitor = monitor(self)
 
         loop = asyncio.get_event_loop()
-        tasks: list[asyncio.Task] = []
-
-        if isinstance(cmd, str):
-            tasks = [
-                loop.create_task(pod.run_async(cmd, in_folder, purge_after))
-                for pod in self.pods
-            ]
-        elif isinstance(cmd, list) and all(isinstance(c, str) for c in cmd):
-            assert len(cmd) == len(self.pods), f"{len(cmd)} != {len(self.pods)}"
-            tasks = [
-                loop.create_task(pod.run_async(c, in_folder, purge_after))
-                for pod, c in zip(self.pods, cmd)
-            ]
-        else:
-            raise ValueError(f"Invalid command type: {type(cmd)}")
+        tasks = self.fanout.create_tasks(
+            self._fan_out_jobs(cmd, in_folder=in_folder, purge_after=purge_after)
+        )
 
         monitor_task = loop.create_task(monitor)
         all_tasks = tasks + [monitor_task]
@@ -233,6 +315,8 @@ class Pods:
             await asyncio.gather(*all_tasks, return_exceptions=True)
         except asyncio.CancelledError:
             pass
+        if VERBOSE:
+            print(self.fanout.stats)
 
     def runpy_with_monitor(
         self,
@@ -250,43 +334,247 @@ class Pods:
             purge_after=purge_after,
         )
 
-    def sync(self):
-        self.sync_async()
+    def sync(
+        self, relay_width: int | None = None, force=False, via_volume: bool = False
+    ):
+        """Sync the project folder to every pod. Pods already synced with the
+        current state of the folder are skipped unless ``force``.
+
+        relay_width: if set (or EZPOD_SYNC_RELAY_WIDTH is), only sync a few
+            pods from here and let pods relay the project on to each other,
+            each pushing to up to ``relay_width`` pods at a time.
+        via_volume: if set (or EZPOD_SYNC_VIA_VOLUME is), upload once to the
+            RunPod network volume the pods share and copy from there.
+        """
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.async_sync(relay_width, force, via_volume))
 
-    def sync_async(self, prev_failed=False):
-        self.wait_pending()
-        print("syncing...")
-        promises = []
-        for pod in self.pods:
-            promise = pod.sync_folder_async()
-            promises.append(promise)
-        print("all syncs started, waiting")
+    async def async_sync(
+        self, relay_width: int | None = None, force=False, via_volume: bool = False
+    ):
+        relay_width = relay_width or int(os.environ.get("EZPOD_SYNC_RELAY_WIDTH", 0))
+        via_volume = via_volume or env_flag("EZPOD_SYNC_VIA_VOLUME")
+        if via_volume:
+            await self.async_volume_sync(force=force)
+        elif relay_width and len(self.pods) > relay_width:
+            await self.async_relay_sync(relay_width, force=force)
+        else:
+            await self.async_direct_sync(force=force)
+
+    async def _sync_plan(
+        self, force=False
+    ) -> tuple[SyncPlan, Manifest, dict[Pod, str]]:
+        """Compile the folder's sync plan once for all pods. Returns it, the
+        local manifest and, for each pod that is not up to date, the path of
+        the ``--files-from`` list to send it: the files changed since the
+        state in its sync marker, or the whole plan. Keep the plan alive while
+        the lists are used.
+        """
+        folder = self.project.folder
+        sync_plan = await asyncio.to_thread(SyncPlan.compile, folder)
+        manifest = await asyncio.to_thread(scan_project, folder.local, sync_plan.files)
+        synced: list[str | None | BaseException] = [None] * len(self.pods)
+        if not force:
+            # the pod's own marker, not what we remember sending it: its
+            # folder may have been deleted or replaced since
+            jobs = [(pod, pod.synced_digest_async) for pod in self.pods]
+            synced = await asyncio.gather(
+                *self.fanout.create_tasks(jobs), return_exceptions=True
+            )
+        plan: dict[Pod, str] = {}
+        current: list[Pod] = []
+        for pod, last in zip(self.pods, synced):
+            if not isinstance(last, str):
+                last = None
+            if last == manifest.digest:
+                continue
+            previous = Manifest.load(last) if last is not None else None
+            if previous is None:
+                plan[pod] = sync_plan.file_list()
+            else:
+                # pods last synced to the same state share one list
+                changed = manifest.changed_since(previous)
+                if not changed:  # only deletions, which sync doesn't propagate
+                    current.append(pod)
+                    continue
+                plan[pod] = sync_plan.file_list(changed, name=last)
+        await asyncio.gather(*(pod.record_synced_async(manifest) for pod in current))
+        skipped = len(self.pods) - len(plan)
+        if skipped:
+            print(f"{skipped}/{len(self.pods)} pods already up to date")
+        return sync_plan, manifest, plan
+
+    def relay_sync(self, width: int, force=False):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.async_relay_sync(width, force=force))
+
+    async def async_relay_sync(self, width: int, force=False):
+        await asyncio.to_thread(self.wait_pending)
+        sync_plan, manifest, plan = await self._sync_plan(force)
+        remote_name = self.project.folder.remote_name
+        if not plan:
+            return
+
+        async def seed_sync(pod: Pod):
+            await pod.sync_folder_async(files_from=plan[pod])
+
+        tree = RelayTree(list(plan), remote_name, seed_sync, plan, self.fanout, width)
+        failed = await tree.run()
+        await asyncio.gather(
+            *(pod.record_synced_async(manifest) for pod in tree.synced)
+        )
+        prune_manifests()
+        if failed:
+            print(f"{len(failed)} pods were not reached by the relay, syncing directly")
+            await Pods(
+                self.project,
+                failed,
+                group=self.group,
+                new_pods_config=self.new_pods_config,
+            ).async_direct_sync()
+
+    def _volume_mount_path(self) -> str:
+        config = self.new_pods_config
+        if not isinstance(config, RunPodCreationConfig) or not config.volume_id:
+            raise Exception("volume sync needs a RunPod profile with a volume_id")
+        return config.volume_mount_path
+
+    def volume_sync(self, force=False):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.async_volume_sync(force=force))
+
+    async def async_volume_sync(self, force=False):
+        await asyncio.to_thread(self.wait_pending)
+        mount_path = self._volume_mount_path()
+        sync_plan, manifest, plan = await self._sync_plan(force)
+        remote_name = self.project.folder.remote_name
+        if not plan:
+            return
+        pods = list(plan)
         try:
-            for promise in promises:
-                promise.join()
+            version = await upload_version(
+                pods[0], mount_path, remote_name, manifest, sync_plan.file_list()
+            )
         except Exception as e:
-            if prev_failed:
-                raise e
-            print(f"failed sync with exception: {e}, retrying in 5 seconds...")
-            time.sleep(5)
-            self.sync_async(prev_failed=True)
-        print("all syncs completed")
+            print(f"upload to the volume failed ({e}), syncing pods directly")
+            await self.async_direct_sync(force=force)
+            return
+
+        async def copy(pod: Pod) -> RsyncResult:
+            result = await copy_from_volume(pod, version, remote_name)
+            await pod.record_synced_async(manifest)
+            return result
+
+        results = await SyncEngine().run(pods, copy, name=lambda pod: pod.data.name)
+        prune_manifests()
+        failed = [pod for pod, r in results.items() if isinstance(r, BaseException)]
+        if failed:
+            print(
+                f"{len(failed)} pods could not copy from the volume, syncing directly"
+            )
+            await Pods(
+                self.project,
+                failed,
+                group=self.group,
+                new_pods_config=self.new_pods_config,
+            ).async_direct_sync(force=force)
+
+    def sync_async(self, force=False):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.async_direct_sync(force=force))
+
+    async def async_direct_sync(self, force=False):
+        """Rsync the project from here to every pod that isn't up to date."""
+        await asyncio.to_thread(self.wait_pending)
+        sync_plan, manifest, plan = await self._sync_plan(force)
+        if not plan:
+            return
+
+        async def sync_pod(pod: Pod) -> RsyncResult:
+            result = await pod.sync_folder_async(files_from=plan[pod])
+            await pod.record_synced_async(manifest)
+            return result
+
+        print("syncing...")
+        results = await SyncEngine().run(
+            list(plan), sync_pod, name=lambda pod: pod.data.name
+        )
+        prune_manifests()
+        failed = [
+            pod.data.name for pod, r in results.items() if isinstance(r, BaseException)
+        ]
+        if failed:
+            raise Exception(f"sync failed on {failed}")
         print("done")
 
-    def make_outputs(self, command: str):
-        return {
-            p: PodOutput(
-                command=command,
-                stdout=deque(maxlen=self._output_max_lines),
-                stderr=deque(maxlen=self._output_max_lines),
-                start_time=datetime.now(),
-                is_running=True,
-            )
-            for p in self.pods
-        }
+    def watch(self):
+        """Sync, then keep pushing local changes to the pods until Ctrl-C."""
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(self.async_watch())
+        except KeyboardInterrupt:
+            print("stopped watching")
+
+    async def async_watch(self):
+        await self.async_sync()
+        await watch(self.pods, self.project.folder)
+
+    def cache_report(self) -> dict[str, dict[str, int]]:
+        """Count remote cache hits/misses (see PodOutput.cache) in each pod's
+        latest output, by cache name."""
+        counts: dict[str, dict[str, int]] = {}
+        for pod in self.pods:
+            if pod.output is None:
+                continue
+            for key, value in pod.output.cache.items():
+                status = value.split()[0]
+                by_status = counts.setdefault(key, {})
+                by_status[status] = by_status.get(status, 0) + 1
+        return counts
+
+    def print_cache_report(self):
+        for key, by_status in self.cache_report().items():
+            summary = ", ".join(f"{n} {status}" for status, n in by_status.items())
+            print(f"{key} cache: {summary}")
+
+    @property
+    def connection_stats(self) -> PoolStats:
+        return POOL.stats
+
+    def close_connections(self):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(POOL.close_all())
+
+    def make_output(self, command: str) -> PodOutput:
+        return PodOutput(
+            command=command,
+            stdout=deque(maxlen=self._output_max_lines),
+            stderr=deque(maxlen=self._output_max_lines),
+            start_time=datetime.now(),
+            is_running=True,
+        )
 
-    def setup(self):
+    def make_outputs(self, command: str):
+        return {p: self.make_output(command) for p in self.pods}
+
+    def setup(self, force=False, wheelhouse: str | None = None):
+        """Install the project on every pod. Pods whose dependency spec files
+        and interpreter are unchanged since their last setup are skipped,
+        unless ``force``.
+
+        wheelhouse: "local" or "pod" to build all wheels once (on this machine,
+            or on the first pod) and sync them to the fleet, so pods install
+            with --no-index instead of each hitting PyPI. Defaults to
+            EZPOD_SETUP_WHEELHOUSE.
+        """
+        wheelhouse = wheelhouse or os.environ.get("EZPOD_SETUP_WHEELHOUSE", None)
         self.sync()
+        if wheelhouse:
+            needing = self.pods if force else self._pods_needing_setup()
+            if needing:
+                self.build_wheelhouse(wheelhouse, needing)
+            else:
+                print("every pod is set up already, not building a wheelhouse")
         # # self.wait_pending()
         # print(f"setting up all pods")
         # joins = [pod.setup() for pod in self.pods]
@@ -305,7 +593,10 @@ class Pods:
         wait_extra = 10
         outputs = self.make_outputs("<run setup>")
         tasks = [
-            loop.create_task(pod.setup_async(outputs[pod]), name=str(i))
+            loop.create_task(
+                pod.setup_async(outputs[pod], force, wheelhouse=bool(wheelhouse)),
+                name=str(i),
+            )
             for i, pod in enumerate(self.pods)
         ]
         print("beginning setups, waiting for them to complete...")
@@ -327,8 +618,9 @@ class Pods:
             print(
                 f"waiting for {len(wips)} pods to finish setup. {len(dones)} complete."
             )
-        for done in dones:
-            print("result", done.result())
+        self.print_setup_report(
+            outputs, [self.pods[int(done.get_name())] for done in dones]
+        )
         assert wips is not None
         to_cancel: set[Pod] = set()
         for wip in wips:
@@ -336,9 +628,98 @@ class Pods:
             print(f"Pod {i} setup timed out.")
             to_cancel.add(self.pods[i])
             wip.cancel()
-        for pod in to_cancel:
-            self._remove_pod(pod)
-            pod.remove()
+        self.remove_pods(list(to_cancel))
+
+    def _local_wheelhouse(self) -> Path:
+        """Where this machine keeps the project's wheels: in ezpod's state
+        dir, not the project, so they stay out of git and the sync plan."""
+        folder = self.project.folder
+        key = hashlib.sha1(str(folder.local.resolve()).encode()).hexdigest()[:12]
+        return STATE_DIR.parent / "wheelhouse" / key / folder.remote_name
+
+    def _pods_needing_setup(self) -> list[Pod]:
+        """The pods whose setup marker is out of date (or couldn't be read)."""
+        loop = asyncio.get_event_loop()
+        jobs = [(pod, pod.needs_setup_async) for pod in self.pods]
+        results = loop.run_until_complete(
+            asyncio.gather(*self.fanout.create_tasks(jobs), return_exceptions=True)
+        )
+        return [pod for pod, needs in zip(self.pods, results) if needs is not False]
+
+    def build_wheelhouse(self, where: str, pods: list[Pod] | None = None):
+        """Build the project's wheels once, here or on the first pod, then
+        push them to the wheelhouse of ``pods`` (default: every pod).
+
+        Wheels are only built here if this machine's python matches the
+        pods' (see pod.INTERPRETER_TAGS); otherwise they're built on a pod.
+        """
+        pods = pods or self.pods
+        assert pods, "no pods to set up"
+        local = self._local_wheelhouse()
+        shutil.rmtree(local, ignore_errors=True)
+        local.parent.mkdir(parents=True, exist_ok=True)
+        loop = asyncio.get_event_loop()
+        if where == "local":
+            theirs = loop.run_until_complete(pods[0].interpreter_tags_async())
+            ours = subprocess.run(
+                [sys.executable, "-c", f"{INTERPRETER_TAGS}; print(*tags)"],
+                capture_output=True,
+                text=True,
+            ).stdout.strip()
+            if theirs != ours:
+                print(
+                    f"this machine's python ({ours}) doesn't match the pods' "
+                    f"({theirs}), building the wheelhouse on a pod"
+                )
+                where = "pod"
+        if where == "local":
+            cmd = pods[0].wheelhouse_build_cmd(str(local), py=sys.executable)
+            print(f"building wheelhouse locally: {cmd}")
+            subprocess.run(cmd, shell=True, check=True, cwd=pods[0].folder)
+        elif where == "pod":
+            builder = pods[0]
+            wheelhouse = f"$HOME/{builder.wheelhouse}"
+            cmd = f"rm -rf {wheelhouse}; {builder.wheelhouse_build_cmd(wheelhouse)}"
+            print(f"building wheelhouse on {builder.data.name}: {cmd}")
+            output = loop.run_until_complete(builder.run_async(cmd))
+            if output is None or output.return_code is None:
+                raise Exception(f"Wheelhouse build on {builder.data.name} failed.")
+            if output.return_code.returncode != 0:
+                print("".join(output.stderr))
+                raise Exception(f"Wheelhouse build on {builder.data.name} failed.")
+            # lands in local, named after the pod's directory
+            loop.run_until_complete(
+                builder.download_async(builder.wheelhouse, local.parent)
+            )
+        else:
+            raise ValueError(f"Unknown wheelhouse location: {where}")
+        engine: SyncEngine[Pod] = SyncEngine()
+        results = loop.run_until_complete(
+            engine.run(
+                pods,
+                lambda pod: pod.push_wheelhouse_async(local),
+                name=lambda pod: f"{pod.data.name} wheelhouse",
+            )
+        )
+        failed = [p.data.name for p, r in results.items() if isinstance(r, Exception)]
+        if failed:
+            print(f"Warning: no wheelhouse on {failed}, their setup will fail")
+
+    def print_setup_report(self, outputs: dict[Pod, PodOutput], done: list[Pod]):
+        saved = 0
+        for pod in done:
+            output = outputs[pod]
+            code = output.return_code.returncode if output.return_code else None
+            status = output.cache.get("setup", "").split()
+            if status and status[0] == "hit":
+                prev = int(status[1]) if len(status) > 1 and status[1] else 0
+                saved += prev
+                print(f"{pod.data.name}: cached (saved ~{prev}s)")
+            else:
+                assert output.end_time is not None
+                took = (output.end_time - output.start_time).total_seconds()
+                print(f"{pod.data.name}: installed in {took:.0f}s (code: {code})")
+        print(f"setup cache saved ~{saved}s of pod time.")
 
     def add_pod(self, pod: Pod):
         if pod.data.id in self.by_id:
@@ -372,18 +753,44 @@ class Pods:
     def wait_pending(self):
         if self.pending:
             print(f"Waiting for {len(self.pending)} pods to initialize...")
+        delay = POLL_MIN_INTERVAL
         while self.pending:
             for purged in PURGED_POD_IDS:
                 if purged in self.pending:
                     self.pending.remove(purged)
-            self.update()
-            time.sleep(0.1)
+            n_pending = len(self.pending)
+            self.update(max_age=delay)
+            if not self.pending:
+                break
+            # poll quickly while pods are coming up, back off while none are
+            if len(self.pending) < n_pending:
+                delay = POLL_MIN_INTERVAL
+            else:
+                delay = min(delay * 2, POLL_MAX_INTERVAL)
+            time.sleep(delay)
         for purged in PURGED_POD_IDS:
             if purged in self.by_id:
                 self._remove_pod(self.by_id[purged])
 
-    def update(self):
-        datas = PodData.get_all()
+    def wait_ready(self, ids: set[str], stop: threading.Event | None = None):
+        """Poll the inventory, backing off like wait_pending, until the pods
+        with ``ids`` are ready (see ezpod.events) or ``stop`` is set."""
+        stop = stop or threading.Event()
+        delay = POLL_MIN_INTERVAL
+        while not stop.is_set() and not ids <= self._ready:
+            n_ready = len(ids & self._ready)
+            self.update(max_age=delay)
+            if len(ids & self._ready) > n_ready:
+                delay = POLL_MIN_INTERVAL
+            else:
+                delay = min(delay * 2, POLL_MAX_INTERVAL)
+            stop.wait(delay)
+
+    def update(self, max_age: float | None = None):
+        """Refresh pods from the inventory (see ezpod.inventory), using a
+        listing at most ``max_age`` seconds old, and emit lifecycle events
+        for what changed."""
+        datas = INVENTORY.get(max_age, self.group)
         by_id = {data.id: data for data in datas}
         had = set(self.by_id.keys())
         got = set(by_id.keys())
@@ -396,14 +803,32 @@ class Pods:
             for id in disappeared:
                 print(f"Warning: {self.by_id[id].data.name} with id {id} disappeared.")
                 # self.by_id.pop(id)
-        for id, pod in self.by_id.items():
+        for id in disappeared - self._gone:
+            self.events.emit(PodGone(self.by_id[id]))
+        self._gone = disappeared
+        for id, pod in list(self.by_id.items()):
             if id not in by_id:
                 continue
+            old = pod.data
             pod.update(by_id[id])
+            self._emit_changes(pod, old)
         finished_init = pend & got
         if finished_init:
             for id in finished_init:
-                self.add_pod(self.pod_from_data(by_id[id]))
+                pod = self.pod_from_data(by_id[id])
+                self.add_pod(pod)
+                self._emit_changes(pod, None)
+
+    def _emit_changes(self, pod: Pod, old: Optional[InstanceData]):
+        new = pod.data
+        if old is not None and old.status != new.status:
+            self.events.emit(StatusChanged(pod, old.status, new.status))
+        addr = ssh_addr(new)
+        if addr is not None and (old is None or ssh_addr(old) != addr):
+            self.events.emit(AddressAssigned(pod, addr))
+        if new.id not in self._ready and is_ready(new):
+            self._ready.add(new.id)
+            self.events.emit(PodReady(pod))
 
     def pod_from_data(self, data: PodData) -> Pod:
         return Pod(
@@ -417,13 +842,17 @@ class Pods:
         project: Optional[RunProject] = None,
         new_pods_config: Optional[PodCreationConfig] = None,
         group: Optional[str] = None,
+        cached: bool = False,
     ) -> "Pods":
+        """cached: allow answering from a recent on-disk inventory snapshot
+        (see ezpod.inventory), for read-only uses."""
         if project is None:
             project = RunProject(folder=RunFolder.cwd())
 
-        poddatas = PodData.get_all()
-        if group is not None:
-            poddatas = [pd for pd in poddatas if pd.podname.group == group]
+        if cached:
+            poddatas = INVENTORY.get_cached(group=group)
+        else:
+            poddatas = INVENTORY.get(group=group)
         pods = [Pod(project=project, data=pd) for pd in poddatas]
         return cls(
             project=project, pods=pods, new_pods_config=new_pods_config, group=group
@@ -455,7 +884,7 @@ class Pods:
         assert False  # TODO
         if project is None:
             project = RunProject(folder=RunFolder.cwd())
-        poddatas = PodData.get_all()
+        poddatas = INVENTORY.get()
         pods = [Pod(project=project, data=pd) for pd in poddatas]
         return cls(project=project, pods=pods, new_pods_config=new_pods_config)
 
@@ -468,42 +897,47 @@ class Pods:
             [pod.data.podname.num for pod in allpods.pods],
             default=-1,
         )
-        for i in range(n):
-            # Use the unified backend‑agnostic create() call.  It may return a
-            # backend specific identifier or a subprocess.CompletedProcess in
-            # the case of runpodctl.  We try to capture a pod/instance id when
-            # possible so that `wait_pending` can keep track of initialisation.
-
-            res = self.new_pods_config.create(f"{group}{current_largest_n + i + 1}")
-
-            # For the original RunPod backend the return value was a
-            # CompletedProcess; we parse its stdout to extract the pod ID so
-            # that the rest of the existing code keeps working without
-            # modifications.
-            pod_id: str | None = None
-            if isinstance(res, str):
-                pod_id = res
-            elif hasattr(res, "stdout"):
-                out = str(res.stdout)
-                if 'pod "' in out and '" created' in out:
-                    pod_id = out.split('pod "')[1].split('" created')[0]
-
-            if pod_id is not None:
-                self.pending.append(pod_id)
+        # created concurrently (RunPod) or in one launch call (AWS); the ids
+        # let `wait_pending` keep track of initialisation
+        names = [f"{group}{current_largest_n + i + 1}" for i in range(n)]
+        ids = self.new_pods_config.create_many(names)
+        self.pending.extend(pod_id for pod_id in ids if pod_id is not None)
+        if None in ids:
+            print(f"Warning: {ids.count(None)}/{n} new pods can't be tracked.")
+        INVENTORY.invalidate()
+
+    def bring_up(
+        self,
+        n: int,
+        cmd: Optional[str] = None,
+        min_complete: Optional[int] = None,
+        timeout: Optional[float] = None,
+        force_setup=False,
+    ) -> dict[Pod, BringUp]:
+        """Make ``n`` pods, then sync, set up and run ``cmd`` on each one as
+        soon as it is ready instead of waiting for the whole fleet at every
+        step. See ezpod.bringup."""
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(
+            bring_up(self, n, cmd, min_complete, timeout, force_setup)
+        )
+
+    def remove_pods(self, pods: list[Pod]) -> list[Pod]:
+        """Remove ``pods`` from the fleet and the provider, in bulk (see
+        ezpod.terminate). Returns the pods that could not be removed."""
+        for pod in pods:
+            self._remove_pod(pod)
+        return terminate(pods)
 
     def purge(self):
-        for pod in self.pods:
-            pod.remove()
-        self.pods = []
-        self.by_id = {}
-        self.by_name = {}
+        left = self.remove_pods(list(self.pods))
         self.wait_pending()
-        for pod in self.pods:
-            pod.remove()
+        # pods that finished initialising in the meantime
+        left += self.remove_pods(list(self.pods))
         self.pods = []
         self.by_id = {}
         self.by_name = {}
-        assert len(PodData.get_all()) == 0
+        assert not left, f"pods left after purge: {left}"
 
     def get_running_pods(self) -> list[Pod]:
         """Get list of pods that are currently running commands"""
@@ -561,6 +995,17 @@ class Pods:
             self.project, pods_l, group=self.group, new_pods_config=self.new_pods_config
         )
 
+    def select(self, spec: str) -> "Pods":
+        """The pods picked by a CLI ``--i`` spec: an index, a ``start-stop``
+        range or a pod name."""
+        if not spec:
+            return self
+        if "-" in spec:
+            return self[slice(*[None if n == "" else int(n) for n in spec.split("-")])]
+        if spec.isnumeric():
+            return self[int(spec)]
+        return self[spec]
+
     def get_alive(self) -> "Pods":
         pods = [pod for pod in self.pods if pod.data.is_running]
         return Pods(
@@ -0,0 +1,233 @@
+"""Relay-tree fan-out for syncing a project to many pods.
+
+Syncing every pod straight from this machine makes the local uplink the
+bottleneck: N pods cost N uploads.  In relay mode this machine only uploads
+to a few seed pods, and every pod that has the project then rsyncs it on to
+further pods, pod to pod, so the number of pods holding the project roughly
+multiplies by ``width + 1`` each round and total time grows with log(N).
+
+Pods authenticate to each other with a relay key made for each sync.  Its
+public half is authorized on every pod; its private half only goes to the
+pods that push to others.  Both are removed from the pods when the sync ends,
+so a pod can't log into the others afterwards.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
+
+import asyncssh
+
+from ezpod.ssh_pool import POOL
+from ezpod.sync import RSYNC_FLAGS
+
+if TYPE_CHECKING:
+    from ezpod.fanout import FanOut
+    from ezpod.pod import Pod
+
+REMOTE_LISTS_DIR = "$HOME/.ezpod/relay_lists"
+# the key older versions kept on every pod, removed along with a sync's key
+LEGACY_RELAY_KEY = "~/.ssh/ezpod_relay"
+
+
+class RelayKey:
+    """A relay key for one sync."""
+
+    def __init__(self):
+        tag = uuid.uuid4().hex[:12]
+        key = asyncssh.generate_private_key("ssh-ed25519", comment=f"ezpod-relay-{tag}")
+        self.private = key.export_private_key().decode()
+        self.public = key.export_public_key().decode().strip()
+        self.remote_path = f"~/.ssh/ezpod_relay_{tag}"
+
+    def authorize_cmd(self) -> str:
+        return (
+            "mkdir -p ~/.ssh && chmod 700 ~/.ssh && "
+            f'echo "{self.public}" >> ~/.ssh/authorized_keys'
+        )
+
+    def install_cmd(self) -> str:
+        """Reads the private key from stdin."""
+        return (
+            "mkdir -p ~/.ssh && chmod 700 ~/.ssh && "
+            f"cat > {self.remote_path} && chmod 600 {self.remote_path}"
+        )
+
+    def remove_cmd(self) -> str:
+        """Removes the key, and the relay key of older versions, from a pod."""
+        keys = "~/.ssh/authorized_keys"
+        return (
+            f"rm -f {self.remote_path} {LEGACY_RELAY_KEY}; "
+            f"if [ -f {keys} ]; then "
+            f'grep -vxF "{self.public}" {keys} | grep -v " ezpod-relay$" > {keys}.ezpod; '
+            f"mv {keys}.ezpod {keys} && chmod 600 {keys}; fi"
+        )
+
+
+def pod_to_pod_rsync_cmd(
+    source: "Pod", target: "Pod", remote_name: str, files_from: str, key_path: str
+) -> str:
+    """files_from: path, on ``source``, of the list of files to send, so only
+    the planned files are relayed, not whatever the pod has generated.
+    key_path: the relay key's path on ``source``."""
+    addr = target.data.sshaddr
+    ssh = (
+        f"ssh -i {key_path} -p {addr.port} "
+        "-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null"
+    )
+    src = f"{source.data.sshaddr.homedir}/{remote_name}/"
+    dest = f"{addr.user}@{addr.ip}:{addr.homedir}/{remote_name}/"
+    flags = " ".join(RSYNC_FLAGS)
+    return f'rsync {flags} --files-from={files_from} -e "{ssh}" {src} {dest}'
+
+
+class RelayTree:
+    def __init__(
+        self,
+        pods: list["Pod"],
+        remote_name: str,
+        seed_sync: Callable[["Pod"], Awaitable[None]],
+        files_from: dict["Pod", str],
+        fanout: "FanOut",
+        width: int = 2,
+    ):
+        """
+        seed_sync: syncs one pod directly from this machine.
+        files_from: the local ``--files-from`` list of each pod (see SyncPlan).
+        fanout: limits authorizing and removing the relay key on every pod.
+        width: how many pods each pod (and this machine) pushes to at a time.
+        """
+        self.pods = pods
+        self.remote_name = remote_name
+        self.seed_sync = seed_sync
+        self.files_from = files_from
+        self.fanout = fanout
+        self.width = width
+        self.key = RelayKey()
+        # (source pod id, local list) -> upload of the list, to its path on the
+        # source pod
+        self._remote_lists: dict[tuple[str, str], asyncio.Future[str]] = {}
+        # source pod id -> upload of the private key to it
+        self._key_uploads: dict[str, asyncio.Future] = {}
+        self.synced: list["Pod"] = []
+        self.failed: list["Pod"] = []
+        self._remaining: deque["Pod"] = deque()
+        self._tasks: list[asyncio.Task] = []
+
+    async def _remote_list(self, conn, source: "Pod", target: "Pod") -> str:
+        """Upload ``target``'s file list to ``source`` (once per list), named
+        by its content so a list left from an earlier sync is never reused."""
+        local = self.files_from[target]
+        key = (source.data.id, local)
+
+        async def upload() -> str:
+            content = Path(local).read_text()
+            digest = hashlib.sha1(content.encode()).hexdigest()[:16]
+            path = f"{REMOTE_LISTS_DIR}/{digest}.files"
+            await conn.run(
+                f"mkdir -p {REMOTE_LISTS_DIR} && cat > {path}",
+                input=content,
+                check=True,
+            )
+            return path
+
+        # shared, so a source's concurrent pushes don't write it at once
+        if key not in self._remote_lists:
+            self._remote_lists[key] = asyncio.ensure_future(upload())
+        return await self._remote_lists[key]
+
+    async def _install_key(self, conn, source: "Pod"):
+        """Give ``source`` the private key, once, when it first pushes."""
+        if source.data.id not in self._key_uploads:
+            upload = conn.run(
+                self.key.install_cmd(), input=self.key.private, check=True
+            )
+            self._key_uploads[source.data.id] = asyncio.ensure_future(upload)
+        await self._key_uploads[source.data.id]
+
+    async def _push(self, source: Optional["Pod"], target: "Pod") -> bool:
+        start = time.monotonic()
+        via = source.data.name if source is not None else "local"
+        try:
+            if source is None:
+                await self.seed_sync(target)
+            else:
+                async with POOL.connection(source.data.sshaddr) as conn:
+                    await self._install_key(conn, source)
+                    files_from = await self._remote_list(conn, source, target)
+                    cmd = pod_to_pod_rsync_cmd(
+                        source,
+                        target,
+                        self.remote_name,
+                        files_from,
+                        self.key.remote_path,
+                    )
+                    await conn.run(cmd, check=True)
+        except Exception as e:
+            print(f"relay {via} -> {target.data.name} failed: {e}")
+            self.failed.append(target)
+            return False
+        took = time.monotonic() - start
+        print(f"relay {via} -> {target.data.name} done in {took:.1f}s")
+        self.synced.append(target)
+        return True
+
+    async def _serve(self, source: Optional["Pod"]):
+        async def slot():
+            while self._remaining:
+                target = self._remaining.popleft()
+                if await self._push(source, target):
+                    self._spawn(target)
+
+        await asyncio.gather(*(slot() for _ in range(self.width)))
+
+    def _spawn(self, source: Optional["Pod"]):
+        self._tasks.append(asyncio.ensure_future(self._serve(source)))
+
+    async def _on_every_pod(self, cmd: str) -> list[Optional[BaseException]]:
+        """Run ``cmd`` on every pod through the fan-out, returning each pod's
+        error (or None)."""
+
+        async def run(pod: "Pod"):
+            async with POOL.connection(pod.data.sshaddr) as conn:
+                await conn.run(cmd, check=True)
+
+        jobs = [(pod, lambda pod=pod: run(pod)) for pod in self.pods]
+        results = await asyncio.gather(
+            *self.fanout.create_tasks(jobs), return_exceptions=True
+        )
+        return [r if isinstance(r, BaseException) else None for r in results]
+
+    async def run(self) -> list["Pod"]:
+        """Sync every pod, returning the pods that could not be reached
+        through the tree."""
+        errors = await self._on_every_pod(self.key.authorize_cmd())
+        try:
+            relayable = []
+            for pod, error in zip(self.pods, errors):
+                if error is not None:
+                    print(f"could not authorize relay key on {pod.data.name}: {error}")
+                    self.failed.append(pod)
+                else:
+                    relayable.append(pod)
+            self._remaining = deque(relayable)
+            start = time.monotonic()
+            self._spawn(None)
+            while not all(t.done() for t in self._tasks):
+                await asyncio.gather(*self._tasks)
+            print(
+                f"relay sync: {len(self.synced)}/{len(self.pods)} pods in "
+                f"{time.monotonic() - start:.1f}s"
+            )
+        finally:
+            errors = await self._on_every_pod(self.key.remove_cmd())
+            for pod, error in zip(self.pods, errors):
+                if error is not None:
+                    print(f"could not remove relay key from {pod.data.name}: {error}")
+        return self.failed
@@ -0,0 +1,117 @@
+"""ezpod's on-pod agent.
+
+This file is copied to each pod and run there with the pod's environment and
+venv already loaded, so it must only use the standard library.  It reads one
+JSON request per line on stdin and writes JSON events to stdout:
+
+    -> {"id": "...", "cmd": "..."}        run ``cmd`` with bash
+    -> {"id": "...", "cancel": true}      kill the process group of ``id``
+    <- {"id": "...", "stream": "stdout" | "stderr", "data": "<line>"}
+    <- {"id": "...", "exit": <returncode>}
+
+Every command runs in its own session so it can be killed as a group.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import codecs
+import json
+import os
+import signal
+import sys
+
+# longest piece of output sent as one event; longer lines (e.g. progress bars
+# redrawn with \r) are sent in parts
+MAX_LINE = 2**16
+
+
+class Agent:
+    def __init__(self):
+        self.procs: dict[str, asyncio.subprocess.Process] = {}
+
+    def send(self, **event):
+        sys.stdout.write(json.dumps(event) + "\n")
+        sys.stdout.flush()
+
+    async def pump(self, id: str, name: str, stream: asyncio.StreamReader):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        def send(data: bytes, final=False):
+            self.send(id=id, stream=name, data=decoder.decode(data, final))
+
+        buffer = b""
+        while chunk := await stream.read(MAX_LINE):
+            *lines, buffer = (buffer + chunk).split(b"\n")
+            for line in lines:
+                send(line + b"\n")
+            while len(buffer) >= MAX_LINE:
+                send(buffer[:MAX_LINE])
+                buffer = buffer[MAX_LINE:]
+        if buffer:
+            send(buffer, final=True)
+
+    async def run(self, id: str, cmd: str):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "bash",
+                "-c",
+                cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=os.path.expanduser("~"),
+                start_new_session=True,
+            )
+        except OSError as e:
+            self.send(id=id, stream="stderr", data=f"ezpod agent: {e}\n")
+            self.send(id=id, exit=127)
+            return
+        self.procs[id] = proc
+        assert proc.stdout is not None and proc.stderr is not None
+        returncode = -1
+        try:
+            await asyncio.gather(
+                self.pump(id, "stdout", proc.stdout),
+                self.pump(id, "stderr", proc.stderr),
+            )
+            returncode = await proc.wait()
+        except Exception as e:
+            self.send(id=id, stream="stderr", data=f"ezpod agent: {e!r}\n")
+            self.cancel(id)
+        finally:
+            # the controller waits for this, so it's sent whatever happened
+            del self.procs[id]
+            self.send(id=id, exit=returncode)
+
+    def cancel(self, id: str):
+        proc = self.procs.get(id)
+        if proc is not None:
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=2**24)
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+        )
+        self.send(id=None, ready=True)
+        tasks = set()
+        while line := await reader.readline():
+            request = json.loads(line)
+            if request.get("cancel"):
+                self.cancel(request["id"])
+                continue
+            task = asyncio.ensure_future(self.run(request["id"], request["cmd"]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        # controller went away: stop everything we started
+        for id in list(self.procs):
+            self.cancel(id)
+
+
+if __name__ == "__main__":
+    asyncio.run(Agent().serve())
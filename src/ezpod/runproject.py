@@ -3,7 +3,7 @@ from pathlib import Path
 
 from pydantic import BaseModel
 import os
-from ezpod.backend_aws_env_var import BACKEND_AWS
+from ezpod.backend_aws_env_var import BACKEND_AWS, env_flag
 
 
 class RunFolder(BaseModel):
@@ -27,3 +27,5 @@ class RunProject(BaseModel):
     folder: RunFolder
     pyname: str = "python3"
     use_venv: bool = not BACKEND_AWS
+    # run commands through a long-lived agent on each pod (see ezpod.agent)
+    use_agent: bool = env_flag("EZPOD_USE_AGENT")
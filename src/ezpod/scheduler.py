@@ -0,0 +1,245 @@
+"""Work-queue scheduling of more commands than there are pods.
+
+Instead of pre-assigning one chunk of commands per pod, :class:`WorkQueue`
+hands the next command to whichever pod goes idle, so fast pods pick up the
+slack of slow ones and a sweep finishes close to the ideal makespan.
+
+With a :class:`HedgePolicy`, pods that run out of queued work re-launch
+stragglers: commands running well past the typical command duration.  The
+first copy to finish wins and the other copy is killed on its pod.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import TYPE_CHECKING, Optional
+
+from ezpod.fanout import FanOut
+
+if TYPE_CHECKING:
+    from ezpod.pod import Pod, PodOutput
+
+
+@dataclass
+class HedgePolicy:
+    """
+    percentile: which percentile of finished command durations to base the
+        straggler deadline on.
+    multiplier: a command is a straggler once it has run for
+        ``multiplier * percentile duration``.
+    min_samples: finished commands needed before any hedging happens.
+    poll_interval: how often (seconds) idle pods look for stragglers.
+    """
+
+    percentile: float = 0.9
+    multiplier: float = 1.5
+    min_samples: int = 3
+    poll_interval: float = 1.0
+
+    def deadline(self, durations: list[float]) -> Optional[float]:
+        if len(durations) < self.min_samples:
+            return None
+        durations = sorted(durations)
+        i = min(int(self.percentile * len(durations)), len(durations) - 1)
+        return durations[i] * self.multiplier
+
+
+@dataclass
+class _Attempt:
+    pod: "Pod"
+    job_tag: str
+    task: asyncio.Task
+    start: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class CommandResult:
+    index: int
+    command: str
+    pod_name: Optional[str] = None
+    output: Optional["PodOutput"] = None
+    attempts: int = 0
+    hedged: bool = False
+    _running: list[_Attempt] = field(default_factory=list, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.output is not None and not self.output.is_running
+
+    @property
+    def returncode(self) -> Optional[int]:
+        if self.output is None or self.output.return_code is None:
+            return None
+        return self.output.return_code.returncode
+
+    @property
+    def duration(self) -> Optional[timedelta]:
+        if self.output is None or self.output.end_time is None:
+            return None
+        return self.output.end_time - self.output.start_time
+
+
+class WorkQueue:
+    def __init__(
+        self,
+        pods: list["Pod"],
+        fanout: FanOut,
+        in_folder=True,
+        max_attempts: int = 3,
+        hedge: Optional[HedgePolicy] = None,
+    ):
+        self.pods = pods
+        self.fanout = fanout
+        self.in_folder = in_folder
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.results: list[CommandResult] = []
+        self._queue: asyncio.Queue[Optional[CommandResult]] = asyncio.Queue()
+        # commands neither finished nor given up on. Idle workers keep waiting
+        # while this is nonzero, since a failed command may be requeued.
+        self._outstanding = 0
+        self._remote_cancels: list[asyncio.Task] = []
+
+    def _finish_one(self):
+        self._outstanding -= 1
+        if self._outstanding == 0:
+            for _ in self.pods:
+                self._queue.put_nowait(None)  # wake idle workers so they exit
+
+    def _find_straggler(self) -> Optional[CommandResult]:
+        assert self.hedge is not None
+        durations = [
+            r.duration.total_seconds() for r in self.results if r.done and r.duration
+        ]
+        deadline = self.hedge.deadline(durations)
+        if deadline is None:
+            return None
+        now = time.monotonic()
+        stragglers = [
+            r
+            for r in self.results
+            if not r.done
+            and len(r._running) == 1
+            and now - r._running[0].start > deadline
+        ]
+        if not stragglers:
+            return None
+        return min(stragglers, key=lambda r: r._running[0].start)
+
+    def _cancel_losers(self, result: CommandResult, winner: _Attempt):
+        for attempt in result._running:
+            if attempt is winner:
+                continue
+            print(
+                f"command {result.index} finished on {winner.pod.data.name}, "
+                f"cancelling copy on {attempt.pod.data.name}"
+            )
+            attempt.task.cancel()
+            self._remote_cancels.append(
+                asyncio.ensure_future(attempt.pod.cancel_remote(attempt.job_tag))
+            )
+
+    async def _run_one(self, pod: "Pod", result: CommandResult) -> bool:
+        """Run ``result``'s command on ``pod``. Returns False if the pod is
+        unusable and should stop taking work."""
+        result.attempts += 1
+        job_tag = uuid.uuid4().hex
+
+        async def start():
+            async with self.fanout.session(pod):
+                return await pod.run_async(
+                    result.command, self.in_folder, job_tag=job_tag
+                )
+
+        attempt = _Attempt(pod, job_tag, asyncio.ensure_future(start()))
+        result._running.append(attempt)
+        await asyncio.wait({attempt.task})
+        if attempt.task.cancelled():
+            return True  # lost the race to another copy; the pod itself is fine
+        result._running.remove(attempt)
+        exc = attempt.task.exception()
+        if exc is not None:
+            print(f"{pod.data.name} failed running command {result.index}: {exc}")
+        output = None if exc is not None else attempt.task.result()
+        if output is None:
+            if result.done or result._running:
+                pass  # another copy finished or is still going
+            elif result.attempts < self.max_attempts:
+                self._queue.put_nowait(result)
+            else:
+                self._finish_one()
+            return False
+        if result.done:
+            return True
+        self._cancel_losers(result, attempt)
+        result._running = []
+        result.pod_name = pod.data.name
+        result.output = output
+        self._finish_one()
+        return True
+
+    async def _next(self) -> Optional[CommandResult]:
+        if self.hedge is None:
+            return await self._queue.get()
+        while True:
+            try:
+                return await asyncio.wait_for(
+                    self._queue.get(), timeout=self.hedge.poll_interval
+                )
+            except asyncio.TimeoutError:
+                straggler = self._find_straggler()
+                if straggler is not None:
+                    straggler.hedged = True
+                    print(f"re-launching straggler command {straggler.index}")
+                    return straggler
+
+    async def _worker(self, pod: "Pod"):
+        while True:
+            result = await self._next()
+            if result is None:
+                return
+            if result.done:
+                continue
+            if not await self._run_one(pod, result):
+                print(f"{pod.data.name} retired from the work queue.")
+                return
+
+    async def run(self, commands: list[str]) -> list[CommandResult]:
+        self.results = [
+            CommandResult(index=i, command=c) for i, c in enumerate(commands)
+        ]
+        for result in self.results:
+            self._queue.put_nowait(result)
+        self._outstanding = len(self.results)
+        if not self.results:
+            return self.results
+        start = time.monotonic()
+        await asyncio.gather(*(self._worker(pod) for pod in self.pods))
+        await asyncio.gather(*self._remote_cancels, return_exceptions=True)
+        self.print_summary(time.monotonic() - start)
+        return self.results
+
+    def print_summary(self, makespan: float):
+        finished = [r for r in self.results if r.done]
+        busy = sum(r.duration.total_seconds() for r in finished if r.duration)
+        ideal = busy / max(len(self.pods), 1)
+        print(
+            f"work queue: {len(finished)}/{len(self.results)} commands finished on "
+            f"{len(self.pods)} pods in {makespan:.1f}s (ideal makespan ~{ideal:.1f}s)"
+        )
+        hedged = [r for r in self.results if r.hedged]
+        if hedged:
+            print(f"  {len(hedged)} stragglers were re-launched")
+        per_pod: dict[str, int] = {}
+        for r in finished:
+            assert r.pod_name is not None
+            per_pod[r.pod_name] = per_pod.get(r.pod_name, 0) + 1
+        for name, n in sorted(per_pod.items()):
+            print(f"  {name}: {n} commands")
+        unfinished = [r.index for r in self.results if not r.done]
+        if unfinished:
+            print(f"Warning: commands {unfinished} did not finish.")
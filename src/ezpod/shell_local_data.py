@@ -1,18 +1,20 @@
 # common_state_utils.py
-from argparse import Action
 import os
-import tempfile
-from pathlib import Path
-from typing import ClassVar
-from pydantic import BaseModel
-from .global_paths import ACCOUNTS_PATH, PROFILES_PATH
-import subprocess
-import toml
+from warnings import warn
 
-STATE_DIR = Path(tempfile.gettempdir()) / "ezpod_shell_states" / f"shell_{os.getppid()}"
-STATE_DIR.mkdir(parents=True, exist_ok=True)
-account_path = STATE_DIR / "account.state"
-profile_path = STATE_DIR / "profile.state"
+from pydantic import BaseModel
+from .global_paths import ACCOUNTS_PATH
+from .shell_state import (
+    STATE_DIR,
+    account_path,
+    profile_path,
+    current_account_name,
+    set_current_account,
+    current_profile_name,
+    set_current_profile,
+    acct_profiles,
+    flexible_login,
+)
 
 
 # class RunpodConfigState(BaseModel):
@@ -94,45 +96,12 @@ class Account(BaseModel):
         account.save(name)
 
 
-def current_account_name():
-    if "EZPOD_ACCOUNT_OVERRIDE" in os.environ:
-        return os.environ["EZPOD_ACCOUNT_OVERRIDE"]
-    if not account_path.exists():
-        return "default"
-    return account_path.read_text().strip()
-
-
-def set_current_account(account: str):
-    account_path.write_text(account)
-
-
-def current_profile_name():
-    if "EZPOD_PROFILE_OVERRIDE" in os.environ:
-        return os.environ["EZPOD_PROFILE_OVERRIDE"]
-    if not profile_path.exists():
-        if (acct_profiles() / "default").exists():
-            return "default"
-        return None
-    return profile_path.read_text().strip()
-
-
-def set_current_profile(profile: str | None):
-    if profile is None:
-        profile_path.unlink(missing_ok=True)
-    else:
-        profile_path.write_text(profile)
-
-
-def acct_profiles() -> Path:
-    path = PROFILES_PATH / current_account_name()
-    path.mkdir(parents=True, exist_ok=True)
-    return path
-
-
-def flexible_login(name: str):
-    if "/" in name:
-        acct, profile = name.split("/")
-        set_current_account(acct)
-        set_current_profile(profile)
-    else:
-        set_current_account(name)
+def default_group(environ=os.environ) -> str | None:
+    """The group used when none is given: EZPOD_GROUP, else the account's
+    default_group."""
+    account = Account.load()
+    env_var = environ.get("EZPOD_GROUP", None)
+    if account.default_group is not None and env_var is not None:
+        warn("Both EZPOD_GROUP and default_group are set")
+        warn(f"Using EZPOD_GROUP: {env_var}")
+    return env_var or account.default_group
@@ -0,0 +1,71 @@
+"""Per-shell account/profile selection and profile listing.
+
+Only uses the standard library, so CLI commands like ``ezpod login`` and
+``ezpod profiles`` can run without importing pydantic or the backends.
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+from .global_paths import PROFILES_PATH
+
+STATE_DIR = Path(tempfile.gettempdir()) / "ezpod_shell_states" / f"shell_{os.getppid()}"
+STATE_DIR.mkdir(parents=True, exist_ok=True)
+account_path = STATE_DIR / "account.state"
+profile_path = STATE_DIR / "profile.state"
+AWS_PROFILE_EXT = "ec2.json"
+
+
+def current_account_name():
+    if "EZPOD_ACCOUNT_OVERRIDE" in os.environ:
+        return os.environ["EZPOD_ACCOUNT_OVERRIDE"]
+    if not account_path.exists():
+        return "default"
+    return account_path.read_text().strip()
+
+
+def set_current_account(account: str):
+    account_path.write_text(account)
+
+
+def current_profile_name():
+    if "EZPOD_PROFILE_OVERRIDE" in os.environ:
+        return os.environ["EZPOD_PROFILE_OVERRIDE"]
+    if not profile_path.exists():
+        if (acct_profiles() / "default").exists():
+            return "default"
+        return None
+    return profile_path.read_text().strip()
+
+
+def set_current_profile(profile: str | None):
+    if profile is None:
+        profile_path.unlink(missing_ok=True)
+    else:
+        profile_path.write_text(profile)
+
+
+def acct_profiles() -> Path:
+    path = PROFILES_PATH / current_account_name()
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def flexible_login(name: str):
+    if "/" in name:
+        acct, profile = name.split("/")
+        set_current_account(acct)
+        set_current_profile(profile)
+    else:
+        set_current_account(name)
+
+
+def profile_names(ext: str | None = None) -> list[str]:
+    """File names of the current account's profiles, only those ending in
+    ``.{ext}`` if given."""
+    return [
+        p.name
+        for p in acct_profiles().iterdir()
+        if p.is_file() and (ext is None or p.name.endswith(f".{ext}"))
+    ]
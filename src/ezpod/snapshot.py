@@ -0,0 +1,112 @@
+"""The on-disk inventory snapshot, readable without the backends.
+
+Besides the full pod data (see ezpod.inventory), every snapshot holds a row
+per pod with what ``ezpod list`` and ``ezpod ssh`` print.  This module only
+uses the standard library, so those commands can answer from a recent
+snapshot without importing pydantic, asyncssh or ``ezpod.pods``.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+from warnings import warn
+
+from ezpod.backend_aws_env_var import BACKEND_AWS, aws_regions
+from ezpod.global_paths import ACCOUNTS_PATH
+from ezpod.shell_state import STATE_DIR, current_account_name
+
+SNAPSHOT_DIR = STATE_DIR.parent / "inventory"
+# how old (seconds) a snapshot may be to answer read-only commands
+SNAPSHOT_MAX_AGE = float(os.environ.get("EZPOD_INVENTORY_SNAPSHOT_MAX_AGE", 30))
+
+
+def _snapshot_stem() -> str:
+    if BACKEND_AWS:
+        regions = "+".join(region or "default" for region in aws_regions())
+        return f"aws_{regions}"
+    return f"runpod_{current_account_name()}"
+
+
+def snapshot_path(group: Optional[str] = None) -> Path:
+    """Where the listing of ``group`` (None: every pod) is saved."""
+    if group is None:
+        return SNAPSHOT_DIR / f"{_snapshot_stem()}.json"
+    return SNAPSHOT_DIR / f"{_snapshot_stem()}@{group}.json"
+
+
+def snapshot_paths() -> list[Path]:
+    """The saved listings, of every pod and of each group."""
+    stem = _snapshot_stem()
+    return [SNAPSHOT_DIR / f"{stem}.json", *SNAPSHOT_DIR.glob(f"{stem}@*.json")]
+
+
+def pod_line(name: str, id: str, gpu_type: str, status: str) -> str:
+    """How a pod is shown, e.g. by ``ezpod list``."""
+    return f"{name} ({id}, {gpu_type}, {status})"
+
+
+def sshcmd(ssh: dict, user: Optional[str] = None) -> str:
+    """The ssh command of a row's ``ssh`` entry, like ``AddrEntry.sshcmd``."""
+    return f"ssh {ssh['opts']} -p {ssh['port']} {user or ssh['user']}@{ssh['ip']} "
+
+
+def load(
+    max_age: float = SNAPSHOT_MAX_AGE, group: Optional[str] = None
+) -> Optional[dict]:
+    """The snapshot of ``group``, if there is one at most ``max_age`` seconds
+    old."""
+    try:
+        snapshot = json.loads(snapshot_path(group).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if time.time() - snapshot["fetched_at"] > max_age:
+        return None
+    return snapshot
+
+
+def load_rows(
+    max_age: float = SNAPSHOT_MAX_AGE, group: Optional[str] = None
+) -> Optional[list[dict]]:
+    """Each pod's (of ``group``, if given) row from a recent snapshot: its id,
+    name, group, ``line``, whether it is ``running`` and its ``ssh`` address
+    (or None). A listing of every pod also answers for a group."""
+    for key in (group, None):
+        snapshot = load(max_age, key)
+        if snapshot is None or "rows" not in snapshot:  # saved by an older version
+            continue
+        rows = snapshot["rows"]
+        if group is None:
+            return rows
+        return [row for row in rows if row["group"] == group]
+    return None
+
+
+def select_rows(rows: list[dict], spec: str) -> list[dict]:
+    """The rows picked by a CLI ``--i`` spec, like ``Pods.select``."""
+    if not spec:
+        return rows
+    if "-" in spec:
+        return rows[slice(*[None if n == "" else int(n) for n in spec.split("-")])]
+    if spec.isnumeric():
+        return [rows[int(spec)]]
+    return [{row["name"]: row for row in rows}[spec]]
+
+
+def default_group(environ=os.environ) -> tuple[bool, Optional[str]]:
+    """``shell_local_data.default_group`` without loading the account model.
+    Returns (False, None) if the account doesn't exist yet, so the caller can
+    fall back to the full path, which creates it."""
+    env_var = environ.get("EZPOD_GROUP", None)
+    try:
+        account = json.loads((ACCOUNTS_PATH / current_account_name()).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False, None
+    group = account.get("default_group")
+    if group is not None and env_var is not None:
+        warn("Both EZPOD_GROUP and default_group are set")
+        warn(f"Using EZPOD_GROUP: {env_var}")
+    return True, env_var or group
@@ -0,0 +1,259 @@
+"""Persistent, per-pod SSH connection pool.
+
+Opening a fresh ``asyncssh`` connection costs a full TCP + SSH handshake.  The
+pool keeps one connection per ``AddrEntry`` (ip/port/user/key) alive between
+commands, sends keepalives, evicts connections that sat idle for too long and
+transparently reconnects when a pooled connection turns out to be dead.  If
+the server refuses another session on a live connection (sshd's
+``MaxSessions``), the command gets a connection of its own instead.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncContextManager, AsyncIterator, Callable, Optional
+
+import asyncssh
+
+from ezpod.AddrEntry import AddrEntry
+
+ConnKey = tuple[str, int, str, str]
+
+# What connecting and starting a process waits for. A FanOut session (see
+# ezpod.fanout) sets it, so only the start of a session holds one of its slots,
+# not the whole remote command.
+START_SLOT: ContextVar[Callable[[], AsyncContextManager]] = ContextVar(
+    "ezpod_ssh_start_slot", default=nullcontext
+)
+
+# Errors raised by ``create_process`` on a connection that died while it was
+# sitting in the pool.  These are safe to retry since no command was started.
+# A ChannelOpenError only means the connection died if it is closed too.
+_RECONNECT_ERRORS = (
+    asyncssh.DisconnectError,
+    asyncssh.ChannelOpenError,
+    BrokenPipeError,
+    ConnectionError,
+)
+
+
+@dataclass
+class PoolStats:
+    hits: int = 0
+    misses: int = 0
+    reconnects: int = 0
+    evictions: int = 0
+
+    def __str__(self):
+        return (
+            f"ssh pool: {self.hits} hits, {self.misses} misses, "
+            f"{self.reconnects} reconnects, {self.evictions} evictions"
+        )
+
+
+@dataclass
+class _PooledConnection:
+    key: ConnKey
+    conn: Optional[asyncssh.SSHClientConnection] = None
+    closed: bool = False
+    in_use: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+
+    @property
+    def usable(self) -> bool:
+        return self.conn is not None and not self.closed and not self.conn.is_closed()
+
+
+class _PoolClient(asyncssh.SSHClient):
+    """Marks the pool entry dead as soon as the connection drops."""
+
+    def __init__(self, entry: _PooledConnection):
+        self._entry = entry
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._entry.closed = True
+
+
+def conn_key(addr: AddrEntry) -> ConnKey:
+    return (addr.ip, int(addr.port), addr.user, addr.key_path)
+
+
+class SSHConnectionPool:
+    def __init__(
+        self,
+        keepalive_interval: float = float(
+            os.environ.get("EZPOD_SSH_KEEPALIVE_INTERVAL", 15)
+        ),
+        idle_timeout: float = float(os.environ.get("EZPOD_SSH_IDLE_TIMEOUT", 300)),
+    ):
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+        self.stats = PoolStats()
+        self._entries: dict[ConnKey, _PooledConnection] = {}
+        self._locks: dict[ConnKey, asyncio.Lock] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _check_loop(self):
+        # Connections (and locks) are bound to the loop they were made on. If
+        # the caller moved to a new loop the old connections are unusable.
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._entries = {}
+            self._locks = {}
+            self._loop = loop
+
+    def _options(self, addr: AddrEntry) -> asyncssh.SSHClientConnectionOptions:
+        return asyncssh.SSHClientConnectionOptions(
+            username=addr.user,
+            keepalive_interval=self.keepalive_interval,
+            keepalive_count_max=3,
+            **(
+                dict(client_keys=[Path(addr.key_path).expanduser()])  # type: ignore
+                if addr.key_path
+                else {}
+            ),
+        )
+
+    async def _connect(self, addr: AddrEntry) -> _PooledConnection:
+        entry = _PooledConnection(key=conn_key(addr))
+        entry.conn = await asyncssh.connect(
+            addr.ip,
+            int(addr.port),
+            options=self._options(addr),
+            client_factory=lambda: _PoolClient(entry),
+        )
+        return entry
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for key, entry in list(self._entries.items()):
+            if entry.in_use:
+                continue
+            if not entry.usable or now - entry.last_used > self.idle_timeout:
+                del self._entries[key]
+                if entry.usable:
+                    self.stats.evictions += 1
+                    entry.conn.close()  # type: ignore[union-attr]
+
+    async def _acquire(
+        self, addr: AddrEntry, reconnect: bool = False
+    ) -> tuple[_PooledConnection, bool]:
+        self._check_loop()
+        self._evict_idle()
+        key = conn_key(addr)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            hit = entry is not None and entry.usable
+            if not hit:
+                if reconnect:
+                    self.stats.reconnects += 1
+                else:
+                    self.stats.misses += 1
+                entry = await self._connect(addr)
+                self._entries[key] = entry
+            else:
+                self.stats.hits += 1
+            assert entry is not None
+            entry.in_use += 1
+            return entry, hit
+
+    def _release(self, entry: _PooledConnection):
+        entry.in_use -= 1
+        entry.last_used = time.monotonic()
+        if not entry.in_use and self._entries.get(entry.key) is not entry:
+            # discarded, or a connection of its own: close it now nobody uses it
+            if entry.conn is not None:
+                entry.conn.close()
+
+    def _discard(self, entry: _PooledConnection):
+        """Take ``entry`` out of the pool. Its connection is closed once the
+        commands still running on it are done."""
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+        if not entry.in_use and entry.conn is not None:
+            entry.conn.close()
+
+    async def _own_connection(self, addr: AddrEntry) -> _PooledConnection:
+        """A connection outside the pool, closed when it is released."""
+        self.stats.misses += 1
+        entry = await self._connect(addr)
+        entry.in_use += 1
+        return entry
+
+    @asynccontextmanager
+    async def connection(
+        self, addr: AddrEntry
+    ) -> AsyncIterator[asyncssh.SSHClientConnection]:
+        """Borrow the pooled connection for ``addr`` for the duration of the block."""
+        async with START_SLOT.get()():
+            entry, _ = await self._acquire(addr)
+        try:
+            assert entry.conn is not None
+            yield entry.conn
+        finally:
+            self._release(entry)
+
+    @asynccontextmanager
+    async def process(
+        self, addr: AddrEntry, cmd: str
+    ) -> AsyncIterator[asyncssh.SSHClientProcess]:
+        """Start ``cmd`` on a pooled connection, reconnecting once if the
+        pooled connection turned out to be dead."""
+        entry: Optional[_PooledConnection] = None
+        try:
+            async with START_SLOT.get()():
+                entry, hit = await self._acquire(addr)
+                assert entry.conn is not None
+                try:
+                    process = await entry.conn.create_process(cmd)
+                except _RECONNECT_ERRORS:
+                    if entry.usable:
+                        # the server refused another session on a live
+                        # connection; the commands running on it are fine
+                        self._release(entry)
+                        entry = None
+                        entry = await self._own_connection(addr)
+                    elif hit:
+                        self._release(entry)
+                        self._discard(entry)
+                        entry = None
+                        entry, _ = await self._acquire(addr, reconnect=True)
+                    else:
+                        raise
+                    assert entry.conn is not None
+                    process = await entry.conn.create_process(cmd)
+            try:
+                yield process
+            finally:
+                process.close()
+                await process.wait_closed()
+        finally:
+            if entry is not None:
+                self._release(entry)
+
+    def forget(self, addr: AddrEntry):
+        """Drop (and close) the pooled connection for ``addr``, if any."""
+        entry = self._entries.get(conn_key(addr))
+        if entry is not None:
+            self._discard(entry)
+
+    async def close_all(self):
+        entries = list(self._entries.values())
+        self._entries = {}
+        for entry in entries:
+            if entry.conn is not None:
+                entry.conn.close()
+        await asyncio.gather(
+            *(e.conn.wait_closed() for e in entries if e.conn is not None),
+            return_exceptions=True,
+        )
+
+
+POOL = SSHConnectionPool()
@@ -1,72 +1,45 @@
-"""Utilities for syncing directories to remote pods using pyinfra."""
+"""Utilities for syncing directories to remote pods with rsync.
+
+Each rsync runs as an asyncio subprocess.  :class:`SyncEngine` runs the
+syncs for a fleet with a concurrency cap and a per-pod timeout, and retries
+only the pods that failed, with exponential backoff.
+"""
 
 from __future__ import annotations
 
-from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import os
+import re
+import shlex
+import signal
+import time
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
 
-from pyinfra.api import Config, Inventory, State
+T = TypeVar("T")
 
 
-# A single thread pool used to perform rsync operations asynchronously.
-_RSYNC_EXECUTOR = ThreadPoolExecutor()
+class RsyncError(Exception):
+    pass
 
 
 @dataclass
-class _JoinHandle:
-    """Simple wrapper that exposes a ``join`` method for compatibility.
-
-    The previous implementation returned a ``Promise`` from patchwork which
-    exposed a ``join`` method.  To minimise changes in callers we provide the
-    same API by wrapping a ``concurrent.futures.Future``.
-    """
-
-    future: Future
-
-    def join(self) -> None:
-        """Block until the underlying future is complete."""
-
-        # ``Future.result`` will raise any exceptions from the worker thread
-        # which matches the behaviour of the previous ``Promise.join``.
-        self.future.result()
-
-
-def _rsync(
-    host: str,
-    user: str,
-    port: int,
-    key_path: Optional[str],
-    src: str,
-    dest: str,
-    exclude: List[str],
-) -> None:
-    """Perform the actual rsync using pyinfra's SSH connector."""
-
-    data = {
-        "ssh_user": user,
-        "ssh_port": port,
-        "ssh_strict_host_key_checking": "no",
-    }
-    if key_path:
-        data["ssh_key"] = key_path
+class RsyncResult:
+    bytes_sent: int = 0
+    duration: float = 0.0
 
-    inventory = Inventory(([host], data), {})
-    state = State(inventory, Config())
-    host_obj = inventory.get_host(host)
+    @classmethod
+    def from_stats(cls, stats: str, duration: float) -> "RsyncResult":
+        """Parse the output of ``rsync --stats``."""
+        m = re.search(r"^Total bytes sent: ([\d,]+)", stats, re.MULTILINE)
+        return cls(int(m.group(1).replace(",", "")) if m else 0, duration)
 
-    # Replicate the patchwork defaults and follow symlinks like the previous
-    # implementation (rsync_opts="-L").  Also forward any exclude patterns.
-    flags = ["-pthrvz", "-L"] + [f"--exclude={pattern}" for pattern in exclude]
-    host_obj.rsync(src, dest, flags=flags)
 
-    # ``Host.rsync`` uses the ``ssh`` binary directly and does not maintain a
-    # persistent connection, so there is nothing to clean up here.  The call is
-    # kept to mirror the previous behaviour and future proof the code.
-    host_obj.disconnect()
+# Follow symlinks (-L) like the previous pyinfra/patchwork implementation.
+RSYNC_FLAGS = ["-pthrz", "-L"]
 
 
-def asyncrsync(
+async def rsync(
     *,
     host: str,
     user: str,
@@ -74,24 +47,143 @@ def asyncrsync(
     key_path: Optional[str],
     src: str,
     dest: str,
-    exclude: Optional[List[str]] = None,
-) -> _JoinHandle:
-    """Start an asynchronous rsync to ``host`` using pyinfra.
-
-    The returned object exposes a ``join`` method which blocks until the sync completes.
+    exclude: Optional[list[str]] = None,
+    files_from: Optional[str] = None,
+    link_dest: Optional[str] = None,
+) -> RsyncResult:
+    """Rsync ``src`` to ``dest`` on ``host``, raising RsyncError on failure.
+
+    files_from: path of a file listing the paths to send, relative to ``src``.
+    link_dest: remote directory (relative to ``dest``) whose unchanged files
+        are hard-linked instead of sent.
     """
-
-    if exclude is None:
-        exclude = []
-
-    future = _RSYNC_EXECUTOR.submit(
-        _rsync,
-        host,
-        user,
-        port,
-        key_path,
-        src,
-        dest,
-        exclude,
+    ssh = f"ssh -o BatchMode=yes -o StrictHostKeyChecking=no -p {port}"
+    if key_path:
+        ssh += f" -i {shlex.quote(key_path)}"
+    args = ["rsync", *RSYNC_FLAGS, "--stats", "-e", ssh]
+    args += [f"--exclude={pattern}" for pattern in exclude or []]
+    if files_from is not None:
+        args.append(f"--files-from={files_from}")
+    if link_dest is not None:
+        args.append(f"--link-dest={link_dest}")
+    args += [src, f"{user}@{host}:{dest}"]
+
+    start = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,  # so a timeout also kills rsync's ssh
     )
-    return _JoinHandle(future)
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:  # includes timeouts
+        if process.returncode is None:
+            os.killpg(process.pid, signal.SIGKILL)
+            await process.wait()
+        raise
+    if process.returncode != 0:
+        raise RsyncError(
+            f"rsync exited with {process.returncode}: {stderr.decode().strip()}"
+        )
+    return RsyncResult.from_stats(stdout.decode(), time.monotonic() - start)
+
+
+def _human_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}TB"
+
+
+class SyncEngine(Generic[T]):
+    def __init__(
+        self,
+        max_concurrency: int = int(os.environ.get("EZPOD_SYNC_CONCURRENCY", 16)),
+        timeout: float = float(os.environ.get("EZPOD_SYNC_TIMEOUT", 600)),
+        retries: int = int(os.environ.get("EZPOD_SYNC_RETRIES", 2)),
+        backoff: float = float(os.environ.get("EZPOD_SYNC_BACKOFF", 5)),
+    ):
+        """
+        max_concurrency: how many rsyncs run at once.
+        timeout: seconds one rsync may take before it is killed and retried.
+        retries: how many times a failed target is retried.
+        backoff: seconds before the first retry, doubling for each retry.
+        """
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _sync_one(
+        self,
+        target: T,
+        name: str,
+        sync: Callable[[T], Awaitable[RsyncResult]],
+        semaphore: asyncio.Semaphore,
+    ) -> RsyncResult | BaseException:
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                print(f"retrying sync to {name} in {delay:.0f}s")
+                await asyncio.sleep(delay)
+            async with semaphore:
+                try:
+                    result = await asyncio.wait_for(sync(target), self.timeout)
+                except asyncio.TimeoutError:
+                    error: BaseException = RsyncError(
+                        f"timed out after {self.timeout:.0f}s"
+                    )
+                except Exception as e:
+                    error = e
+                else:
+                    print(
+                        f"synced {name}: {_human_bytes(result.bytes_sent)} "
+                        f"in {result.duration:.1f}s"
+                    )
+                    return result
+            print(f"sync to {name} failed: {error}")
+        return error
+
+    async def sync_one(
+        self,
+        target: T,
+        sync: Callable[[T], Awaitable[RsyncResult]],
+        name: Callable[[T], str] = str,
+    ) -> RsyncResult:
+        """Sync one target, for callers that start targets one at a time.
+        Concurrent calls on the same loop share the concurrency cap. Raises
+        the final error."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        result = await self._sync_one(target, name(target), sync, self._semaphore)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    async def run(
+        self,
+        targets: list[T],
+        sync: Callable[[T], Awaitable[RsyncResult]],
+        name: Callable[[T], str] = str,
+    ) -> dict[T, RsyncResult | BaseException]:
+        """Sync every target, returning its result or final error."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *(self._sync_one(t, name(t), sync, semaphore) for t in targets)
+        )
+        by_target = dict(zip(targets, results))
+        ok = [r for r in results if isinstance(r, RsyncResult)]
+        print(
+            f"sync: {len(ok)}/{len(targets)} succeeded, "
+            f"{_human_bytes(sum(r.bytes_sent for r in ok))} sent "
+            f"in {time.monotonic() - start:.1f}s"
+        )
+        return by_target
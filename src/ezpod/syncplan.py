@@ -0,0 +1,221 @@
+"""Compiles a project folder's ignore rules into the explicit list of files to sync.
+
+Rules follow gitignore semantics: ``.gitignore`` files in any directory apply
+to that directory's subtree, later matches win, ``!`` negates, a leading or
+inner ``/`` anchors the pattern to the ignore file's directory, a trailing
+``/`` matches directories only and ``**`` spans directories.  Like git, a file
+can't be re-included once its parent directory is excluded.
+
+On top of that, patterns in the root ``.ezpodinclude`` re-include paths that
+git ignores, and patterns in the root ``.ezpodignore`` exclude additional
+paths.  ``.git`` is never synced.
+
+The plan is compiled once per ``Pods.sync`` and its file list is handed to
+every pod's rsync as ``--files-from``.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Optional
+
+from ezpod.runproject import RunFolder
+
+
+def _translate(pattern: str) -> str:
+    """Regex source for a gitignore glob (without leading/trailing slashes)."""
+    res = ""
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i):
+                j = i + 2
+                at_start = i == 0 or pattern[i - 1] == "/"
+                if at_start and j == n:
+                    res += ".*"
+                    i = j
+                    continue
+                if at_start and pattern[j] == "/":
+                    res += "(?:.*/)?"
+                    i = j + 1
+                    continue
+                i = j
+            else:
+                i += 1
+            res += "[^/]*"
+            continue
+        if c == "?":
+            res += "[^/]"
+        elif c == "[":
+            j = pattern.find(
+                "]", i + 2 if pattern[i + 1 : i + 2] in ("!", "]") else i + 1
+            )
+            if j == -1:
+                res += re.escape(c)
+            else:
+                body = pattern[i + 1 : j].replace("\\", "\\\\")
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                res += f"[{body}]"
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            res += re.escape(pattern[i])
+        else:
+            res += re.escape(c)
+        i += 1
+    return res
+
+
+@dataclass
+class IgnoreRule:
+    regex: re.Pattern
+    base: str  # directory of the ignore file, relative to the root ("" for root)
+    negate: bool = False
+    dir_only: bool = False
+    anchored: bool = False
+
+    @classmethod
+    def parse(cls, line: str, base: str = "") -> Optional["IgnoreRule"]:
+        line = line.rstrip("\n")
+        # trailing spaces are ignored unless escaped
+        stripped = line.rstrip(" ")
+        if stripped.endswith("\\") and len(stripped) < len(line):
+            stripped += " "
+        line = stripped
+        if not line or line.startswith("#"):
+            return None
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith(("\\!", "\\#")):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            return None
+        anchored = "/" in line
+        line = line.lstrip("/")
+        return cls(re.compile(_translate(line)), base, negate, dir_only, anchored)
+
+    def matches(self, relpath: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if self.base:
+            if not relpath.startswith(self.base + "/"):
+                return False
+            relpath = relpath[len(self.base) + 1 :]
+        if self.anchored:
+            return self.regex.fullmatch(relpath) is not None
+        return self.regex.fullmatch(relpath.rsplit("/", 1)[-1]) is not None
+
+
+def parse_rules(lines: Iterable[str], base: str = "", negate=False) -> list[IgnoreRule]:
+    rules = []
+    for line in lines:
+        rule = IgnoreRule.parse(line, base)
+        if rule is not None:
+            rule.negate ^= negate
+            rules.append(rule)
+    return rules
+
+
+def _lines(path: Path) -> list[str]:
+    return path.read_text().splitlines() if path.is_file() else []
+
+
+def ignored(rules: list[IgnoreRule], relpath: str, is_dir: bool) -> bool:
+    result = False
+    for rule in rules:
+        if rule.matches(relpath, is_dir):
+            result = not rule.negate
+    return result
+
+
+RULE_FILES = (".gitignore", ".ezpodignore", ".ezpodinclude")
+
+
+class SyncRules:
+    """The ignore rules of a project folder, with each directory's
+    ``.gitignore`` read on first use."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        include = _lines(root / ".ezpodinclude")
+        ezpod_ignore = _lines(root / ".ezpodignore")
+        both = {l.strip() for l in include} & {l.strip() for l in ezpod_ignore} - {""}
+        if both:
+            raise Exception(
+                f".ezpodinclude contains entries that were ignored in .ezpodignore: {both}"
+            )
+        # applied after the (nested) gitignore rules, so they take precedence
+        self.overrides = (
+            parse_rules(include, negate=True)
+            + parse_rules(ezpod_ignore)
+            + parse_rules([".git"])
+        )
+        self._gitignores: dict[str, list[IgnoreRule]] = {}
+
+    def _dir_rules(self, reldir: str) -> list[IgnoreRule]:
+        """The gitignore rules that apply inside ``reldir`` ("" for root)."""
+        rules = self._gitignores.get(reldir)
+        if rules is None:
+            parent = self._dir_rules(os.path.dirname(reldir)) if reldir else []
+            own = parse_rules(_lines(self.root / reldir / ".gitignore"), reldir)
+            rules = self._gitignores[reldir] = parent + own
+        return rules
+
+    def ignored(self, relpath: str, is_dir: bool) -> bool:
+        """Whether the rules ignore ``relpath`` itself, assuming its parent
+        directories are not ignored."""
+        rules = self._dir_rules(os.path.dirname(relpath)) + self.overrides
+        return ignored(rules, relpath, is_dir)
+
+    def excluded(self, relpath: str, is_dir: bool) -> bool:
+        """Whether ``relpath`` is left out of the sync, either by its own rules
+        or because one of its parent directories is."""
+        parts = relpath.split("/")
+        for i in range(1, len(parts)):
+            if self.ignored("/".join(parts[:i]), is_dir=True):
+                return True
+        return self.ignored(relpath, is_dir)
+
+
+@dataclass
+class SyncPlan:
+    root: Path
+    files: list[str]
+    _lists_dir: Optional[tempfile.TemporaryDirectory] = field(default=None, repr=False)
+
+    @classmethod
+    def compile(cls, folder: RunFolder) -> "SyncPlan":
+        root = folder.local
+        rules = SyncRules(root)
+        files = []
+        for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+            reldir = os.path.relpath(dirpath, root)
+            prefix = "" if reldir == "." else f"{reldir}/"
+            dirnames[:] = sorted(
+                d for d in dirnames if not rules.ignored(prefix + d, is_dir=True)
+            )
+            for name in sorted(filenames):
+                if not rules.ignored(prefix + name, is_dir=False):
+                    files.append(prefix + name)
+        return cls(root, files)
+
+    def file_list(self, files: Optional[list[str]] = None, name: str = "all") -> str:
+        """Path of a ``--files-from`` list of ``files`` (default: the whole
+        plan), written once per ``name`` and shared by every pod's rsync."""
+        if self._lists_dir is None:
+            self._lists_dir = tempfile.TemporaryDirectory(prefix="ezpod_sync_")
+        path = Path(self._lists_dir.name) / f"{name}.files"
+        if not path.exists():
+            path.write_text(
+                "".join(f"{f}\n" for f in (self.files if files is None else files))
+            )
+        return str(path)
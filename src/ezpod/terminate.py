@@ -0,0 +1,65 @@
+"""Removing many pods at once.
+
+``Pod.remove`` makes one blocking provider call per pod, so removing a
+large fleet one pod at a time takes minutes while the pods keep billing.
+:func:`terminate` hands all the pods to their backend's bulk path
+(``remove_pods``: concurrent ``runpodctl remove pod`` calls on RunPod,
+batched ``terminate-instances`` calls on AWS), then confirms they are gone
+with whole-inventory listings instead of checking each pod.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from typing import TYPE_CHECKING
+
+from ezpod.inventory import INVENTORY
+
+if TYPE_CHECKING:
+    from ezpod.pod import Pod
+
+# AWS lists terminated instances for a while after they're gone
+GONE_STATES = {"shutting-down", "terminated"}
+# seconds to wait for removed pods to leave the inventory
+CONFIRM_TIMEOUT = float(os.environ.get("EZPOD_TERMINATE_CONFIRM_TIMEOUT", 60))
+
+
+def still_listed(ids: set[str], timeout: float = CONFIRM_TIMEOUT) -> set[str]:
+    """Poll the inventory until none of ``ids`` is listed as alive, returning
+    the ones still listed after ``timeout`` seconds."""
+    deadline = time.monotonic() + timeout
+    delay = 1.0
+    while True:
+        listed = {
+            data.id
+            for data in INVENTORY.get(max_age=0)
+            if data.id in ids and data.status.lower() not in GONE_STATES
+        }
+        if not listed or time.monotonic() + delay > deadline:
+            return listed
+        time.sleep(delay)
+        delay = min(delay * 2, 10)
+
+
+def terminate(pods: list["Pod"]) -> list["Pod"]:
+    """Remove ``pods`` through their backend's bulk path and confirm they are
+    gone. Returns the pods that could not be removed."""
+    if not pods:
+        return []
+    start = time.monotonic()
+    by_id = {pod.data.id: pod for pod in pods}
+    print(f"removing {len(pods)} pods...")
+    failed = set(type(pods[0].data).remove_pods([pod.data for pod in pods]))
+    for pod in pods:
+        if pod.data.id not in failed:
+            pod.mark_removed()
+    left = failed | still_listed(set(by_id) - failed)
+    print(
+        f"removed {len(pods) - len(left)}/{len(pods)} pods "
+        f"in {time.monotonic() - start:.1f}s"
+    )
+    if left:
+        names = sorted(by_id[id].data.name for id in left)
+        print(f"Warning: could not remove {names}")
+    return [by_id[id] for id in left]
@@ -0,0 +1,105 @@
+"""Syncing through the network volume that RunPod pods share.
+
+Pods created with a ``volume_id`` all mount the same network volume at
+``volume_mount_path``.  Instead of uploading the project from this machine
+to every pod, volume sync uploads it once, through one pod, into a
+versioned directory on the volume::
+
+    {volume_mount_path}/.ezpod_sync/{remote_name}/versions/{manifest digest}
+
+Each pod then copies that version into its own project folder, which only
+moves data inside the datacenter.  (A copy rather than a symlink, since
+setup writes the pod's venv into the project folder.)  Uploads hard-link
+unchanged files from the previous version, and only the newest few versions
+are kept.
+"""
+
+from __future__ import annotations
+
+import os
+import shlex
+import time
+import uuid
+from typing import TYPE_CHECKING
+
+from ezpod.manifest import Manifest
+from ezpod.ssh_pool import POOL
+from ezpod.sync import RsyncError, RsyncResult
+
+if TYPE_CHECKING:
+    from ezpod.pod import Pod
+
+SYNC_DIR = ".ezpod_sync"
+KEEP_VERSIONS = int(os.environ.get("EZPOD_VOLUME_KEEP_VERSIONS", 3))
+# minutes after which an unfinished upload is considered abandoned
+STALE_UPLOAD_MINUTES = 24 * 60
+
+
+def versions_dir(mount_path: str, remote_name: str) -> str:
+    return f"{mount_path}/{SYNC_DIR}/{remote_name}/versions"
+
+
+async def upload_version(
+    pod: "Pod",
+    mount_path: str,
+    remote_name: str,
+    manifest: Manifest,
+    files_from: str,
+) -> str:
+    """Make sure the volume holds the version of ``manifest``, uploading it
+    through ``pod`` if needed. Returns the version's directory."""
+    versions = versions_dir(mount_path, remote_name)
+    version = f"{versions}/{manifest.digest}"
+    async with POOL.connection(pod.data.sshaddr) as conn:
+        r = await conn.run(
+            f"mkdir -p {versions} && cd {versions} && "
+            f"if [ -d {manifest.digest} ]; then echo present; "
+            "else ls -1t | grep -v '\\.partial$' | head -n 1; fi",
+            check=True,
+        )
+    latest = str(r.stdout).strip()
+    if latest == "present":
+        print(f"version {manifest.digest[:12]} already on the volume")
+        return version
+    start = time.monotonic()
+    # staged per upload, since another controller may be uploading the same
+    # version at the same time
+    staging = f"{version}.{uuid.uuid4().hex[:12]}.partial"
+    # --link-dest is relative to the destination directory
+    result = await pod.sync_folder_async(
+        files_from=files_from,
+        dest=staging,
+        link_dest=f"../{latest}" if latest else None,
+    )
+    async with POOL.connection(pod.data.sshaddr) as conn:
+        # if the other upload got there first, its version is as good as ours
+        await conn.run(
+            f"{{ mv -T {staging} {version} 2>/dev/null || "
+            f"{{ [ -d {version} ] && rm -rf {staging}; }}; }} "
+            f"&& touch {version} && cd {versions} "
+            f"&& ls -1t | grep -v '\\.partial$' | tail -n +{KEEP_VERSIONS + 1} "
+            "| xargs -r rm -rf "
+            f"&& find . -maxdepth 1 -name '*.partial' -mmin +{STALE_UPLOAD_MINUTES} "
+            "-exec rm -rf {} +",
+            check=True,
+        )
+    print(
+        f"uploaded version {manifest.digest[:12]} to the volume via "
+        f"{pod.data.name}: {result.bytes_sent} bytes in "
+        f"{time.monotonic() - start:.1f}s"
+    )
+    return version
+
+
+async def copy_from_volume(pod: "Pod", version: str, remote_name: str) -> RsyncResult:
+    """Copy a version from the volume into ``pod``'s project folder."""
+    project = f"{pod.data.sshaddr.homedir}/{remote_name}"
+    start = time.monotonic()
+    async with POOL.connection(pod.data.sshaddr) as conn:
+        r = await conn.run(
+            f"mkdir -p {shlex.quote(project)} && "
+            f"rsync -a --stats {version}/ {shlex.quote(project)}/"
+        )
+    if r.exit_status != 0:
+        raise RsyncError(f"copy from volume failed: {str(r.stderr).strip()}")
+    return RsyncResult.from_stats(str(r.stdout), time.monotonic() - start)
@@ -0,0 +1,217 @@
+"""Watch mode: push local edits to pods as they happen.
+
+The project folder is watched with inotify (through ctypes, so there is no
+extra dependency), falling back to polling file mtimes where inotify is not
+available.  Bursts of changes are debounced into one batch, filtered through
+the sync rules, and only the changed files are rsynced to every pod in
+parallel.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from ezpod.runproject import RunFolder
+from ezpod.sync import RsyncResult, SyncEngine
+from ezpod.syncplan import RULE_FILES, SyncPlan, SyncRules
+
+if TYPE_CHECKING:
+    from ezpod.pod import Pod
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct("iIII")
+
+# Changed paths; None stands for "changes were lost, resync everything".
+Changes = asyncio.Queue[Optional[str]]
+
+
+class InotifyWatcher:
+    def __init__(self, root: Path, rules: SyncRules, changes: Changes):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self.rules = rules
+        self.changes = changes
+        self._dirs: dict[int, str] = {}
+
+    def _add_watch(self, reldir: str):
+        path = str(self.root / reldir).encode()
+        wd = self._libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd >= 0:
+            self._dirs[wd] = reldir
+
+    def add_tree(self, reldir: str = "") -> list[str]:
+        """Watch ``reldir`` and its subdirectories, returning the files in it."""
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self.root / reldir):
+            rel = os.path.relpath(dirpath, self.root)
+            rel = "" if rel == "." else rel
+            prefix = f"{rel}/" if rel else ""
+            self._add_watch(rel)
+            dirnames[:] = [
+                d for d in dirnames if not self.rules.ignored(prefix + d, is_dir=True)
+            ]
+            files += [prefix + name for name in filenames]
+        return files
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0").decode()
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.changes.put_nowait(None)
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            reldir = self._dirs.get(wd)
+            if reldir is None:
+                continue
+            relpath = f"{reldir}/{name}" if reldir else name
+            if not mask & IN_ISDIR:
+                self.changes.put_nowait(relpath)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                if not self.rules.excluded(relpath, is_dir=True):
+                    for path in self.add_tree(relpath):
+                        self.changes.put_nowait(path)
+
+    def start(self):
+        self.add_tree()
+        asyncio.get_running_loop().add_reader(self.fd, self._on_readable)
+
+    def close(self):
+        asyncio.get_running_loop().remove_reader(self.fd)
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    def __init__(self, folder: RunFolder, changes: Changes, interval: float):
+        self.folder = folder
+        self.changes = changes
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def _snapshot(self) -> dict[str, tuple[int, int]]:
+        snapshot = {}
+        for relpath in SyncPlan.compile(self.folder).files:
+            try:
+                st = (self.folder.local / relpath).stat()
+            except FileNotFoundError:
+                continue
+            snapshot[relpath] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    async def _poll(self):
+        last = await asyncio.to_thread(self._snapshot)
+        while True:
+            await asyncio.sleep(self.interval)
+            current = await asyncio.to_thread(self._snapshot)
+            for relpath, stat in current.items():
+                if last.get(relpath) != stat:
+                    self.changes.put_nowait(relpath)
+            last = current
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._poll())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+async def _next_batch(changes: Changes, debounce: float) -> set[Optional[str]]:
+    """Wait for a change, then collect changes until none arrive for
+    ``debounce`` seconds."""
+    batch = {await changes.get()}
+    while True:
+        try:
+            batch.add(await asyncio.wait_for(changes.get(), debounce))
+        except asyncio.TimeoutError:
+            return batch
+
+
+async def watch(
+    pods: list["Pod"],
+    folder: RunFolder,
+    debounce: float = float(os.environ.get("EZPOD_WATCH_DEBOUNCE", 0.3)),
+    poll_interval: float = float(os.environ.get("EZPOD_WATCH_POLL_INTERVAL", 1.0)),
+):
+    """Push changes in ``folder`` to ``pods`` until cancelled."""
+    root = folder.local
+    rules = SyncRules(root)
+    changes: Changes = asyncio.Queue()
+    try:
+        watcher: InotifyWatcher | PollingWatcher = InotifyWatcher(root, rules, changes)
+        how = "inotify"
+    except OSError as e:
+        print(f"inotify unavailable ({e}), polling every {poll_interval}s")
+        watcher = PollingWatcher(folder, changes, poll_interval)
+        how = "polling"
+    watcher.start()
+    print(f"watching {root} ({how}) for {len(pods)} pods, Ctrl-C to stop")
+    engine = SyncEngine(retries=1, backoff=1)
+    # A watched push leaves the pods in a state no manifest describes, so the
+    # next full sync must not skip them.
+    await asyncio.gather(*(pod.forget_synced_async() for pod in pods))
+    try:
+        with tempfile.TemporaryDirectory(prefix="ezpod_watch_") as lists_dir:
+            while True:
+                batch = await _next_batch(changes, debounce)
+                if None in batch or any(
+                    Path(p).name in RULE_FILES for p in batch if p is not None
+                ):
+                    # lost events or changed rules: send the whole plan
+                    rules = SyncRules(root)
+                    if isinstance(watcher, InotifyWatcher):
+                        watcher.rules = rules
+                    files = SyncPlan.compile(folder).files
+                else:
+                    files = sorted(
+                        p
+                        for p in batch
+                        if p is not None
+                        and (root / p).is_file()
+                        and not rules.excluded(p, is_dir=False)
+                    )
+                if not files:
+                    continue
+                files_from = Path(lists_dir) / "changed.files"
+                files_from.write_text("".join(f"{f}\n" for f in files))
+                more = ", ..." if len(files) > 5 else ""
+                print(f"pushing {len(files)} files: {', '.join(files[:5])}{more}")
+
+                async def push(pod: "Pod") -> RsyncResult:
+                    return await pod.sync_folder_async(files_from=str(files_from))
+
+                await engine.run(pods, push, name=lambda pod: pod.data.name)
+    finally:
+        watcher.close()
@@ -0,0 +1,102 @@
+"""Startup benchmark for the lightweight CLI commands.
+
+Runs ``ezpod profiles``, ``setprofile`` and ``login`` in fresh interpreters
+and fails if any of them imports one of the heavy dependencies (see
+``ezpod.__main__``) or takes more than ``EZPOD_IMPORTTIME_FACTOR`` times as
+long as a bare ``python -c pass`` on the same machine, printing the slowest
+imports from ``python -X importtime``::
+
+    EZPOD_IMPORTTIME_FACTOR=10 EZPOD_IMPORTTIME_RUNS=5 pytest -s tests/test_importtime.py
+
+The budget is relative so that slow or busy machines don't fail it; which
+modules get imported is checked exactly.  The commands run against a
+temporary profiles directory, so they don't touch the real account/profile
+selection.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+FACTOR = float(os.environ.get("EZPOD_IMPORTTIME_FACTOR", 10))
+RUNS = int(os.environ.get("EZPOD_IMPORTTIME_RUNS", 5))
+COMMANDS = [["profiles"], ["setprofile", "bench"], ["login", "bench"]]
+HEAVY_MODULES = {"asyncssh", "boto3", "botocore", "pydantic", "pyinfra"}
+
+
+def _best_ms(cmd: list[str], env: dict[str, str], runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, capture_output=True, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+
+def _run(args: list[str], env: dict[str, str], importtime=False):
+    flags = ["-X", "importtime"] if importtime else []
+    return subprocess.run(
+        [sys.executable, *flags, "-m", "ezpod", *args],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def _imports(stderr: str) -> list[tuple[int, str]]:
+    """(cumulative us, module) for every import in ``-X importtime`` output."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imports.append((int(cumulative), name.strip()))
+    return imports
+
+
+def bench(factor: float = FACTOR, runs: int = RUNS) -> bool:
+    ok = True
+    with tempfile.TemporaryDirectory() as profiles:
+        env = dict(os.environ, EZPOD_PROFILES_PATH=profiles)
+        baseline = _best_ms([sys.executable, "-c", "pass"], env, runs)
+        budget_ms = baseline * factor
+        print(f"python -c pass: {baseline:.0f}ms, budget {budget_ms:.0f}ms")
+        for args in COMMANDS:
+            name = " ".join(args)
+            best = _best_ms([sys.executable, "-m", "ezpod", *args], env, runs)
+            imports = _imports(_run(args, env, importtime=True).stderr)
+            heavy = sorted({m for _, m in imports if m in HEAVY_MODULES})
+            passed = best <= budget_ms and not heavy
+            ok &= passed
+            print(f"{'ok  ' if passed else 'FAIL'} ezpod {name}: {best:.0f}ms")
+            if heavy:
+                print(f"     imports heavy modules: {', '.join(heavy)}")
+            if not passed:
+                for cumulative, module in sorted(imports, reverse=True)[:10]:
+                    print(f"     {cumulative / 1000:7.1f}ms  {module}")
+    # the commands ran with this process as their "shell"
+    shell_state = Path(tempfile.gettempdir()) / "ezpod_shell_states"
+    shutil.rmtree(shell_state / f"shell_{os.getpid()}", ignore_errors=True)
+    return ok
+
+
+def test_cli_imports_no_heavy_modules():
+    code = (
+        "import sys, ezpod.__main__; "
+        f"print(' '.join(sorted(set({sorted(HEAVY_MODULES)!r}) & sys.modules.keys())))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    assert out.split() == []
+
+
+def test_light_commands_start_fast():
+    assert bench(), "a lightweight command is over budget, see the output above"
@@ -0,0 +1,114 @@
+"""Checks the sync plan's gitignore handling against git itself.
+
+Each case builds a small repository, compiles its sync plan and compares the
+file list with ``git ls-files --others --exclude-standard -c``, i.e. the files
+git would not ignore.
+"""
+
+from __future__ import annotations
+
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from ezpod.runproject import RunFolder
+from ezpod.syncplan import SyncPlan
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+
+CASES = {
+    "negation": {
+        ".gitignore": "*.log\n!keep.log\n",
+        "a.log": "",
+        "keep.log": "",
+        "sub/b.log": "",
+        "sub/keep.log": "",
+        "main.py": "",
+    },
+    "anchored": {
+        ".gitignore": "/build\ndocs/*.tmp\n/top.txt\n",
+        "build/out.o": "",
+        "src/build/out.o": "",
+        "docs/a.tmp": "",
+        "docs/deeper/b.tmp": "",
+        "src/docs/c.tmp": "",
+        "top.txt": "",
+        "src/top.txt": "",
+    },
+    "dir_only": {
+        ".gitignore": "cache/\nvenv/\n",
+        "cache/x.bin": "",
+        "src/cache/y.bin": "",
+        "lib/cache": "a file, not a directory",
+        "venv": "also a file",
+        "keep.py": "",
+    },
+    "nested": {
+        ".gitignore": "*.dat\n*.bak\nout/\n",
+        "a.dat": "",
+        "a.bak": "",
+        "sub/.gitignore": "!important.dat\n*.txt\n/local/\n",
+        "sub/x.dat": "",
+        "sub/important.dat": "",
+        "sub/notes.txt": "",
+        "sub/local/y.py": "",
+        "sub/deeper/local/z.py": "",
+        "sub/deeper/important.dat": "",
+        "sub/deeper/.gitignore": "!*.bak\n",
+        "sub/deeper/w.bak": "",
+        "notes.txt": "",
+        "out/o.py": "",
+    },
+    "excluded_parent": {
+        # a file can't be re-included once its directory is excluded
+        ".gitignore": "logs/\n!logs/keep.txt\ntmp/*\n!tmp/keep.txt\n",
+        "logs/keep.txt": "",
+        "logs/other.txt": "",
+        "tmp/keep.txt": "",
+        "tmp/other.txt": "",
+    },
+    "globs": {
+        ".gitignore": "**/gen/*.py\na/**/z.txt\n*.py[co]\n\\#literal\nspace\\ \nfile?.txt\n",
+        "gen/g.py": "",
+        "x/y/gen/g.py": "",
+        "a/z.txt": "",
+        "a/b/c/z.txt": "",
+        "b/z.txt": "",
+        "m.pyc": "",
+        "m.pyo": "",
+        "m.py": "",
+        "#literal": "",
+        "space ": "",
+        "space": "",
+        "file1.txt": "",
+        "file10.txt": "",
+    },
+}
+
+
+def _make_tree(root: Path, files: dict[str, str]):
+    subprocess.run(["git", "init", "-q", str(root)], check=True)
+    for relpath, content in files.items():
+        path = root / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def _git_files(root: Path) -> list[str]:
+    out = subprocess.run(
+        ["git", "ls-files", "--others", "--exclude-standard", "-c", "-z"],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return sorted(f for f in out.split("\0") if f)
+
+
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_plan_matches_git(case: str, tmp_path: Path):
+    _make_tree(tmp_path, CASES[case])
+    plan = SyncPlan.compile(RunFolder(local_path=str(tmp_path)))
+    assert sorted(plan.files) == _git_files(tmp_path)